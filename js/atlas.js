@@ -0,0 +1,66 @@
+/**
+ * Sprite Atlases for Assemblage
+ *
+ * Loads the WebP sprite sheets built by scripts/sprite_atlas.py and cuts them
+ * into one canvas per image, so the mosaic and tiling generators get their
+ * fragments from a handful of requests instead of one per image. Images
+ * added since the atlas was built are returned as missing, for the caller
+ * to load individually.
+ */
+
+export const ATLAS_TILE_SIZE = 256;
+
+function loadSheet(url) {
+    return new Promise((resolve, reject) => {
+        const image = new Image();
+        image.onload = () => resolve(image);
+        image.onerror = () => reject(new Error(`Failed to load atlas sheet: ${url}`));
+        image.src = url;
+    });
+}
+
+/**
+ * Canvases cut from the atlas for each metadata entry it contains.
+ * @param {Array<Object>} metadata - metadata entries (id, features, ...)
+ * @param {number} tileSize - atlas tile size (longest side of each tile)
+ * @param {string} baseUrl - prefix for asset URLs ('.' or e.g. '/assemblage')
+ * @returns {Promise<{images: Array<HTMLCanvasElement>, missing: Array<Object>}>}
+ */
+export async function loadAtlasImages(metadata, tileSize = ATLAS_TILE_SIZE, baseUrl = '.') {
+    const directory = `${baseUrl}/images/atlases/${tileSize}`;
+    let manifest, sheets;
+    try {
+        const response = await fetch(`${directory}/atlas.json`, { cache: 'no-cache' });
+        if (!response.ok) {
+            return { images: [], missing: metadata };
+        }
+        manifest = await response.json();
+        sheets = await Promise.all(manifest.sheets.map(sheet => sheet.file ? loadSheet(`${directory}/${sheet.file}`) : null));
+    } catch (error) {
+        console.warn('Sprite atlas unavailable, loading images individually:', error);
+        return { images: [], missing: metadata };
+    }
+
+    const images = [];
+    const missing = [];
+    for (const entry of metadata) {
+        const rect = manifest.images[entry.id];
+        if (!rect) {
+            missing.push(entry);
+            continue;
+        }
+        const [sheet, x, y, width, height] = rect;
+        const canvas = document.createElement('canvas');
+        canvas.width = width;
+        canvas.height = height;
+        canvas.getContext('2d').drawImage(sheets[sheet], x, y, width, height, 0, 0, width, height);
+        // Stand in for a loaded <img>: the generators check these before drawing
+        canvas.complete = true;
+        canvas.naturalWidth = width;
+        canvas.naturalHeight = height;
+        canvas.features = entry.features || null;
+        images.push(canvas);
+    }
+    console.log(`Loaded ${images.length} images from ${sheets.filter(Boolean).length} atlas sheet(s)`);
+    return { images, missing };
+}
@@ -6,13 +6,20 @@
 
 import CollageGenerator from './collageGenerator.js';
 import LegacyCollageAdapter from './legacyCollageAdapter.js';
+import { derivativeUrl } from '../derivatives.js';
+import { loadAtlasImages, ATLAS_TILE_SIZE } from '../atlas.js';
+
+// Fragments are drawn well below the stored 800px, so load the 512px rendition
+const FRAGMENT_IMAGE_SIZE = 512;
 
 class CollageApp {
     constructor() {
         this.canvas = document.getElementById('collageCanvas');
         this.generator = new CollageGenerator(this.canvas);
         this.legacyAdapter = new LegacyCollageAdapter(this.generator);
+        this.metadata = [];
         this.imageCollection = [];
+        this.tileImages = [];
         this.currentEffect = null;
         
         this.initializeUI();
@@ -67,34 +74,55 @@ class CollageApp {
     async loadImageCollection() {
         try {
             const response = await fetch('images/metadata.json');
-            const metadata = await response.json();
-            
-            // Load all images
-            this.imageCollection = await Promise.all(
-                metadata.map(async (img) => {
-                    const image = new Image();
-                    image.src = `images/collages/${img.id}.jpg`;
-                    await new Promise((resolve, reject) => {
-                        image.onload = resolve;
-                        image.onerror = () => {
-                            console.warn(`Failed to load image: ${img.id}`);
-                            resolve(null); // Resolve with null instead of rejecting
-                        };
-                    });
-                    return image;
-                })
-            );
-            
-            // Filter out any failed image loads
-            this.imageCollection = this.imageCollection.filter(img => img !== null);
+            this.metadata = await response.json();
             
-            console.log(`Loaded ${this.imageCollection.length} images`);
-            this.generator.images = this.imageCollection;
+            // Mosaic and tiling fragments come from the sprite sheets; anything
+            // not in them yet (or everything, without an atlas) loads on its own
+            const atlas = await loadAtlasImages(this.metadata, ATLAS_TILE_SIZE, '.');
+            const individual = await this.loadImages(atlas.missing);
+            this.tileImages = atlas.images.concat(individual);
+            if (atlas.images.length === 0) {
+                this.setImageCollection(individual);
+            }
         } catch (error) {
             console.error('Error loading images:', error);
         }
     }
     
+    async loadImages(metadata) {
+        const images = await Promise.all(
+            metadata.map(async (img) => {
+                const image = new Image();
+                image.features = img.features || null;
+                image.src = derivativeUrl(img, FRAGMENT_IMAGE_SIZE, '.');
+                const loaded = await new Promise((resolve) => {
+                    image.onload = () => resolve(true);
+                    image.onerror = () => {
+                        console.warn(`Failed to load image: ${img.id}`);
+                        resolve(false); // Skip it instead of rejecting
+                    };
+                });
+                return loaded ? image : null;
+            })
+        );
+        
+        // Filter out any failed image loads
+        return images.filter(img => img !== null);
+    }
+    
+    setImageCollection(images) {
+        this.imageCollection = images;
+        console.log(`Loaded ${this.imageCollection.length} images`);
+        this.generator.images = this.imageCollection;
+    }
+    
+    // The other effects draw fragments larger than atlas tiles, so load those images on first use
+    async ensureImageCollection() {
+        if (this.imageCollection.length === 0) {
+            this.setImageCollection(await this.loadImages(this.metadata));
+        }
+    }
+    
     setEffect(effect) {
         this.currentEffect = effect;
         this.generator.currentEffect = effect;
@@ -157,7 +185,7 @@ class CollageApp {
         }
     }
     
-    generate() {
+    async generate() {
         if (!this.currentEffect) {
             alert('Please select an effect first');
             return;
@@ -170,6 +198,7 @@ class CollageApp {
         try {
             // Use legacy styles for mosaic and tiling effects
             if (this.currentEffect === 'mosaic' || this.currentEffect === 'tiling') {
+                this.legacyAdapter.legacyStyles.images = this.tileImages;
                 this.legacyAdapter.generate(
                     this.currentEffect,
                     this.generator.parameters,
@@ -177,7 +206,8 @@ class CollageApp {
                 );
             } else {
                 // Pass the current effect to the generator for non-legacy effects
-                this.generator.generate(this.generator.images, null, this.currentEffect);
+                await this.ensureImageCollection();
+                await this.generator.generate(this.generator.images, null, this.currentEffect);
             }
             generateButton.textContent = 'Generate';
         } catch (error) {
@@ -11,6 +11,7 @@ import { SlicedCollageGenerator } from './slicedCollageGenerator.js';
 import { NarrativeCompositionManager } from './narrativeCompositionManager.js';
 import { SafeCrystalFormationGenerator } from './crystalFormationGenerator.js';
 import IsolatedCrystalGenerator from './isolatedCrystalGenerator.js';
+import { focusCrop } from '../imageFeatures.js';
 
 class CollageGenerator {
     constructor(canvas) {
@@ -370,18 +371,15 @@ class CollageGenerator {
                         cropY = (image.height - cropHeight) / 2;
                     }
                 } else {
-                    // Standard crop to fill
+                    // Standard crop to fill, keeping the image's focus in view
                     if (srcRatio > destRatio) {
                         cropWidth = image.width;
                         cropHeight = cropWidth / destRatio;
-                        cropX = 0;
-                        cropY = (image.height - cropHeight) / 2;
                     } else {
                         cropHeight = image.height;
                         cropWidth = cropHeight * destRatio;
-                        cropX = (image.width - cropWidth) / 2;
-                        cropY = 0;
                     }
+                    ({ cropX, cropY } = focusCrop(image, cropWidth, cropHeight));
                 }
                 
                 // Draw the cropped portion with pixel-perfect coordinates
@@ -2,6 +2,8 @@
  * MosaicGenerator class for creating mosaic-style collages
  * This class handles the generation of mosaic-style collages with various composition styles
  */
+import { focusCrop } from '../imageFeatures.js';
+
 class MosaicGenerator {
     /**
      * Create a new MosaicGenerator
@@ -318,20 +320,17 @@ class MosaicGenerator {
                     cropY = Math.random() * maxCropY;
                 }
             } else {
-                // Standard cropping to fit the tile
+                // Standard cropping to fit the tile, keeping the image's focus in view
                 if (srcRatio > destRatio) {
                     // Image is wider than destination - crop width to match aspect ratio
                     cropHeight = image.height;
                     cropWidth = cropHeight * destRatio;
-                    cropX = (image.width - cropWidth) / 2;
-                    cropY = 0;
                 } else {
                     // Image is taller than destination - crop height to match aspect ratio
                     cropWidth = image.width;
                     cropHeight = cropWidth / destRatio;
-                    cropX = 0;
-                    cropY = (image.height - cropHeight) / 2;
                 }
+                ({ cropX, cropY } = focusCrop(image, cropWidth, cropHeight));
             }
             
             this.ctx.drawImage(
@@ -4,8 +4,12 @@
  * Handles loading and managing the image collection
  */
 
+import { derivativeSources } from './derivatives.js';
+
 let imageCollection = [];
 let lastCheckTime = 0;
+let metadataVersion = null; // Store version of the loaded metadata (only served by the Flask server)
+let metadataEventsUrl = null; // Event stream server advertised alongside metadata.json, if any
 const CHECK_INTERVAL = 5000; // Check for new images every 5 seconds
 
 // Helper function to get the base URL for assets
@@ -17,6 +21,37 @@ function getBaseUrl() {
     return '';
 }
 
+// Transform a metadata entry into image collection format
+function toCollectionItem(img, baseUrl) {
+    return {
+        id: img.id,
+        originalFilename: img.source_file || img.src,
+        src: img.path ? `${baseUrl}/${img.path}` : `${baseUrl}/images/collages/${img.src}`,
+        // Smaller renditions (thumb/small/medium/full) for drawing below full size
+        sources: derivativeSources(img, baseUrl),
+        // Brightness, contrast, saliency, focus and crop box computed at ingest
+        features: img.features || null,
+        tags: img.tags || [],
+        description: img.description || "",
+        originalFormat: "JPEG",
+        processedFormat: "JPEG",
+        quality: 90,
+        dimensions: {
+            width: 450,
+            height: 600
+        },
+        originalDimensions: {
+            width: 3024,
+            height: 4032
+        }
+    };
+}
+
+function readMetadataVersion(response) {
+    const version = response.headers.get('X-Metadata-Version');
+    return version === null ? null : parseInt(version, 10);
+}
+
 export async function loadImageCollection() {
     try {
         const baseUrl = getBaseUrl();
@@ -24,27 +59,12 @@ export async function loadImageCollection() {
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
+        metadataVersion = readMetadataVersion(response);
+        metadataEventsUrl = response.headers.get('X-Metadata-Events');
         const metadata = await response.json();
         
         // Transform metadata into image collection format
-        imageCollection = metadata.map(img => ({
-            id: img.id,
-            originalFilename: img.source_file || img.src,
-            src: img.path ? `${baseUrl}/${img.path}` : `${baseUrl}/images/collages/${img.src}`,
-            tags: img.tags || [],
-            description: img.description || "",
-            originalFormat: "JPEG",
-            processedFormat: "JPEG",
-            quality: 90,
-            dimensions: {
-                width: 450,
-                height: 600
-            },
-            originalDimensions: {
-                width: 3024,
-                height: 4032
-            }
-        }));
+        imageCollection = metadata.map(img => toCollectionItem(img, baseUrl));
         
         console.log('Loaded image paths:', imageCollection.map(img => ({ id: img.id, src: img.src })).slice(0, 5), '...');
         
@@ -56,6 +76,133 @@ export async function loadImageCollection() {
     }
 }
 
+/**
+ * Fetch matching images from the image processor's query API (/api/images),
+ * following pagination cursors. Only the requested fields are transferred,
+ * e.g. queryImages({ tags: ['vintage'], fields: ['id', 'src', 'tags'], limit: 40 }).
+ * @param {Object} options - tags (array), match ('all' or 'any'), fields (array), limit (max images)
+ * @returns {Promise<Array>} metadata entries with just the requested fields
+ */
+export async function queryImages({ tags = [], match = 'all', fields = ['id', 'src', 'tags'], limit = Infinity } = {}) {
+    const baseUrl = getBaseUrl();
+    const images = [];
+    let cursor = null;
+    do {
+        const params = new URLSearchParams({ match, limit: String(Math.min(limit - images.length, 1000)) });
+        if (tags.length) params.set('tags', tags.join(','));
+        if (fields.length) params.set('fields', fields.join(','));
+        if (cursor) params.set('cursor', cursor);
+        
+        const response = await fetch(`${baseUrl}/api/images?${params}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const page = await response.json();
+        images.push(...page.images);
+        cursor = page.next_cursor;
+    } while (cursor && images.length < limit);
+    return images;
+}
+
+/**
+ * Draw random images matching a tag expression on the image processor (/api/sample),
+ * e.g. sampleImages('vintage & (portrait | face) & !color', 12, { weight: 'relevance' }).
+ * @param {string} expression - tags combined with & (or ,), | and !, grouped with parentheses
+ * @param {number} count - images to draw
+ * @param {Object} options - weight ('uniform' or 'relevance'), fields (array), exclude (ids), seed
+ * @returns {Promise<Array>} metadata entries with just the requested fields
+ */
+export async function sampleImages(expression, count, { weight = 'uniform', fields = ['id', 'src', 'tags'], exclude = [], seed = null } = {}) {
+    const params = new URLSearchParams({ n: String(count), weight });
+    if (expression) params.set('q', expression);
+    if (fields.length) params.set('fields', fields.join(','));
+    if (exclude.length) params.set('exclude', exclude.join(','));
+    if (seed !== null) params.set('seed', String(seed));
+    
+    const response = await fetch(`${getBaseUrl()}/api/sample?${params}`);
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    return (await response.json()).images;
+}
+
+/**
+ * Apply /metadata/changes since metadataVersion to the collection.
+ * Returns false if the server asks for (or needs) a full reload instead.
+ */
+async function applyMetadataChanges(baseUrl) {
+    const response = await fetch(`${baseUrl}/metadata/changes?since=${metadataVersion}`);
+    if (!response.ok) {
+        return false;
+    }
+    const delta = await response.json();
+    if (delta.reset) {
+        return false;
+    }
+    
+    if (delta.changes.length > 0) {
+        const added = applyChanges(delta.changes, baseUrl);
+        console.log('Applied', delta.changes.length, 'metadata changes (' + added + ' new images)');
+    }
+    metadataVersion = delta.version;
+    return true;
+}
+
+/**
+ * Add, replace or drop entries in the collection.
+ * @param {Array} changes - {op: 'add'|'put', entry} or {op: 'remove', id}
+ * @returns {number} how many images were new
+ */
+function applyChanges(changes, baseUrl) {
+    const collection = new Map(imageCollection.map(img => [img.id, img]));
+    let added = 0;
+    changes.forEach(change => {
+        if (change.op === 'remove') {
+            collection.delete(change.id);
+        } else {
+            added += collection.has(change.entry.id) ? 0 : 1;
+            collection.set(change.entry.id, toCollectionItem(change.entry, baseUrl));
+        }
+    });
+    imageCollection = [...collection.values()];
+    return added;
+}
+
+/**
+ * Receive metadata changes pushed by the image processor (/metadata/events,
+ * from its event stream server when metadata.json names one).
+ * Falls back to polling if the stream is unavailable (e.g. static hosting).
+ */
+function subscribeToMetadataEvents() {
+    const baseUrl = getBaseUrl();
+    const eventsUrl = metadataEventsUrl || `${baseUrl}/metadata/events`;
+    const source = new EventSource(`${eventsUrl}?since=${metadataVersion}`);
+    
+    const handle = (name, apply) => source.addEventListener(name, event => {
+        apply(JSON.parse(event.data));
+        // Only the last event of a batch carries the version
+        if (event.lastEventId) {
+            metadataVersion = parseInt(event.lastEventId, 10);
+        }
+    });
+    handle('version', () => {});
+    handle('added', entry => {
+        applyChanges([{ op: 'add', entry }], baseUrl);
+        console.log('New image', entry.id);
+    });
+    handle('updated', entry => applyChanges([{ op: 'put', entry }], baseUrl));
+    handle('removed', data => applyChanges([{ op: 'remove', id: data.id }], baseUrl));
+    handle('reset', () => loadImageCollection());
+    
+    source.onerror = () => {
+        // EventSource reconnects on its own unless the server refused the stream
+        if (source.readyState === EventSource.CLOSED) {
+            console.warn('Metadata event stream unavailable, polling for new images instead');
+            setInterval(checkForNewImages, CHECK_INTERVAL);
+        }
+    };
+}
+
 export async function checkForNewImages() {
     const currentTime = Date.now();
     if (currentTime - lastCheckTime < CHECK_INTERVAL) {
@@ -65,10 +212,18 @@ export async function checkForNewImages() {
 
     try {
         const baseUrl = getBaseUrl();
-        const response = await fetch(`${baseUrl}/images/metadata.json`);
+        
+        // Ask the server only for what changed since the version we hold
+        if (metadataVersion !== null && await applyMetadataChanges(baseUrl)) {
+            return;
+        }
+        
+        // Full reload; the server answers 304 (via the ETag) while nothing changed
+        const response = await fetch(`${baseUrl}/images/metadata.json`, { cache: 'no-cache' });
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
+        metadataVersion = readMetadataVersion(response);
         const metadata = await response.json();
         
         // Get current image IDs
@@ -80,28 +235,8 @@ export async function checkForNewImages() {
         if (newImages.length > 0) {
             console.log('Found', newImages.length, 'new images');
             
-            // Transform new images into collection format
-            const newCollectionItems = newImages.map(img => ({
-                id: img.id,
-                originalFilename: img.source_file || img.src,
-                src: `${baseUrl}/images/collages/${img.src}`,
-                tags: img.tags || [],
-                description: img.description || "",
-                originalFormat: "JPEG",
-                processedFormat: "JPEG",
-                quality: 90,
-                dimensions: {
-                    width: 450,
-                    height: 600
-                },
-                originalDimensions: {
-                    width: 3024,
-                    height: 4032
-                }
-            }));
-            
             // Add new images to collection
-            imageCollection = [...imageCollection, ...newCollectionItems];
+            imageCollection = [...imageCollection, ...newImages.map(img => toCollectionItem(img, baseUrl))];
             
             // No need to call displayImages() as it doesn't exist in the current implementation
         }
@@ -113,8 +248,13 @@ export async function checkForNewImages() {
 // Initialize the image collection
 loadImageCollection().then(collection => {
     console.log('Image collection initialized with', collection.length, 'images');
-    // Start periodic check for new images
-    setInterval(checkForNewImages, CHECK_INTERVAL);
+    // Get new images pushed by the image processor, or check periodically if
+    // this is a static server (no metadata version) or the browser lacks EventSource
+    if (metadataVersion !== null && typeof EventSource !== 'undefined') {
+        subscribeToMetadataEvents();
+    } else {
+        setInterval(checkForNewImages, CHECK_INTERVAL);
+    }
     // No need to call displayImages() as it doesn't exist in the current implementation
 });
 
@@ -0,0 +1,69 @@
+/**
+ * Image Derivatives for Assemblage
+ *
+ * Picks the smallest pre-generated rendition (thumb/small/medium/full, see
+ * scripts/derivatives.py) that covers the size an image will be drawn at,
+ * preferring WebP. Entries without derivatives fall back to the full JPEG.
+ */
+
+// Smallest to largest
+export const DERIVATIVE_LEVELS = ['thumb', 'small', 'medium', 'full'];
+
+let webpSupported = null;
+
+function supportsWebP() {
+    if (webpSupported === null) {
+        try {
+            const canvas = document.createElement('canvas');
+            canvas.width = canvas.height = 1;
+            webpSupported = canvas.toDataURL('image/webp').startsWith('data:image/webp');
+        } catch (error) {
+            webpSupported = false;
+        }
+    }
+    return webpSupported;
+}
+
+function fullImageUrl(img, baseUrl) {
+    return img.path ? `${baseUrl}/${img.path}` : `${baseUrl}/images/collages/${img.src}`;
+}
+
+/**
+ * URL of the smallest rendition whose longer side is at least maxDimension pixels.
+ * @param {Object} img - metadata entry (id, src, path, derivatives)
+ * @param {number} maxDimension - longest side the image will be drawn at, in device pixels
+ * @param {string} baseUrl - prefix for asset URLs ('' or e.g. '/assemblage')
+ */
+export function derivativeUrl(img, maxDimension, baseUrl = '') {
+    const derivatives = img.derivatives;
+    if (!derivatives || !derivatives.sizes) {
+        return fullImageUrl(img, baseUrl);
+    }
+
+    const level = DERIVATIVE_LEVELS.find(name => {
+        const size = derivatives.sizes[name];
+        return size && Math.max(size[0], size[1]) >= maxDimension;
+    }) || 'full';
+
+    const formats = derivatives.formats || ['jpg'];
+    const ext = formats.includes('webp') && supportsWebP() ? 'webp' : 'jpg';
+    if (level === 'full' && ext === 'jpg') {
+        return fullImageUrl(img, baseUrl);
+    }
+    return `${baseUrl}/images/derivatives/${level}/${img.id}.${ext}`;
+}
+
+/**
+ * URLs for every level, e.g. { thumb: ..., small: ..., medium: ..., full: ... }.
+ */
+export function derivativeSources(img, baseUrl = '') {
+    const sources = {};
+    const sizes = (img.derivatives && img.derivatives.sizes) || {};
+    DERIVATIVE_LEVELS.forEach(name => {
+        const size = sizes[name];
+        sources[name] = size
+            ? derivativeUrl(img, Math.max(size[0], size[1]), baseUrl)
+            : fullImageUrl(img, baseUrl);
+    });
+    return sources;
+}
@@ -0,0 +1,38 @@
+/**
+ * Image Features for Assemblage
+ *
+ * Reads the visual features computed for each image at ingest (brightness,
+ * contrast, saliency, focus and crop box; see scripts/image_features.py), so
+ * generators can crop and place fragments by what is in them without
+ * analysing pixels in the browser. Images loaded from the collection carry
+ * them as image.features; everything here falls back to the image centre
+ * when they are missing.
+ */
+
+function clamp(value, min, max) {
+    return Math.max(min, Math.min(max, value));
+}
+
+/**
+ * Centre of interest of an image in its own pixels, e.g. { x: 212, y: 180 }.
+ * @param {HTMLImageElement} image - loaded image, optionally with .features
+ */
+export function focusPoint(image) {
+    const focus = (image.features && image.features.focus) || [0.5, 0.5];
+    return { x: focus[0] * image.width, y: focus[1] * image.height };
+}
+
+/**
+ * Top-left corner of a cropWidth x cropHeight source rectangle centred on the
+ * image's focus, kept inside the image.
+ * @param {HTMLImageElement} image - loaded image, optionally with .features
+ * @param {number} cropWidth - source rectangle width, in image pixels
+ * @param {number} cropHeight - source rectangle height, in image pixels
+ */
+export function focusCrop(image, cropWidth, cropHeight) {
+    const focus = focusPoint(image);
+    return {
+        cropX: clamp(focus.x - cropWidth / 2, 0, Math.max(0, image.width - cropWidth)),
+        cropY: clamp(focus.y - cropHeight / 2, 0, Math.max(0, image.height - cropHeight))
+    };
+}
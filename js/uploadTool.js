@@ -17,6 +17,8 @@ document.addEventListener('DOMContentLoaded', () => {
     // State variables
     let uploadedFiles = [];
     let isProcessing = false;
+    const JOB_POLL_INTERVAL = 1000; // Poll queued upload jobs every second
+    const JOB_POLL_MAX_ERRORS = 30; // Give up on a job after this many failed polls in a row
     
     // Initialize event listeners
     initEventListeners();
@@ -162,12 +164,25 @@ document.addEventListener('DOMContentLoaded', () => {
             
             const result = await response.json();
             
-            if (result.success) {
-                showStatus(`Successfully processed and added ${result.images.length} images!`, 'success');
-                resetForm();
-            } else {
+            if (!result.success) {
                 throw new Error(result.message || 'Failed to process images');
             }
+            
+            // Files are processed in the background; follow the queued jobs
+            const jobs = await waitForJobs(result.jobs);
+            const added = jobs.filter(job => job.status === 'done');
+            const failed = jobs.filter(job => job.status === 'failed');
+            
+            if (added.length === 0 && failed.length > 0) {
+                throw new Error(failed.map(job => job.error).join('\n'));
+            }
+            
+            let message = `Successfully processed and added ${added.length} images!`;
+            if (failed.length > 0) {
+                message += ` ${failed.length} skipped: ${failed.map(job => job.error).join('; ')}`;
+            }
+            showStatus(message, 'success');
+            resetForm();
         } catch (error) {
             console.error('Upload error:', error);
             let errorMessage = 'An error occurred while processing images.';
@@ -188,6 +203,58 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
     
+    // Poll queued upload jobs until they have all finished
+    async function waitForJobs(jobs) {
+        const pending = new Map(jobs.map(job => [job.id, job]));
+        const errors = new Map();
+        const finished = [];
+        
+        const giveUp = (id, error) => {
+            finished.push({ ...pending.get(id), status: 'failed', error });
+            pending.delete(id);
+        };
+        
+        while (pending.size > 0) {
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+            
+            for (const id of [...pending.keys()]) {
+                let response;
+                try {
+                    response = await fetch(`http://localhost:5001/jobs/${id}`);
+                } catch (error) {
+                    response = null;
+                }
+                
+                if (response && response.status === 404) {
+                    giveUp(id, `${pending.get(id).filename}: job not found on the server`);
+                    continue;
+                }
+                if (!response || !response.ok) {
+                    errors.set(id, (errors.get(id) || 0) + 1);
+                    if (errors.get(id) >= JOB_POLL_MAX_ERRORS) {
+                        giveUp(id, `${pending.get(id).filename}: lost contact with the server`);
+                    }
+                    continue;
+                }
+                errors.delete(id);
+                
+                const job = await response.json();
+                pending.set(id, job);
+                if (job.status === 'done' || job.status === 'failed') {
+                    pending.delete(id);
+                    finished.push(job);
+                }
+            }
+            
+            const current = [...pending.values()][0];
+            if (current) {
+                showStatus(`Processing images... ${finished.length}/${jobs.length} done (${current.filename}: ${current.stage})`, 'info');
+            }
+        }
+        
+        return finished;
+    }
+    
     // Show status message
     function showStatus(message, type) {
         statusMessage.textContent = message;
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Static Server Benchmark for Assemblage
+
+Compares the old server.py setup (single-threaded socketserver.TCPServer with
+SimpleHTTPRequestHandler) against static_server.py. Each server is started as
+a subprocess on the project root, then client threads request a mix of the
+site's files (pages, scripts, styles, metadata.json and collection images)
+for a fixed time over keep-alive connections where the server allows it.
+
+With --slow-client, one extra connection is opened first and never sends a
+full request, the way a stalled or slow client would.
+
+Usage:
+    python benchmark_static_server.py
+    python benchmark_static_server.py --clients 16 --duration 10
+    python benchmark_static_server.py --slow-client
+"""
+
+import os
+import sys
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+
+# Equivalent to server.py --mode simple, minus per-request logging
+SIMPLE_SERVER = """
+import sys, http.server, socketserver
+class Handler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+with socketserver.TCPServer(("127.0.0.1", int(sys.argv[1])), Handler) as httpd:
+    httpd.serve_forever()
+"""
+
+CLIENT_TIMEOUT = 5.0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def start_server(kind, port):
+    if kind == "simple":
+        command = [sys.executable, "-c", SIMPLE_SERVER, str(port)]
+    else:
+        command = [sys.executable, os.path.join(SCRIPT_DIR, "static_server.py"),
+                   "--port", str(port), "--root", ROOT_DIR, "--quiet"]
+    process = subprocess.Popen(command, cwd=ROOT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return process
+
+
+def workload(image_count):
+    """URL paths to request: the page and its assets plus a sample of collection images."""
+    paths = ["/index.html", "/images/metadata.json"]
+    for directory, extension in (("js", ".js"), ("css", ".css")):
+        for name in sorted(os.listdir(os.path.join(ROOT_DIR, directory))):
+            if name.endswith(extension):
+                paths.append(f"/{directory}/{name}")
+    collages_dir = os.path.join(ROOT_DIR, "images", "collages")
+    images = sorted(name for name in os.listdir(collages_dir) if name.endswith(".jpg"))
+    paths.extend(f"/images/collages/{name}" for name in images[:image_count])
+    return paths
+
+
+def client(port, paths, deadline, results, seed, compressed):
+    rng = random.Random(seed)
+    headers = {"Accept-Encoding": "br, gzip"} if compressed else {}
+    latencies = []
+    received = errors = 0
+    conn = None
+    while time.time() < deadline:
+        path = rng.choice(paths)
+        start = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=CLIENT_TIMEOUT)
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+            if response.status != 200:
+                errors += 1
+            if response.will_close:
+                conn.close()
+                conn = None
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            if conn:
+                conn.close()
+            conn = None
+            continue
+        latencies.append(time.perf_counter() - start)
+        received += len(body)
+    if conn:
+        conn.close()
+    results.append((latencies, received, errors))
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def run(kind, paths, clients, duration, slow_client, compressed):
+    port = free_port()
+    process = start_server(kind, port)
+    stalled = None
+    try:
+        if slow_client:
+            # Connect and send half a request line, then go quiet
+            stalled = socket.create_connection(("127.0.0.1", port))
+            stalled.sendall(b"GET /index.html HT")
+
+        results = []
+        deadline = time.time() + duration
+        threads = [threading.Thread(target=client, args=(port, paths, deadline, results, seed, compressed))
+                   for seed in range(clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        if stalled:
+            stalled.close()
+        process.terminate()
+        process.wait()
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    received = sum(result[1] for result in results)
+    errors = sum(result[2] for result in results)
+    return {
+        "requests": len(latencies),
+        "req_per_s": len(latencies) / elapsed,
+        "mb_per_s": received / elapsed / (1024 * 1024),
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark static_server.py against the SimpleHTTPRequestHandler server")
+    parser.add_argument("--clients", "-c", type=int, default=8, help="Concurrent client connections (default: 8)")
+    parser.add_argument("--duration", "-d", type=float, default=5.0, help="Seconds per server (default: 5)")
+    parser.add_argument("--images", type=int, default=50, help="Collection images in the request mix (default: 50)")
+    parser.add_argument("--slow-client", action="store_true", help="Hold one stalled connection open during the run")
+    parser.add_argument("--compressed", action="store_true", help="Send Accept-Encoding: br, gzip")
+    args = parser.parse_args()
+
+    paths = workload(args.images)
+    print(f"{len(paths)} paths, {args.clients} clients, {args.duration:g}s per server"
+          + (", one stalled client" if args.slow_client else ""))
+    print(f"{'server':<8} {'requests':>9} {'req/s':>9} {'MB/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for kind in ("simple", "static"):
+        stats = run(kind, paths, args.clients, args.duration, args.slow_client, args.compressed)
+        print(f"{kind:<8} {stats['requests']:>9} {stats['req_per_s']:>9.1f} {stats['mb_per_s']:>8.1f} "
+              f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Collage Renderer for Assemblage
+
+Renders compositions on the server with Pillow and NumPy instead of a
+browser canvas, for low-end clients and for pre-generated, shareable
+outputs. Ports of three of the js/collage generators:
+
+    mosaic   grid of cover-cropped tiles, "field" (jittered) or "focal"
+             (larger towards the centre), some showing a cropped portion
+    tiling   scattered square tiles of varied size and rotation, each image
+             kept whole, multiplied onto a coloured background
+    layered  2-5 large overlapping layers at partial opacity
+
+A composition is planned first (a list of fragments: image, destination
+rectangle, source crop, rotation, opacity, blend mode) from a seeded random
+generator, so the same seed and images always give the same output, and
+then composited in float32 with normal, multiply, screen, overlay, darken
+or lighten blending. Fragments are loaded through the shared decoded image
+cache at the size they are drawn.
+
+Usage:
+    python collage_renderer.py --style mosaic --size 1920x1080
+    python collage_renderer.py --style tiling --count 20 --tags "vintage & !color" --output renders/
+    python collage_renderer.py --style layered --seed 7 --format png
+
+    from collage_renderer import render
+    img = render("mosaic", image_paths, 1200, 800, seed=42)
+"""
+
+import os
+import sys
+import math
+import random
+import argparse
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+from image_cache import shared_cache
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+IMAGES_DIR = os.path.join(ROOT_DIR, "images")
+COLLAGES_DIR = os.path.join(IMAGES_DIR, "collages")
+METADATA_FILE = os.path.join(IMAGES_DIR, "metadata.json")
+RENDERS_DIR = os.path.join(ROOT_DIR, "renders")
+
+STYLES = ("mosaic", "tiling", "layered")
+BLEND_MODES = ("normal", "multiply", "screen", "overlay", "darken", "lighten")
+OUTPUT_FORMATS = {"jpg": ("JPEG", {"quality": 90, "optimize": True, "progressive": True}), "png": ("PNG", {"optimize": True})}
+
+DEFAULT_SIZE = (1200, 800)
+MAX_SIDE = 4096
+DEFAULT_IMAGE_COUNT = {"mosaic": 40, "tiling": 30, "layered": 5}
+
+# Same palette as CollageGenerator.generateBackgroundColor (chosen to work under multiply)
+BACKGROUND_COLORS = ("#FF6B6B", "#4ECDC4", "#45B7D1", "#96CEB4", "#FFEEAD",
+                     "#D4A5A5", "#9B59B6", "#3498DB", "#E67E22", "#1ABC9C")
+
+
+@dataclass
+class Fragment:
+    """One image drawn into the composition."""
+    path: str
+    x: float                 # Destination rectangle, before rotation about its centre
+    y: float
+    width: float
+    height: float
+    crop: tuple = None       # Source box as fractions (left, top, right, bottom); None = whole image
+    rotation: float = 0.0    # Degrees, counter-clockwise
+    opacity: float = 1.0
+    blend: str = "normal"
+
+
+# -------------------- Planning --------------------
+
+def _image_size(path):
+    return shared_cache().header(path)["size"]
+
+
+def _cover_crop(src_size, dest_size, portion=1.0, rng=None):
+    """Crop box (fractions) matching dest's aspect ratio, like MosaicGenerator.drawImage(crop=true).
+
+    With portion < 1 only that share of the image is shown, at a random offset
+    along the longer axis.
+    """
+    src_ratio = src_size[0] / src_size[1]
+    dest_ratio = dest_size[0] / dest_size[1]
+    if src_ratio > dest_ratio:
+        height = portion
+        width = height * dest_ratio / src_ratio
+        left = rng.random() * (1 - width) if rng and portion < 1 else (1 - width) / 2
+        top = (1 - height) / 2
+    else:
+        width = portion
+        height = width * src_ratio / dest_ratio
+        left = (1 - width) / 2
+        top = rng.random() * (1 - height) if rng and portion < 1 else (1 - height) / 2
+    return left, top, left + width, top + height
+
+
+def plan_mosaic(paths, width, height, rng, params):
+    """Grid of cover-cropped tiles (MosaicGenerator.generateMosaic)."""
+    complexity = params.get("complexity", 0.5)
+    roll = rng.random()
+    if roll < 0.2:
+        grid = rng.randint(2, 3)
+    elif roll < 0.4:
+        grid = rng.randint(4, 5)
+    elif roll < 0.7:
+        grid = rng.randint(6, 7)
+    else:
+        grid = max(8, min(10, math.ceil(math.sqrt(len(paths)) * (1 + complexity))))
+    grid = params.get("grid", grid)
+
+    cell_width, cell_height = width / grid, height / grid
+    total = grid * grid
+    full_opacity = set(rng.sample(range(total), max(1, math.ceil(total * 0.4))))
+    order = rng.sample(paths, len(paths))
+    focal = params.get("composition", "field") == "focal"
+    touching = params.get("tiles_touching", False)
+    blend = params.get("blend", "normal")
+
+    fragments = []
+    for index in range(total):
+        i, j = divmod(index, grid)
+        x, y = i * cell_width, j * cell_height
+        if focal:
+            distance = math.hypot(x - width / 2, y - height / 2)
+            scale = 1 + (1 - distance / math.hypot(width / 2, height / 2)) * 0.5 * (0.5 if touching else 1.0)
+            x -= (cell_width * scale - cell_width) / 2
+            y -= (cell_height * scale - cell_height) / 2
+        else:
+            offset = 0.05 if touching else 0.1
+            x += (rng.random() - 0.5) * cell_width * offset
+            y += (rng.random() - 0.5) * cell_height * offset
+            scale = 1 + (rng.random() - 0.5) * 0.2
+
+        path = rng.choice(paths) if params.get("allow_repetition") else order[index % len(order)]
+        tile_width, tile_height = cell_width * scale, cell_height * scale
+        portion = 0.3 + rng.random() * 0.7 if rng.random() < 0.4 else 1.0
+        fragments.append(Fragment(
+            path, x, y, tile_width, tile_height,
+            crop=_cover_crop(_image_size(path), (tile_width, tile_height), portion, rng),
+            opacity=1.0 if index in full_opacity else 0.7 + rng.random() * 0.3,
+            blend=blend,
+        ))
+    return fragments
+
+
+def plan_tiling(paths, width, height, rng, params):
+    """Scattered square tiles with whole images (TilingGenerator field tiles)."""
+    dramatic = params.get("dramatic", rng.random() < 0.3)
+    count = min(params.get("tiles", rng.randint(18, 36)), len(paths) if not params.get("allow_repetition") else 10 ** 6)
+    base_size = math.sqrt(width * height / max(1, count)) * 1.1
+    min_scale, max_scale = 0.7, 1.8 if dramatic else 1.4
+    use_rotation = rng.random() < (0.9 if dramatic else 0.7)
+    max_rotation = 45 if dramatic else 25
+    blend = params.get("blend", "multiply")
+
+    columns = max(1, round(math.sqrt(count * width / height)))
+    rows = max(1, math.ceil(count / columns))
+    cell_width, cell_height = width / columns, height / rows
+    jitter = min(cell_width, cell_height) * (0.25 if dramatic else 0.15)
+    positions = [((column + 0.5) * cell_width + (rng.random() - 0.5) * jitter,
+                  (row + 0.5) * cell_height + (rng.random() - 0.5) * jitter)
+                 for row in range(-1, rows + 1) for column in range(-1, columns + 1)]
+    rng.shuffle(positions)
+
+    order = rng.sample(paths, len(paths))
+    fragments = []
+    for index, (cx, cy) in enumerate(positions[:count]):
+        if dramatic:
+            roll = rng.random()
+            scale = (max_scale - rng.random() * 0.3 if roll < 0.3 else
+                     min_scale + rng.random() * 0.2 if roll < 0.6 else 1.0 + rng.random() * 0.3)
+        else:
+            scale = min_scale + rng.random() * (max_scale - min_scale)
+        size = base_size * scale
+
+        path = rng.choice(paths) if params.get("allow_repetition") else order[index % len(order)]
+        # Keep the whole image: fit it inside the square (drawTileWithAspectRatio)
+        image_width, image_height = _image_size(path)
+        ratio = image_width / image_height
+        draw_width, draw_height = (size, size / ratio) if ratio > 1 else (size * ratio, size)
+
+        roll = rng.random()
+        opacity = (1.0 if roll < (0.2 if dramatic else 0.15) else
+                   0.7 + rng.random() * 0.3 if roll < (0.7 if dramatic else 0.5) else
+                   0.3 + rng.random() * 0.4)
+        rotate = use_rotation and rng.random() < (0.5 if dramatic else 0.3)
+        fragments.append(Fragment(
+            path, cx - draw_width / 2, cy - draw_height / 2, draw_width, draw_height,
+            rotation=(rng.random() - 0.5) * max_rotation if rotate else 0.0,
+            opacity=opacity, blend=blend,
+        ))
+    # Larger tiles first so small ones stay visible (CollageGenerator.drawTiles)
+    fragments.sort(key=lambda fragment: -fragment.width * fragment.height)
+    return fragments
+
+
+def plan_layered(paths, width, height, rng, params):
+    """A few large overlapping layers (LayeredGenerator.generateLayers)."""
+    count = min(params.get("layers", rng.randint(2, 5)), len(paths))
+    blend = params.get("blend", "normal")
+    layers = []
+    for index, path in enumerate(rng.sample(paths, count)):
+        image_width, image_height = _image_size(path)
+        ratio = image_width / image_height
+        scale = 0.7 + rng.random() * 0.5
+        layer_width = width * scale
+        layer_height = layer_width / ratio
+        if layer_height < height * 0.7:
+            layer_height = height * 0.7
+            layer_width = layer_height * ratio
+        layers.append((scale, Fragment(
+            path,
+            rng.random() * width * 1.2 - width * 0.1,
+            rng.random() * height * 1.2 - height * 0.1,
+            layer_width, layer_height,
+            opacity=1.0 if index == 0 else 0.3 + rng.random() * 0.4,
+            blend=blend,
+        )))
+    # Smaller scales drawn first
+    layers.sort(key=lambda layer: layer[0])
+    return [fragment for _, fragment in layers]
+
+
+PLANNERS = {"mosaic": plan_mosaic, "tiling": plan_tiling, "layered": plan_layered}
+
+
+def plan(style, paths, width, height, seed=None, params=None):
+    """The fragments of a composition; the same seed and paths give the same plan."""
+    if style not in PLANNERS:
+        raise ValueError(f"style must be one of: {', '.join(STYLES)}")
+    if not paths:
+        raise ValueError("No images to compose")
+    params = dict(params or {})
+    if params.get("blend", "normal") not in BLEND_MODES:
+        raise ValueError(f"blend must be one of: {', '.join(BLEND_MODES)}")
+    return PLANNERS[style](list(paths), width, height, random.Random(seed), params)
+
+
+# -------------------- Compositing --------------------
+
+def _blend(base, top, mode):
+    """Blend-mode result of drawing top over base (both float32 in [0, 1])."""
+    if mode == "multiply":
+        return base * top
+    if mode == "screen":
+        return 1 - (1 - base) * (1 - top)
+    if mode == "overlay":
+        return np.where(base <= 0.5, 2 * base * top, 1 - 2 * (1 - base) * (1 - top))
+    if mode == "darken":
+        return np.minimum(base, top)
+    if mode == "lighten":
+        return np.maximum(base, top)
+    return top
+
+
+def _fragment_pixels(fragment, cache):
+    """The fragment cropped, scaled and rotated: (RGB float32 array, alpha float32 array)."""
+    dest_size = (max(1, round(fragment.width)), max(1, round(fragment.height)))
+    left, top, right, bottom = fragment.crop or (0.0, 0.0, 1.0, 1.0)
+    # Decode at the scale the crop will be drawn at
+    needed = (math.ceil(dest_size[0] / max(right - left, 1e-6)), math.ceil(dest_size[1] / max(bottom - top, 1e-6)))
+    img = cache.get(fragment.path, needed)
+    box = (left * img.width, top * img.height, right * img.width, bottom * img.height)
+    img = img.resize(dest_size, Image.Resampling.BILINEAR, box=box, reducing_gap=2.0)
+
+    alpha = None
+    if fragment.rotation:
+        img = img.convert("RGBA").rotate(fragment.rotation, resample=Image.Resampling.BICUBIC, expand=True)
+        alpha = np.asarray(img.getchannel("A"), dtype=np.float32) / 255
+        img = img.convert("RGB")
+    pixels = np.asarray(img, dtype=np.float32) / 255
+    if alpha is None:
+        alpha = np.ones(pixels.shape[:2], dtype=np.float32)
+    return pixels, alpha
+
+
+def composite(fragments, width, height, background="#FFFFFF", cache=None):
+    """Draw fragments in order onto a background. Returns an RGB PIL image."""
+    cache = cache or shared_cache()
+    background = Image.new("RGB", (1, 1), background).getpixel((0, 0))
+    canvas = np.empty((height, width, 3), dtype=np.float32)
+    canvas[:] = np.array(background, dtype=np.float32) / 255
+
+    for fragment in fragments:
+        pixels, alpha = _fragment_pixels(fragment, cache)
+        frag_height, frag_width = alpha.shape
+        # Rotation grows the box around the same centre
+        x0 = round(fragment.x + fragment.width / 2 - frag_width / 2)
+        y0 = round(fragment.y + fragment.height / 2 - frag_height / 2)
+        left, top = max(0, x0), max(0, y0)
+        right, bottom = min(width, x0 + frag_width), min(height, y0 + frag_height)
+        if left >= right or top >= bottom:
+            continue
+
+        region = canvas[top:bottom, left:right]
+        source = pixels[top - y0:bottom - y0, left - x0:right - x0]
+        weight = (alpha[top - y0:bottom - y0, left - x0:right - x0] * fragment.opacity)[..., None]
+        region += (_blend(region, source, fragment.blend) - region) * weight
+
+    np.clip(canvas, 0, 1, out=canvas)
+    return Image.fromarray((canvas * 255 + 0.5).astype(np.uint8), "RGB")
+
+
+def render(style, paths, width=DEFAULT_SIZE[0], height=DEFAULT_SIZE[1], seed=None, params=None, background=None):
+    """Plan and composite a collage. Returns an RGB PIL image."""
+    if not (1 <= width <= MAX_SIDE and 1 <= height <= MAX_SIDE):
+        raise ValueError(f"width and height must be between 1 and {MAX_SIDE}")
+    fragments = plan(style, paths, width, height, seed, params)
+    if background is None:
+        default_blend = (params or {}).get("blend", "multiply" if style == "tiling" else "normal")
+        background = random.Random(seed).choice(BACKGROUND_COLORS) if default_blend == "multiply" else "#FFFFFF"
+    return composite(fragments, width, height, background)
+
+
+def save(img, path, fmt="jpg"):
+    """Write a render as JPEG or PNG."""
+    pil_format, options = OUTPUT_FORMATS[fmt]
+    tmp_path = f"{path}.tmp"
+    img.save(tmp_path, format=pil_format, **options)
+    os.replace(tmp_path, path)
+    return path
+
+
+def collection_paths(entries, collages_dir=COLLAGES_DIR):
+    """Image file paths for metadata entries, skipping missing files."""
+    paths = (os.path.join(collages_dir, os.path.basename(entry["src"])) for entry in entries if entry.get("src"))
+    return [path for path in paths if os.path.exists(path)]
+
+
+# -------------------- Command line --------------------
+
+def parse_size(value):
+    try:
+        width, height = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("size must look like 1200x800")
+    return width, height
+
+
+def main():
+    from metadata_store import MetadataStore
+    from tag_index import TagIndex
+
+    parser = argparse.ArgumentParser(description="Render collages from the collection on the server")
+    parser.add_argument("--style", "-s", choices=STYLES, default="mosaic", help="Composition style (default: mosaic)")
+    parser.add_argument("--size", type=parse_size, default=DEFAULT_SIZE, help="Output size, e.g. 1920x1080 (default: 1200x800)")
+    parser.add_argument("--format", "-f", choices=sorted(OUTPUT_FORMATS), default="jpg", help="Output format (default: jpg)")
+    parser.add_argument("--count", "-n", type=int, default=1, help="Number of collages to render (default: 1)")
+    parser.add_argument("--seed", type=int, help="Seed of the first collage; later ones use seed+1, seed+2, ...")
+    parser.add_argument("--tags", "-t", help="Tag expression selecting the images, e.g. \"vintage & !color\"")
+    parser.add_argument("--images", type=int, help="Images per collage (default depends on style)")
+    parser.add_argument("--blend", choices=BLEND_MODES, help="Blend mode for every fragment (default depends on style)")
+    parser.add_argument("--metadata", "-m", default=METADATA_FILE, help="Path to metadata.json")
+    parser.add_argument("--output", "-o", default=RENDERS_DIR, help="Directory to write renders to")
+    args = parser.parse_args()
+
+    index = TagIndex(MetadataStore(args.metadata))
+    collages_dir = os.path.join(os.path.dirname(os.path.abspath(args.metadata)), "collages")
+    os.makedirs(args.output, exist_ok=True)
+    first_seed = args.seed if args.seed is not None else random.randrange(1 << 31)
+    params = {"blend": args.blend} if args.blend else {}
+    width, height = args.size
+
+    for seed in range(first_seed, first_seed + args.count):
+        sample = index.sample(args.tags, n=args.images or DEFAULT_IMAGE_COUNT[args.style], seed=seed, fields=["src"])
+        paths = collection_paths(sample["images"], collages_dir)
+        if not paths:
+            print(f"Error: no images match {args.tags!r}")
+            return 1
+        img = render(args.style, paths, width, height, seed=seed, params=params)
+        path = save(img, os.path.join(args.output, f"{args.style}-{seed}.{args.format}"), args.format)
+        print(f"✓ {path} ({len(paths)} images)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
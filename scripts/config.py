@@ -21,4 +21,27 @@ MAIN_SERVER_PORT = int(os.getenv('MAIN_SERVER_PORT', '8000'))
 # Image Processing Settings
 TARGET_SIZE = tuple(map(int, os.getenv('TARGET_SIZE', '800,800').split(',')))
 JPEG_QUALITY = int(os.getenv('JPEG_QUALITY', '85'))
-CONVERT_TO_BW = os.getenv('CONVERT_TO_BW', 'false').lower() == 'true' 
\ No newline at end of file
+CONVERT_TO_BW = os.getenv('CONVERT_TO_BW', 'false').lower() == 'true'
+
+# Duplicate Detection Settings
+NEAR_DUPLICATE_THRESHOLD = int(os.getenv('NEAR_DUPLICATE_THRESHOLD', '5'))  # Max Hamming distance between hashes
+NEAR_DUPLICATE_HASH = os.getenv('NEAR_DUPLICATE_HASH', 'phash')  # ahash, dhash or phash
+
+# Upload Processing Settings
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '2'))  # Background threads processing queued uploads
+
+# Tagging Cache Settings
+TAG_CACHE_PATH = os.getenv('TAG_CACHE_PATH') or str(root_dir / 'images' / 'tag_cache.db')  # Cached vision results, keyed by image content
+TAG_CACHE_MAX_ENTRIES = int(os.getenv('TAG_CACHE_MAX_ENTRIES', '50000'))  # Least recently used entries are evicted beyond this
+
+# Image Variant Settings
+VARIANT_CACHE_DIR = os.getenv('VARIANT_CACHE_DIR') or str(root_dir / 'cache' / 'variants')  # Resized variants rendered on request
+VARIANT_CACHE_MAX_MB = int(os.getenv('VARIANT_CACHE_MAX_MB', '512'))  # Least recently used variants are evicted beyond this
+DECODE_CACHE_MB = int(os.getenv('DECODE_CACHE_MB', '256'))  # Decoded images kept in memory for hashing, processing and rendering
+
+# Metadata Settings
+METADATA_EXPORT_DELAY = float(os.getenv('METADATA_EXPORT_DELAY', '1.0'))  # Seconds to gather writes before metadata.json is re-exported (0 = after every write)
+
+# Live Update Settings
+EVENT_STREAM_PORT = int(os.getenv('EVENT_STREAM_PORT', '5002'))  # Port of the asyncio /metadata/events server (0 = only the threaded route)
+EVENT_MAX_CLIENTS = int(os.getenv('EVENT_MAX_CLIENTS', '10000'))  # Open streams allowed at once on that server; keep below the open-file limit
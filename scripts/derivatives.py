@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Image Derivatives for Assemblage
+
+Generates a ladder of smaller renditions for each collection image so the
+frontend can load a size close to what it draws instead of the full 800px
+JPEG for every fragment:
+
+    thumb   128px
+    small   256px
+    medium  512px
+    full    800px (the stored JPEG itself)
+
+Each level is written as JPEG and WebP (optionally AVIF, if Pillow supports it) to
+images/derivatives/<level>/<id>.<format>; the full-size JPEG stays at
+images/collages/<id>.jpg. The image is decoded once and each level is resized
+from the one above it.
+
+Metadata entries record what was generated, and URLs follow from the layout
+above (see js/derivatives.js):
+
+    "derivatives": {"formats": ["jpg", "webp"], "sizes": {"thumb": [128, 96], ...}}
+
+Usage:
+    python derivatives.py                  # backfill every image in images/metadata.json
+    python derivatives.py --workers 0      # one worker process per CPU
+    python derivatives.py --force          # regenerate even if up to date
+    python derivatives.py --formats jpg,webp,avif
+"""
+
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from image_io import reduce_for, fit_size
+from metadata_store import MetadataStore
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+IMAGES_DIR = os.path.join(ROOT_DIR, "images")
+COLLAGES_DIR = os.path.join(IMAGES_DIR, "collages")
+DERIVATIVES_DIR = os.path.join(IMAGES_DIR, "derivatives")
+METADATA_FILE = os.path.join(IMAGES_DIR, "metadata.json")
+
+# Largest to smallest; each level is resized from the previous one
+LEVELS = (("full", 800), ("medium", 512), ("small", 256), ("thumb", 128))
+
+# Pillow format name and encoder options per file extension
+FORMATS = {
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+    "webp": ("WEBP", {"quality": 80, "method": 2}),
+    "avif": ("AVIF", {"quality": 60, "speed": 8}),
+}
+
+# AVIF is smaller again but several times slower to encode; opt in with --formats
+DEFAULT_FORMATS = ("jpg", "webp")
+
+
+def available_formats():
+    """Derivative formats this Pillow build can write (AVIF is optional)."""
+    Image.init()
+    return [ext for ext, (pil_format, _) in FORMATS.items() if pil_format in Image.SAVE]
+
+
+def derivative_path(image_id, level, ext, derivatives_dir=DERIVATIVES_DIR):
+    return os.path.join(derivatives_dir, level, f"{image_id}.{ext}")
+
+
+def _up_to_date(source_path, paths):
+    source_mtime = os.path.getmtime(source_path)
+    return all(os.path.exists(path) and os.path.getmtime(path) >= source_mtime for path in paths)
+
+
+def generate_derivatives(source_path, image_id, formats=None, derivatives_dir=DERIVATIVES_DIR, force=False):
+    """Write the derivative ladder for one image. Returns the metadata record.
+
+    The full-size JPEG is the source itself and is not rewritten. Existing
+    derivatives newer than the source are kept unless force is set.
+    """
+    formats = formats or DEFAULT_FORMATS
+    with Image.open(source_path) as img:
+        full_size = fit_size(img.size, (LEVELS[0][1], LEVELS[0][1])) if max(img.size) > LEVELS[0][1] else img.size
+        sizes = {}
+        outputs = []
+        size = full_size
+        for level, max_dimension in LEVELS:
+            if max(size) > max_dimension:
+                size = fit_size(size, (max_dimension, max_dimension))
+            sizes[level] = list(size)
+            for ext in formats:
+                if level == "full" and ext == "jpg":
+                    continue
+                outputs.append((level, ext, tuple(size)))
+
+        record = {"formats": list(formats), "sizes": sizes}
+        paths = [derivative_path(image_id, level, ext, derivatives_dir) for level, ext, _ in outputs]
+        if not force and _up_to_date(source_path, paths):
+            return record
+
+        reduce_for(img, full_size)
+        img = img.convert("RGB") if img.mode not in ("RGB", "L") else img
+        current = img if img.size == full_size else img.resize(full_size, Image.Resampling.LANCZOS)
+        for (level, ext, size), path in zip(outputs, paths):
+            if current.size != size:
+                current = current.resize(size, Image.Resampling.LANCZOS)
+            pil_format, options = FORMATS[ext]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            current.save(tmp_path, format=pil_format, **options)
+            os.replace(tmp_path, path)
+    return record
+
+
+def remove_derivatives(image_id, derivatives_dir=DERIVATIVES_DIR):
+    """Delete every derivative of an image."""
+    for level, _ in LEVELS:
+        for ext in FORMATS:
+            path = derivative_path(image_id, level, ext, derivatives_dir)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _backfill_one(task):
+    image_id, source_path, formats, derivatives_dir, force = task
+    try:
+        return image_id, generate_derivatives(source_path, image_id, formats, derivatives_dir, force), None
+    except Exception as e:
+        return image_id, None, str(e)
+
+
+def backfill(metadata_file=METADATA_FILE, collages_dir=COLLAGES_DIR, workers=1, formats=None, force=False,
+             derivatives_dir=DERIVATIVES_DIR):
+    """Generate derivatives for every image in the metadata and record them."""
+    store = MetadataStore(metadata_file)
+    formats = formats or DEFAULT_FORMATS
+    tasks = []
+    for entry in store.all():
+        source_path = os.path.join(collages_dir, os.path.basename(entry["src"]))
+        if not os.path.exists(source_path):
+            print(f"Warning: Image file not found: {source_path}")
+            continue
+        tasks.append((entry["id"], source_path, formats, derivatives_dir, force))
+
+    print(f"Generating {', '.join(formats)} derivatives for {len(tasks)} images with {workers} worker(s)")
+    done = errors = 0
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        results = executor.map(_backfill_one, tasks, chunksize=4) if executor else map(_backfill_one, tasks)
+        with store.batch():
+            for image_id, record, error in results:
+                if error:
+                    print(f"Error generating derivatives for {image_id}: {error}")
+                    errors += 1
+                    continue
+                store.update(image_id, derivatives=record)
+                done += 1
+                if done % 50 == 0:
+                    print(f"  {done}/{len(tasks)}")
+    finally:
+        if executor:
+            executor.shutdown()
+    print(f"Done: {done} images, {errors} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate thumbnail/small/medium/full derivatives for the collection")
+    parser.add_argument("--metadata", "-m", default=METADATA_FILE, help="Path to metadata.json")
+    parser.add_argument("--input", "-i", default=COLLAGES_DIR, help="Directory containing the collection images")
+    parser.add_argument("--output", "-o", default=DERIVATIVES_DIR, help="Directory to write derivatives to")
+    parser.add_argument("--workers", "-w", type=int, default=1, help="Worker processes (0 = one per CPU, default: 1)")
+    parser.add_argument("--formats", help=f"Comma-separated formats from {', '.join(available_formats())} "
+                                          f"(default: {','.join(DEFAULT_FORMATS)})")
+    parser.add_argument("--force", action="store_true", help="Regenerate derivatives that are already up to date")
+    args = parser.parse_args()
+
+    formats = None
+    if args.formats:
+        formats = [ext.strip().lower() for ext in args.formats.split(",") if ext.strip()]
+        unsupported = [ext for ext in formats if ext not in available_formats()]
+        if unsupported:
+            print(f"Error: unsupported format(s): {', '.join(unsupported)}")
+            sys.exit(1)
+
+    workers = args.workers if args.workers > 0 else os.cpu_count() or 1
+    backfill(args.metadata, args.input, workers, formats, args.force, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Event Broker for Assemblage
+
+Fans metadata changes out to connected browsers (the /metadata/events
+server-sent event stream) so they no longer poll for new images:
+
+- Each subscriber has a small bounded buffer. publish() never blocks on a
+  slow client: when a buffer is full the client is marked as overflowed and
+  told to resync (a "reset" event) instead of receiving the backlog.
+- Each subscriber waits on its own event, costing no CPU while idle, and
+  publish() wakes only the subscribers it queued something for (one that
+  has already overflowed isn't woken again). A wait times out every
+  heartbeat interval so the stream can send a keep-alive comment and notice
+  closed connections.
+- The number of subscribers is capped (SubscriberLimitError beyond it).
+
+Every open stream still holds one server thread while it waits, so under
+Flask's threaded development server a few hundred subscribers is a
+practical ceiling. The broker backs the fallback /metadata/events route;
+thousands of idle connections are served by event_stream_server.py.
+
+Usage:
+    from event_broker import EventBroker
+
+    broker = EventBroker()
+    broker.publish("added", entry, event_id=version)
+
+    with broker.subscribe() as subscription:
+        for event in subscription.events(heartbeat=15):
+            ...  # (name, data, event_id), or None for a heartbeat
+"""
+
+import threading
+from collections import deque
+
+DEFAULT_BUFFER_SIZE = 64
+DEFAULT_MAX_SUBSCRIBERS = 200
+
+# Sent in place of a subscriber's buffered events after it overflowed
+RESET_EVENT = "reset"
+
+
+class SubscriberLimitError(Exception):
+    """Raised when the broker already has max_subscribers subscribers."""
+
+
+class Subscription:
+    """One subscriber's bounded event buffer."""
+
+    def __init__(self, broker, buffer_size):
+        self._broker = broker
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._buffer = deque()
+        self._buffer_size = buffer_size
+        self.overflowed = False
+        self.closed = False
+
+    def _push(self, event):
+        """Queue an event and wake the subscriber. Returns True if this push overflowed the buffer."""
+        with self._lock:
+            if self.overflowed:
+                return False
+            if len(self._buffer) >= self._buffer_size:
+                self._buffer.clear()
+                self.overflowed = True
+            else:
+                self._buffer.append(event)
+        self._ready.set()
+        return self.overflowed
+
+    def close(self):
+        """Stop receiving events."""
+        self.closed = True
+        self._ready.set()
+        self._broker._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def events(self, heartbeat):
+        """Yield (name, data, event_id) as events arrive, or None every `heartbeat` idle seconds."""
+        while not self.closed:
+            self._ready.wait(heartbeat)
+            with self._lock:
+                # Cleared under the lock, so a push racing with this read sets it again
+                self._ready.clear()
+                if self.overflowed:
+                    self.overflowed = False
+                    pending = [(RESET_EVENT, None, None)]
+                else:
+                    pending = list(self._buffer)
+                self._buffer.clear()
+            if self.closed:
+                return
+            if not pending:
+                yield None
+            for event in pending:
+                yield event
+
+
+class EventBroker:
+    """Publish/subscribe hub with bounded per-subscriber buffers."""
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE, max_subscribers=DEFAULT_MAX_SUBSCRIBERS):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self.published = 0
+        self.overflows = 0
+
+    def subscribe(self):
+        """Register a subscriber. Close it (or use it as a context manager) when done."""
+        subscription = Subscription(self, self.buffer_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                raise SubscriberLimitError(f"Too many subscribers ({self.max_subscribers})")
+            self._subscribers.add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, name, data=None, event_id=None):
+        """Queue an event for every subscriber and wake them. Never blocks on a subscriber."""
+        event = (name, data, event_id)
+        with self._lock:
+            self.published += 1
+            self.overflows += sum(subscription._push(event) for subscription in self._subscribers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": len(self._subscribers),
+                "max_subscribers": self.max_subscribers,
+                "published": self.published,
+                "overflows": self.overflows,
+            }
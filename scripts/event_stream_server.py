@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Event Stream Server for Assemblage
+
+Serves the /metadata/events server-sent event stream from a single asyncio
+event loop (in a background thread, on its own port), so thousands of idle
+browser connections cost a socket and a small coroutine each rather than a
+server thread each, as they would under Flask's threaded server:
+
+- A client connects with GET /metadata/events (?since=<version> or a
+  Last-Event-ID header to first receive what it missed). Replay runs in the
+  loop's executor; events published meanwhile are held back and sent after
+  it, so each client sees changes in version order.
+- publish() may be called from any thread. Each event is encoded once and
+  written to every client's socket buffer; nothing waits on a slow client.
+  A client whose unsent data grows past max_buffer is disconnected instead,
+  and catches up through replay when its browser reconnects.
+- One timer writes a keep-alive comment to every client each heartbeat
+  interval, which is also how closed connections are noticed.
+- The number of clients is capped (503 with Retry-After beyond it). Each
+  client holds a file descriptor, so the process's open-file limit (ulimit
+  -n) must be above max_clients.
+
+Usage:
+    from event_stream_server import EventStreamServer
+
+    server = EventStreamServer(replay, port=5002)   # replay(since) -> [(name, data, event_id), ...]
+    server.start()
+    server.publish("added", entry, event_id=version)
+    server.stats()
+"""
+
+import json
+import asyncio
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+STREAM_PATH = "/metadata/events"
+DEFAULT_MAX_CLIENTS = 10000
+DEFAULT_HEARTBEAT = 15
+DEFAULT_MAX_BUFFER = 256 * 1024   # Unsent bytes allowed per client before it is dropped
+REQUEST_TIMEOUT = 10              # Seconds to wait for a request's headers
+MAX_REQUEST_BYTES = 16 * 1024
+
+
+def encode_event(name, data=None, event_id=None):
+    """Encode one server-sent event."""
+    lines = f"event: {name}\ndata: {json.dumps(data)}\n"
+    if event_id is not None:
+        lines += f"id: {event_id}\n"
+    return (lines + "\n").encode("utf-8")
+
+
+def _response_head(status, headers):
+    lines = [f"HTTP/1.1 {status}"] + [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+class _Client:
+    def __init__(self, writer):
+        self.writer = writer
+        self.held = []          # Events published while the client's replay was running
+        self.replaying = True
+
+
+class EventStreamServer:
+    """Server-sent event streams for many idle clients on one asyncio loop."""
+
+    def __init__(self, replay, host="0.0.0.0", port=5002, max_clients=DEFAULT_MAX_CLIENTS,
+                 heartbeat=DEFAULT_HEARTBEAT, max_buffer=DEFAULT_MAX_BUFFER):
+        self.replay = replay
+        self.host = host
+        self.port = port
+        self.max_clients = max_clients
+        self.heartbeat = heartbeat
+        self.max_buffer = max_buffer
+        self._clients = set()
+        self._loop = None
+        self._server = None
+        self._started = threading.Event()
+        self._error = None
+        self.published = 0
+        self.dropped = 0
+
+    # -------------------- Lifecycle --------------------
+
+    def start(self):
+        """Start serving in a daemon thread. Raises OSError if the port can't be bound."""
+        thread = threading.Thread(target=self._run, name="event-stream-server", daemon=True)
+        thread.start()
+        self._started.wait()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            server = loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, backlog=1024, limit=MAX_REQUEST_BYTES))
+        except OSError as e:
+            self._error = e
+            self._started.set()
+            loop.close()
+            return
+        self._loop = loop
+        loop.call_later(self.heartbeat, self._send_heartbeat)
+        self._server = server
+        self._started.set()
+        loop.run_forever()
+
+    # -------------------- Publishing --------------------
+
+    def publish(self, name, data=None, event_id=None):
+        """Send an event to every client. Safe to call from any thread; never blocks."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._broadcast, encode_event(name, data, event_id))
+
+    def _broadcast(self, chunk):
+        self.published += 1
+        for client in list(self._clients):
+            if client.replaying:
+                client.held.append(chunk)
+            else:
+                self._write(client, chunk)
+
+    def _send_heartbeat(self):
+        for client in list(self._clients):
+            if not client.replaying:
+                self._write(client, b": heartbeat\n\n")
+        self._loop.call_later(self.heartbeat, self._send_heartbeat)
+
+    def _write(self, client, chunk):
+        writer = client.writer
+        if writer.transport.is_closing():
+            self._clients.discard(client)
+            return
+        writer.write(chunk)
+        if writer.transport.get_write_buffer_size() > self.max_buffer:
+            # Too far behind; it resumes from its Last-Event-ID on reconnect
+            self.dropped += 1
+            self._clients.discard(client)
+            writer.transport.abort()
+
+    # -------------------- Connections --------------------
+
+    async def _handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+
+        lines = head.decode("latin-1").split("\r\n")
+        parts = lines[0].split()
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        url = urlsplit(parts[1]) if len(parts) == 3 else None
+
+        cors = {"Access-Control-Allow-Origin": "*", "Connection": "close"}
+        if url is None or parts[0] != "GET" or url.path != STREAM_PATH:
+            writer.write(_response_head("404 Not Found", {**cors, "Content-Length": "0"}))
+            await self._close(writer)
+            return
+        if len(self._clients) >= self.max_clients:
+            writer.write(_response_head("503 Service Unavailable",
+                                        {**cors, "Content-Length": "0", "Retry-After": str(self.heartbeat)}))
+            await self._close(writer)
+            return
+
+        since = headers.get("last-event-id") or (parse_qs(url.query).get("since") or [None])[0]
+        try:
+            since = int(since) if since else None
+        except ValueError:
+            since = None
+
+        client = _Client(writer)
+        self._clients.add(client)
+        try:
+            writer.write(_response_head("200 OK", {**cors, "Content-Type": "text/event-stream",
+                                                   "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}))
+            # Reconnect at most every few seconds
+            writer.write(b"retry: 5000\n\n")
+            events = await self._loop.run_in_executor(None, self.replay, since)
+            for event in events:
+                writer.write(encode_event(*event))
+            client.replaying = False
+            for chunk in client.held:
+                self._write(client, chunk)
+            client.held = []
+
+            # Idle until the browser goes away; the request has no body, so any read ends at EOF
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        except Exception as e:
+            print(f"Event stream client failed: {e}")
+        finally:
+            self._clients.discard(client)
+            await self._close(writer)
+
+    async def _close(self, writer):
+        # Let the response drain before the socket closes
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    def stats(self):
+        return {
+            "clients": len(self._clients),
+            "max_clients": self.max_clients,
+            "published": self.published,
+            "dropped": self.dropped,
+        }
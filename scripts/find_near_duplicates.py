@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Report near-duplicate images in the collages directory.
+
+Uses the persistent hash index (see hash_index.py) to find every pair of
+images whose perceptual hashes are within a Hamming distance threshold, e.g.
+re-encoded or slightly cropped copies of the same source. Nothing is deleted;
+the report is for review.
+
+Usage:
+    python find_near_duplicates.py --threshold 5
+    python find_near_duplicates.py --threshold 10 --hash phash
+    python find_near_duplicates.py --threshold 8 --json > near_duplicates.json
+"""
+
+import sys
+import json
+import time
+import argparse
+from contextlib import redirect_stdout
+
+from image_processor import hash_index, metadata_store, NEAR_DUPLICATE_THRESHOLD, NEAR_DUPLICATE_HASH
+from image_hashing import HASH_KINDS
+
+def describe(filename):
+    """Short description of an image for the report."""
+    entry = metadata_store.get_by_src(filename)
+    if not entry:
+        return "(no metadata)"
+    description = entry.get('description') or ""
+    return description[:60] + ("..." if len(description) > 60 else "")
+
+def report_near_duplicates(threshold, kind=NEAR_DUPLICATE_HASH, as_json=False):
+    """Print all near-duplicate pairs within the threshold."""
+    # Keep progress output out of the way of a JSON report
+    with redirect_stdout(sys.stderr if as_json else sys.stdout):
+        hash_index.refresh()
+
+    start = time.perf_counter()
+    pairs = hash_index.near_duplicate_pairs(threshold, kind=kind)
+    elapsed = time.perf_counter() - start
+
+    if as_json:
+        print(json.dumps([
+            {'image': a, 'match': b, 'distance': distance}
+            for a, b, distance in pairs
+        ], indent=2))
+        return pairs
+
+    print(f"\nFound {len(pairs)} near-duplicate pairs (threshold: {threshold}, hash: {kind}, search took {elapsed * 1000:.1f} ms)")
+    for a, b, distance in pairs:
+        print(f"\n[distance {distance}]")
+        print(f"  {a}: {describe(a)}")
+        print(f"  {b}: {describe(b)}")
+    return pairs
+
+def main():
+    parser = argparse.ArgumentParser(description="Report near-duplicate images")
+    parser.add_argument("--threshold", "-t", type=int, default=NEAR_DUPLICATE_THRESHOLD,
+                        help=f"Maximum Hamming distance between hashes (default: {NEAR_DUPLICATE_THRESHOLD})")
+    parser.add_argument("--hash", choices=HASH_KINDS, default=NEAR_DUPLICATE_HASH,
+                        help=f"Hash to compare (default: {NEAR_DUPLICATE_HASH})")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    args = parser.parse_args()
+    report_near_duplicates(args.threshold, args.hash, args.json)
+
+if __name__ == "__main__":
+    main()
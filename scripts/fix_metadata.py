@@ -5,8 +5,10 @@ Fix metadata.json to ensure consistent format for all images
 """
 
 import os
-import json
 import sys
+import shutil
+
+from metadata_store import MetadataStore
 
 # Get the absolute path to the script
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -23,56 +25,54 @@ def fix_metadata():
     
     print(f"Processing metadata file: {METADATA_FILE}")
     
+    # Backup original file
+    backup_file = f"{METADATA_FILE}.backup"
+    print(f"Creating backup at {backup_file}")
+    shutil.copy2(METADATA_FILE, backup_file)
+    
     # Load the existing metadata
-    with open(METADATA_FILE, 'r') as f:
-        metadata = json.load(f)
+    store = MetadataStore(METADATA_FILE)
+    metadata = store.all()
     
     print(f"Found {len(metadata)} entries in metadata.json")
     
     # Track different formats
     with_src = 0
     with_path = 0
+    invalid_ids = []
     
     # Update each entry to use consistent format
-    updated_metadata = []
-    for entry in metadata:
-        # Convert "path" to "src" if it exists
-        if 'path' in entry:
-            filename = os.path.basename(entry['path'])
-            entry['src'] = filename
-            del entry['path']
-            with_path += 1
-        
-        # Verify src field exists
-        if 'src' not in entry:
-            print(f"Warning: Entry without src field: {entry}")
-            continue
-        
-        with_src += 1
+    with store.batch():
+        for entry in metadata:
+            # Convert "path" to "src" if it exists
+            if 'path' in entry:
+                filename = os.path.basename(entry['path'])
+                entry['src'] = filename
+                del entry['path']
+                store.put(entry)
+                with_path += 1
+            
+            # Verify src field exists
+            if 'src' not in entry:
+                print(f"Warning: Entry without src field: {entry}")
+                invalid_ids.append(entry['id'])
+                continue
+            
+            with_src += 1
+            
+            # Verify the image file exists
+            image_path = os.path.join(COLLAGES_DIR, entry['src'])
+            if not os.path.exists(image_path):
+                print(f"Warning: Image file not found: {image_path}")
         
-        # Verify the image file exists
-        image_path = os.path.join(COLLAGES_DIR, entry['src'])
-        if not os.path.exists(image_path):
-            print(f"Warning: Image file not found: {image_path}")
-        
-        updated_metadata.append(entry)
+        store.remove(invalid_ids)
     
     print(f"Statistics:")
     print(f"- Entries with 'src': {with_src}")
     print(f"- Entries with 'path' (converted): {with_path}")
-    print(f"- Total valid entries: {len(updated_metadata)}")
-    
-    # Backup original file
-    backup_file = f"{METADATA_FILE}.backup"
-    print(f"Creating backup at {backup_file}")
-    with open(backup_file, 'w') as f:
-        json.dump(metadata, f, indent=2)
-    
-    # Save the updated metadata
-    print(f"Saving updated metadata to {METADATA_FILE}")
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(updated_metadata, f, indent=2)
+    print(f"- Total valid entries: {store.count()}")
     
+    print(f"Saved updated metadata to {METADATA_FILE}")
     print(f"Metadata updated successfully")
 
 if __name__ == "__main__":
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Perceptual Hash Index for Assemblage
+
+Keeps the perceptual hashes (aHash, dHash, pHash) of every image in the
+collages directory in a table next to the image metadata, so duplicate checks
+are lookups instead of re-hashing the whole collection. Cached hashes are
+keyed by file mtime and size (and the hashing pipeline version) and are only
+recomputed when a file changes.
+
+Near-duplicate queries (Hamming distance <= threshold) go through an in-memory
+multi-index hash: the 64-bit hash is split into chunks, and by the pigeonhole
+principle any match within distance r agrees with the query to within r // m
+bits in at least one of the m chunks. Only those buckets are scanned, which
+keeps queries sub-linear in the collection size.
+
+Usage:
+    from hash_index import HashIndex
+
+    index = HashIndex(db_path, collages_dir)
+    index.refresh()                              # hash new/changed files, drop removed ones
+    index.lookup(image_hash)                     # filenames with exactly this aHash
+    index.find_near(image_hash, 5)               # [(filename, distance), ...]
+    index.find_near(phash, 8, kind='phash')      # same, over pHash values
+"""
+
+import os
+import sqlite3
+import threading
+from itertools import combinations
+
+from image_hashing import HASH_KINDS, HASH_VERSION, hash_files
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_hashes (
+    filename TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    ahash TEXT NOT NULL,
+    dhash TEXT,
+    phash TEXT,
+    version INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Columns added after the first version of the table
+MIGRATIONS = [
+    ('dhash', 'TEXT'),
+    ('phash', 'TEXT'),
+    ('version', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+
+class MultiIndexHash:
+    """Multi-index hashing over fixed-width integer hashes for Hamming-radius queries."""
+
+    def __init__(self, bits=64, chunks=4):
+        if bits % chunks:
+            raise ValueError("bits must be divisible by chunks")
+        self.bits = bits
+        self.chunks = chunks
+        self.chunk_bits = bits // chunks
+        self.chunk_mask = (1 << self.chunk_bits) - 1
+        self._values = {}
+        self._buckets = [{} for _ in range(chunks)]
+        self._flip_masks = {}
+
+    def __len__(self):
+        return len(self._values)
+
+    def _split(self, value):
+        return [(value >> (i * self.chunk_bits)) & self.chunk_mask for i in range(self.chunks)]
+
+    def _masks(self, radius):
+        """All chunk-width masks with at most `radius` bits set."""
+        if radius not in self._flip_masks:
+            masks = [0]
+            for r in range(1, radius + 1):
+                for positions in combinations(range(self.chunk_bits), r):
+                    masks.append(sum(1 << p for p in positions))
+            self._flip_masks[radius] = masks
+        return self._flip_masks[radius]
+
+    def add(self, key, value):
+        if key in self._values:
+            self.remove(key)
+        self._values[key] = value
+        for bucket, chunk in zip(self._buckets, self._split(value)):
+            bucket.setdefault(chunk, set()).add(key)
+
+    def remove(self, key):
+        value = self._values.pop(key, None)
+        if value is None:
+            return
+        for bucket, chunk in zip(self._buckets, self._split(value)):
+            keys = bucket.get(chunk)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del bucket[chunk]
+
+    def query(self, value, max_distance):
+        """Return [(key, distance), ...] within max_distance, closest first."""
+        masks = self._masks(min(max_distance // self.chunks, self.chunk_bits))
+        candidates = set()
+        for bucket, chunk in zip(self._buckets, self._split(value)):
+            for mask in masks:
+                keys = bucket.get(chunk ^ mask)
+                if keys:
+                    candidates.update(keys)
+
+        results = []
+        for key in candidates:
+            distance = bin(self._values[key] ^ value).count("1")
+            if distance <= max_distance:
+                results.append((key, distance))
+        results.sort(key=lambda item: (item[1], item[0]))
+        return results
+
+
+class HashIndex:
+    """Persistent filename -> perceptual hashes index for one image directory."""
+
+    def __init__(self, db_path, image_dir, extensions=('.jpg',)):
+        self.db_path = db_path
+        self.image_dir = image_dir
+        self.extensions = extensions
+        self._lock = threading.RLock()
+        self._near = {}
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Add hash columns missing from tables created by older versions."""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(image_hashes)")}
+        with self._conn:
+            for column, definition in MIGRATIONS:
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE image_hashes ADD COLUMN {column} {definition}")
+            for kind in HASH_KINDS:
+                self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_image_hashes_{kind} ON image_hashes({kind})")
+
+    def _near_index(self, kind):
+        """Build the in-memory multi-index hash for one hash kind on first use."""
+        if kind not in HASH_KINDS:
+            raise ValueError(f"Unknown hash kind: {kind}")
+        if kind not in self._near:
+            near = MultiIndexHash()
+            for filename, image_hash in self._conn.execute(
+                f"SELECT filename, {kind} FROM image_hashes WHERE version = ?", (HASH_VERSION,)
+            ):
+                near.add(filename, int(image_hash, 16))
+            self._near[kind] = near
+        return self._near[kind]
+
+    def _store(self, filename, mtime_ns, size, hashes):
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO image_hashes (filename, mtime_ns, size, ahash, dhash, phash, version) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (filename, mtime_ns, size, hashes['ahash'], hashes['dhash'], hashes['phash'], HASH_VERSION),
+            )
+        for kind, near in self._near.items():
+            near.add(filename, int(hashes[kind], 16))
+
+    def _stat(self, filename):
+        st = os.stat(os.path.join(self.image_dir, filename))
+        return st.st_mtime_ns, st.st_size
+
+    def _cached(self, filename, mtime_ns, size):
+        row = self._conn.execute(
+            "SELECT ahash, dhash, phash FROM image_hashes "
+            "WHERE filename = ? AND mtime_ns = ? AND size = ? AND version = ?",
+            (filename, mtime_ns, size, HASH_VERSION),
+        ).fetchone()
+        return dict(zip(HASH_KINDS, row)) if row else None
+
+    def hash_file(self, filename):
+        """Return the hashes for a file in the image directory, computing them only if the file changed."""
+        with self._lock:
+            mtime_ns, size = self._stat(filename)
+            hashes = self._cached(filename, mtime_ns, size)
+            if hashes is not None:
+                return hashes
+
+            hashes = hash_files([os.path.join(self.image_dir, filename)])[0]
+            if hashes is not None:
+                self._store(filename, mtime_ns, size, hashes)
+            return hashes
+
+    def add(self, filename, hashes=None):
+        """Record a newly added file. Pass its hashes if they are already known."""
+        if hashes is None:
+            return self.hash_file(filename)
+        with self._lock:
+            mtime_ns, size = self._stat(filename)
+            self._store(filename, mtime_ns, size, hashes)
+        return hashes
+
+    def remove(self, filename):
+        """Forget a file that was removed from the image directory."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM image_hashes WHERE filename = ?", (filename,))
+            for near in self._near.values():
+                near.remove(filename)
+
+    def lookup(self, image_hash, kind='ahash'):
+        """Return the filenames whose hash of the given kind equals image_hash."""
+        if kind not in HASH_KINDS:
+            raise ValueError(f"Unknown hash kind: {kind}")
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT filename FROM image_hashes WHERE {kind} = ? AND version = ? ORDER BY filename",
+                (image_hash, HASH_VERSION),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def find_near(self, image_hash, max_distance, kind='ahash', exclude=None):
+        """Return [(filename, distance), ...] with Hamming distance <= max_distance, closest first."""
+        with self._lock:
+            matches = self._near_index(kind).query(int(image_hash, 16), max_distance)
+        return [(filename, distance) for filename, distance in matches if filename != exclude]
+
+    def near_duplicate_pairs(self, max_distance, kind='ahash'):
+        """Return every (filename_a, filename_b, distance) pair within max_distance."""
+        with self._lock:
+            near = self._near_index(kind)
+            pairs = []
+            for filename, image_hash in self._conn.execute(
+                f"SELECT filename, {kind} FROM image_hashes WHERE version = ? ORDER BY filename", (HASH_VERSION,)
+            ):
+                for other, distance in near.query(int(image_hash, 16), max_distance):
+                    if other > filename:
+                        pairs.append((filename, other, distance))
+        pairs.sort(key=lambda pair: (pair[2], pair[0], pair[1]))
+        return pairs
+
+    def refresh(self):
+        """Bring the index in line with the image directory.
+
+        Returns a list of (filename, hashes) pairs in directory order. Only new
+        or modified files are decoded (hashed together in vectorized batches);
+        rows for deleted files are dropped.
+        """
+        with self._lock:
+            entries = []
+            pending = []
+            for filename in os.listdir(self.image_dir):
+                if not filename.lower().endswith(self.extensions):
+                    continue
+                mtime_ns, size = self._stat(filename)
+                hashes = self._cached(filename, mtime_ns, size)
+                if hashes is None:
+                    pending.append((len(entries), filename, mtime_ns, size))
+                entries.append((filename, hashes))
+
+            computed = hash_files([os.path.join(self.image_dir, filename) for _, filename, _, _ in pending])
+            for (position, filename, mtime_ns, size), hashes in zip(pending, computed):
+                if hashes is not None:
+                    self._store(filename, mtime_ns, size, hashes)
+                entries[position] = (filename, hashes)
+            entries = [(filename, hashes) for filename, hashes in entries if hashes is not None]
+
+            present = {filename for filename, _ in entries}
+            stale = [
+                row[0] for row in self._conn.execute("SELECT filename FROM image_hashes")
+                if row[0] not in present
+            ]
+            with self._conn:
+                self._conn.executemany("DELETE FROM image_hashes WHERE filename = ?", [(f,) for f in stale])
+            for near in self._near.values():
+                for filename in stale:
+                    near.remove(filename)
+
+        print(f"✓ Hash index up to date ({len(entries)} images, {len(pending)} hashed, {len(stale)} dropped)")
+        return entries
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Decoded Image Cache for Assemblage
+
+Keeps recently decoded collection images in memory so code that touches the
+same files over and over (hashing, reprocessing, the collage renderer)
+decodes each JPEG once rather than on every use. Entries are keyed by path
+and mode ("RGB", or "L" for luminance only) and are invalidated when the
+file's mtime or size changes. Each image is decoded at a reduced JPEG scale
+that still covers the largest size asked of it so far (see image_io.py).
+
+The cache holds at most max_bytes of pixel data, evicting the least recently
+used images beyond that, and counts hits, misses and evictions. File headers
+(format, size, info) are cached alongside, so checks that only need those
+don't reopen the file.
+
+Usage:
+    from image_cache import shared_cache
+
+    cache = shared_cache()
+    img = cache.get("/path/to/image.jpg", (600, 450))   # RGB PIL image to be resized to 600x450; do not modify
+    cache.header("/path/to/image.jpg")                  # {"format", "size", "mode", "info"}
+    cache.stats()
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from image_io import reduce_for
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+MAX_HEADERS = 10000
+MODES = ("RGB", "L")
+
+
+def image_bytes(img):
+    """Memory held by an image's pixel data."""
+    return img.width * img.height * len(img.getbands())
+
+
+def _covers(decoded_for, size):
+    """Whether a decode made for box decoded_for (None = full size) also serves box size."""
+    if decoded_for is None:
+        return True
+    return size is not None and size[0] <= decoded_for[0] and size[1] <= decoded_for[1]
+
+
+class DecodedImageCache:
+    """LRU cache of decoded images with a byte budget."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # (path, mode) -> (mtime_ns, file size, decoded image, box decoded for or None if full size)
+        self._images = OrderedDict()
+        self._headers = OrderedDict()  # path -> (mtime_ns, file size, header)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, size=None, mode="RGB"):
+        """Decoded image for a caller that will resize it to size (width, height), or full size if None.
+
+        As with image_io.reduce_for, JPEGs are decoded at the smallest DCT
+        scale that leaves both sides at least twice size. The returned image
+        is shared: callers must copy it before modifying.
+        """
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of: {', '.join(MODES)}")
+        st = os.stat(path)
+        key = (path, mode)
+        with self._lock:
+            cached = self._images.get(key)
+            if cached and cached[:2] == (st.st_mtime_ns, st.st_size) and _covers(cached[3], size):
+                self._images.move_to_end(key)
+                self.hits += 1
+                return cached[2]
+            self.misses += 1
+
+        img, decoded_for = self._decode(path, size, mode, st)
+        self._store(key, (st.st_mtime_ns, st.st_size, img, decoded_for))
+        return img
+
+    def header(self, path):
+        """Format, size, mode and info of an image file, without decoding it."""
+        st = os.stat(path)
+        with self._lock:
+            cached = self._headers.get(path)
+            if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+                self._headers.move_to_end(path)
+                return cached[2]
+
+        with Image.open(path) as img:
+            header = {"format": img.format, "size": img.size, "mode": img.mode, "info": dict(img.info)}
+        self._remember_header(path, st, header)
+        return header
+
+    def _remember_header(self, path, st, header):
+        with self._lock:
+            self._headers[path] = (st.st_mtime_ns, st.st_size, header)
+            self._headers.move_to_end(path)
+            while len(self._headers) > MAX_HEADERS:
+                self._headers.popitem(last=False)
+
+    def _decode(self, path, size, mode, st):
+        with Image.open(path) as img:
+            self._remember_header(path, st, {"format": img.format, "size": img.size, "mode": img.mode, "info": dict(img.info)})
+            full_size = img.size
+            if size is not None:
+                reduce_for(img, size, "L" if mode == "L" else None)
+            decoded = img.convert(mode)
+        # A decode that came out at full size serves every later request
+        return decoded, (None if decoded.size == full_size else tuple(size))
+
+    def _store(self, key, entry):
+        size = image_bytes(entry[2])
+        with self._lock:
+            previous = self._images.pop(key, None)
+            if previous:
+                self.bytes -= image_bytes(previous[2])
+            if size > self.max_bytes:
+                return
+            self._images[key] = entry
+            self.bytes += size
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used images until within budget. Caller holds the lock."""
+        while self.bytes > self.max_bytes and self._images:
+            _, entry = self._images.popitem(last=False)
+            self.bytes -= image_bytes(entry[2])
+            self.evictions += 1
+
+    def resize(self, max_bytes):
+        """Change the byte budget, evicting as needed."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._headers.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._images),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "headers": len(self._headers),
+            }
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache(max_bytes=None):
+    """The process-wide cache. max_bytes, if given, sets its budget."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = DecodedImageCache(max_bytes if max_bytes is not None else DEFAULT_MAX_BYTES)
+        elif max_bytes is not None:
+            _shared.resize(max_bytes)
+        return _shared
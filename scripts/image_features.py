@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Image Features for Assemblage
+
+Computes a compact description of each collection image at ingest, so the
+collage generators can place and crop fragments by what is in them instead
+of guessing at runtime. Everything is measured with NumPy on a 128px
+grayscale version of the image:
+
+    brightness    mean luminance, 0-1
+    contrast      RMS contrast (standard deviation of luminance), 0-1
+    histogram     16-bin luminance histogram, fractions of the pixels
+    edge_density  fraction of pixels on a strong edge
+    saliency      8x8 grid of interest, one hex digit (0-f) per cell, rows top to bottom
+    focus         centroid of interest [x, y], as fractions of the width and height
+    crop          box holding most of the interest [left, top, right, bottom], as fractions
+
+Interest combines how far a pixel is from the background (estimated from the
+image border; most fragments are cut-outs on paper) with local edge strength.
+
+Metadata entries record the result under "features":
+
+    "features": {"version": 1, "brightness": 0.71, "contrast": 0.28, ..., "focus": [0.46, 0.38], ...}
+
+Usage:
+    python image_features.py                  # backfill every image in images/metadata.json
+    python image_features.py --workers 0      # one worker process per CPU
+    python image_features.py --force          # recompute even if up to date
+
+    from image_features import image_features
+    features = image_features("/path/to/image.jpg")
+"""
+
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from image_cache import shared_cache
+from image_io import fit_size
+from metadata_store import MetadataStore
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+IMAGES_DIR = os.path.join(ROOT_DIR, "images")
+COLLAGES_DIR = os.path.join(IMAGES_DIR, "collages")
+METADATA_FILE = os.path.join(IMAGES_DIR, "metadata.json")
+
+# Bump when the features change so backfill recomputes them
+FEATURES_VERSION = 1
+
+ANALYSIS_SIZE = 128
+HISTOGRAM_BINS = 16
+SALIENCY_GRID = 8
+EDGE_THRESHOLD = 0.1   # Gradient magnitude (luminance 0-1 per pixel) counted as an edge
+CROP_MASS = 0.9        # Share of the interest the crop box keeps
+CROP_PADDING = 0.04
+
+
+def _normalized(values):
+    peak = values.max()
+    return values / peak if peak > 0 else values
+
+
+def _gradient_magnitude(luma):
+    """Central-difference gradient magnitude, same shape as luma (edges replicated)."""
+    padded = np.pad(luma, 1, mode="edge")
+    dx = (padded[1:-1, 2:] - padded[1:-1, :-2]) / 2
+    dy = (padded[2:, 1:-1] - padded[:-2, 1:-1]) / 2
+    return np.hypot(dx, dy)
+
+
+def _box_blur(values, radius=2):
+    """Mean over a (2r+1)^2 window, via a summed-area table."""
+    padded = np.pad(values, radius, mode="edge")
+    table = np.pad(padded.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    size = 2 * radius + 1
+    height, width = values.shape
+    window = (table[size:size + height, size:size + width] - table[:height, size:size + width]
+              - table[size:size + height, :width] + table[:height, :width])
+    return window / (size * size)
+
+
+def _pool(values, grid):
+    """Mean of values over a grid x grid layout of cells."""
+    rows = np.linspace(0, values.shape[0], grid + 1).astype(int)
+    columns = np.linspace(0, values.shape[1], grid + 1).astype(int)
+    sums = np.add.reduceat(np.add.reduceat(values, rows[:-1], axis=0), columns[:-1], axis=1)
+    counts = np.outer(np.diff(rows), np.diff(columns))
+    return sums / np.maximum(counts, 1)
+
+
+def _mass_bounds(weights, mass):
+    """Fractional span of a 1-D weight profile holding the central `mass` of its total."""
+    cumulative = np.cumsum(weights) / weights.sum()
+    tail = (1 - mass) / 2
+    start = int(np.searchsorted(cumulative, tail))
+    end = int(np.searchsorted(cumulative, 1 - tail)) + 1
+    return start / len(weights), min(end, len(weights)) / len(weights)
+
+
+def compute_features(luma):
+    """Features of a 2-D luminance array with values in [0, 1]."""
+    histogram, _ = np.histogram(luma, bins=HISTOGRAM_BINS, range=(0.0, 1.0))
+    gradient = _gradient_magnitude(luma)
+
+    # Background: the median of the border pixels
+    border = np.concatenate([luma[0], luma[-1], luma[1:-1, 0], luma[1:-1, -1]])
+    distinct = np.abs(luma - np.median(border))
+    interest = 0.5 * _normalized(distinct) + 0.5 * _normalized(_box_blur(gradient))
+
+    height, width = luma.shape
+    total = interest.sum()
+    if total > 0:
+        focus = [float((interest.sum(0) * (np.arange(width) + 0.5)).sum() / total / width),
+                 float((interest.sum(1) * (np.arange(height) + 0.5)).sum() / total / height)]
+        left, right = _mass_bounds(interest.sum(0), CROP_MASS)
+        top, bottom = _mass_bounds(interest.sum(1), CROP_MASS)
+        crop = [max(0.0, left - CROP_PADDING), max(0.0, top - CROP_PADDING),
+                min(1.0, right + CROP_PADDING), min(1.0, bottom + CROP_PADDING)]
+    else:
+        focus, crop = [0.5, 0.5], [0.0, 0.0, 1.0, 1.0]
+
+    cells = np.rint(_normalized(_pool(interest, SALIENCY_GRID)) * 15).astype(int)
+    return {
+        "version": FEATURES_VERSION,
+        "brightness": round(float(luma.mean()), 3),
+        "contrast": round(float(luma.std()), 3),
+        "histogram": [round(float(count), 3) for count in histogram / luma.size],
+        "edge_density": round(float((gradient > EDGE_THRESHOLD).mean()), 3),
+        "saliency": ["".join(f"{cell:x}" for cell in row) for row in cells],
+        "focus": [round(value, 3) for value in focus],
+        "crop": [round(value, 3) for value in crop],
+    }
+
+
+def image_features(image_path):
+    """Features of an image file (decoded through the shared image cache)."""
+    cache = shared_cache()
+    size = fit_size(cache.header(image_path)["size"], (ANALYSIS_SIZE, ANALYSIS_SIZE))
+    img = cache.get(image_path, size, mode="L")
+    if img.size != size:
+        img = img.resize(size, Image.Resampling.BOX)
+    return compute_features(np.asarray(img, dtype=np.float32) / 255)
+
+
+def _backfill_one(task):
+    image_id, source_path = task
+    try:
+        return image_id, image_features(source_path), None
+    except Exception as e:
+        return image_id, None, str(e)
+
+
+def backfill(metadata_file=METADATA_FILE, collages_dir=COLLAGES_DIR, workers=1, force=False):
+    """Compute features for every image in the metadata that lacks current ones and record them."""
+    store = MetadataStore(metadata_file)
+    tasks = []
+    for entry in store.all():
+        if not force and (entry.get("features") or {}).get("version") == FEATURES_VERSION:
+            continue
+        source_path = os.path.join(collages_dir, os.path.basename(entry["src"]))
+        if not os.path.exists(source_path):
+            print(f"Warning: Image file not found: {source_path}")
+            continue
+        tasks.append((entry["id"], source_path))
+
+    print(f"Computing features for {len(tasks)} images with {workers} worker(s)")
+    done = errors = 0
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        results = executor.map(_backfill_one, tasks, chunksize=8) if executor else map(_backfill_one, tasks)
+        with store.batch():
+            for image_id, features, error in results:
+                if error:
+                    print(f"Error computing features for {image_id}: {error}")
+                    errors += 1
+                    continue
+                store.update(image_id, features=features)
+                done += 1
+                if done % 50 == 0:
+                    print(f"  {done}/{len(tasks)}")
+    finally:
+        if executor:
+            executor.shutdown()
+    print(f"Done: {done} images, {errors} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute luminance, contrast, saliency and crop features for the collection")
+    parser.add_argument("--metadata", "-m", default=METADATA_FILE, help="Path to metadata.json")
+    parser.add_argument("--input", "-i", default=COLLAGES_DIR, help="Directory containing the collection images")
+    parser.add_argument("--workers", "-w", type=int, default=1, help="Worker processes (0 = one per CPU, default: 1)")
+    parser.add_argument("--force", action="store_true", help="Recompute features that are already up to date")
+    args = parser.parse_args()
+
+    workers = args.workers if args.workers > 0 else os.cpu_count() or 1
+    backfill(args.metadata, args.input, workers, args.force)
+
+
+if __name__ == "__main__":
+    main()
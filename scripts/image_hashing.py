@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Perceptual Image Hashing for Assemblage
+
+NumPy implementations of three 64-bit perceptual hashes:
+
+- aHash: 8x8 grayscale thumbnail, each bit is pixel >= mean
+- dHash: 9x8 grayscale thumbnail, each bit is pixel > left neighbour
+- pHash: 32x32 grayscale thumbnail, 2D DCT, each bit of the low 8x8
+  frequencies is coefficient > median
+
+The hash functions work on uint8 arrays with any number of leading batch
+dimensions and return packed uint64 values (bit order matches the original
+string-based hash: first pixel is the most significant bit). Only the resize
+to thumbnail size goes through Pillow, and JPEGs are decoded in draft mode
+(luminance only, reduced DCT scale) since the largest thumbnail is 32x32.
+Decodes go through the shared decoded image cache, so hashing a file again
+(duplicate checks, index rebuilds) doesn't touch the disk.
+
+Usage:
+    from image_hashing import hash_image_file, hash_files
+
+    hashes = hash_image_file("/path/to/image.jpg")   # {'ahash': '...', 'dhash': '...', 'phash': '...'}
+    all_hashes = hash_files(paths)                    # batched, one dict (or None) per path
+"""
+
+import numpy as np
+from PIL import Image
+
+from image_cache import shared_cache
+
+HASH_KINDS = ('ahash', 'dhash', 'phash')
+
+# Bump when the hashing pipeline changes so cached hashes get recomputed
+HASH_VERSION = 3
+
+# Thumbnail (width, height) each hash is computed from
+THUMBNAIL_SIZES = {'ahash': (8, 8), 'dhash': (9, 8), 'phash': (32, 32)}
+PHASH_LOW_FREQ = 8
+
+# Smallest size files are decoded at before thumbnailing
+DECODE_SIZE = (32, 32)
+
+BATCH_SIZE = 256
+
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II matrix of size n x n."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0, :] = np.sqrt(1.0 / n)
+    return matrix
+
+
+_DCT = _dct_matrix(THUMBNAIL_SIZES['phash'][0])
+
+
+def pack_bits(bits):
+    """Pack a (..., 64) boolean array into (...) uint64 values, first bit most significant."""
+    packed = np.packbits(bits.astype(np.uint8), axis=-1)
+    return packed.view('>u8')[..., 0].astype(np.uint64)
+
+
+def ahash(pixels):
+    """Average hash of (..., 8, 8) uint8 grayscale pixels."""
+    pixels = np.asarray(pixels, dtype=np.float32)
+    flat = pixels.reshape(pixels.shape[:-2] + (-1,))
+    return pack_bits(flat >= flat.mean(axis=-1, keepdims=True))
+
+
+def dhash(pixels):
+    """Difference hash of (..., 8, 9) uint8 grayscale pixels (rows, columns)."""
+    pixels = np.asarray(pixels, dtype=np.int16)
+    bits = pixels[..., :, 1:] > pixels[..., :, :-1]
+    return pack_bits(bits.reshape(bits.shape[:-2] + (-1,)))
+
+
+def phash(pixels):
+    """DCT hash of (..., 32, 32) uint8 grayscale pixels."""
+    pixels = np.asarray(pixels, dtype=np.float64)
+    coeffs = _DCT @ pixels @ _DCT.T
+    low = coeffs[..., :PHASH_LOW_FREQ, :PHASH_LOW_FREQ].reshape(pixels.shape[:-2] + (-1,))
+    # Exclude the DC term from the median; it only tracks overall brightness
+    median = np.median(low[..., 1:], axis=-1, keepdims=True)
+    return pack_bits(low > median)
+
+
+def to_hex(value):
+    """Format a packed hash as the 16-character hex string stored in the index."""
+    return f"{int(value):016x}"
+
+
+def thumbnails(img, kinds=HASH_KINDS):
+    """Grayscale thumbnails for each hash kind, as uint8 arrays."""
+    gray = img.convert('L')
+    return {
+        kind: np.asarray(gray.resize(THUMBNAIL_SIZES[kind], Image.Resampling.BOX), dtype=np.uint8)
+        for kind in kinds
+    }
+
+
+HASH_FUNCS = {'ahash': ahash, 'dhash': dhash, 'phash': phash}
+
+
+def hash_batch(images, kind='ahash'):
+    """Hash a batch of PIL images (or uint8 grayscale thumbnails) with one vectorized call.
+
+    Returns a uint64 array with one hash per image.
+    """
+    arrays = [
+        thumbnails(image, (kind,))[kind] if isinstance(image, Image.Image) else np.asarray(image, dtype=np.uint8)
+        for image in images
+    ]
+    if not arrays:
+        return np.empty(0, dtype=np.uint64)
+    return HASH_FUNCS[kind](np.stack(arrays))
+
+
+def hash_image(img):
+    """Return {'ahash', 'dhash', 'phash'} hex hashes for a PIL image."""
+    thumbs = thumbnails(img)
+    return {kind: to_hex(HASH_FUNCS[kind](thumbs[kind])) for kind in HASH_KINDS}
+
+
+def hash_image_file(image_path):
+    """Return {'ahash', 'dhash', 'phash'} hex hashes for an image file."""
+    return hash_image(shared_cache().get(image_path, DECODE_SIZE, mode='L'))
+
+
+def hash_files(paths):
+    """Hash many image files, vectorizing the hash math across batches.
+
+    Returns a list aligned with paths: a hash dict per file, or None if the
+    file could not be read.
+    """
+    results = [None] * len(paths)
+    for start in range(0, len(paths), BATCH_SIZE):
+        positions = []
+        thumbs = {kind: [] for kind in HASH_KINDS}
+        for position in range(start, min(start + BATCH_SIZE, len(paths))):
+            try:
+                image_thumbs = thumbnails(shared_cache().get(paths[position], DECODE_SIZE, mode='L'))
+            except Exception as e:
+                print(f"Error computing hash for {paths[position]}: {e}")
+                continue
+            positions.append(position)
+            for kind in HASH_KINDS:
+                thumbs[kind].append(image_thumbs[kind])
+
+        if not positions:
+            continue
+        packed = {kind: HASH_FUNCS[kind](np.stack(thumbs[kind])) for kind in HASH_KINDS}
+        for offset, position in enumerate(positions):
+            results[position] = {kind: to_hex(packed[kind][offset]) for kind in HASH_KINDS}
+    return results
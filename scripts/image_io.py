@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Reduced-scale image decoding for Assemblage
+
+Hashing, thumbnails and analysis only need a small version of each image, but
+a plain Image.open() + resize() decodes the full-resolution JPEG first. JPEG
+supports decoding directly at 1/2, 1/4 or 1/8 scale (DCT scaling), which PIL
+exposes as draft mode. The helpers here request the smallest scale that still
+leaves `reducing_gap` times the target size, so the final resize keeps its
+quality while decode time and memory drop several-fold on large uploads.
+
+Non-JPEG images are returned unchanged.
+
+Usage:
+    from image_io import open_reduced, reduce_for
+
+    with open_reduced(path, (64, 64), mode='L') as img:
+        ...
+
+    with Image.open(path) as img:
+        original_size = img.size
+        reduce_for(img, (800, 800))
+"""
+
+from PIL import Image
+
+DEFAULT_REDUCING_GAP = 2.0
+
+
+def reduce_for(img, size, mode=None, reducing_gap=DEFAULT_REDUCING_GAP):
+    """Configure a freshly opened image to decode at a reduced scale.
+
+    Must be called before the pixel data is loaded. `size` is the final size
+    the caller will resize to; `mode` may be 'L' to decode only the luminance
+    channel of a colour JPEG. Returns the image for chaining.
+    """
+    if img.format != 'JPEG':
+        return img
+    width, height = size
+    draft_size = (max(1, int(width * reducing_gap)), max(1, int(height * reducing_gap)))
+    img.draft(mode, draft_size)
+    return img
+
+
+def open_reduced(path, size, mode=None, reducing_gap=DEFAULT_REDUCING_GAP):
+    """Open an image decoded at the smallest JPEG scale that covers size * reducing_gap."""
+    img = Image.open(path)
+    return reduce_for(img, size, mode, reducing_gap)
+
+
+def fit_size(image_size, max_size):
+    """Size of image_size scaled to fit within max_size, preserving aspect ratio."""
+    width, height = image_size
+    max_width, max_height = max_size
+    ratio = min(max_width / width, max_height / height)
+    return max(1, int(width * ratio)), max(1, int(height * ratio))
@@ -4,8 +4,20 @@ Image Processor for Assemblage
 
 This script handles:
 1. Processing uploaded images (resize, convert to B&W if needed)
-2. Updating metadata.json with new image information
+2. Updating metadata.json with new image information (including
+   precomputed visual features; see image_features.py)
 3. Serving a simple API endpoint for the upload tool to interact with
+   (uploads are queued and processed by background workers; see /jobs/<id>)
+4. Serving metadata.json with ETags, plus /metadata/changes?since=<version>
+   so clients can fetch only what changed, and /metadata/events to push
+   changes to open pages as they happen (served from an asyncio loop on
+   EVENT_STREAM_PORT; see event_stream_server.py)
+5. Querying the collection by tag with field selection and cursor
+   pagination (/api/images), and drawing random images that match a tag
+   expression (/api/sample)
+6. Rendering collages on the server for clients that can't (/api/render)
+7. Packing the collection into sprite sheets for the mosaic and tiling
+   generators (/api/atlases/<tile size>)
 
 Usage:
     python image_processor.py
@@ -13,7 +25,9 @@ Usage:
 Requirements:
     - Python 3.6+
     - Pillow (PIL) for image processing
+    - NumPy for perceptual hashing
     - Flask for the web server
+    - brotli (optional) for Brotli-compressed metadata.json
 """
 
 import os
@@ -21,16 +35,30 @@ import sys
 import json
 import uuid
 import time
+import threading
 from datetime import datetime
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory
 from flask_cors import CORS
 from PIL import Image, ImageOps
 import shutil
-import openai
 import requests
 from io import BytesIO
-from config import OPENAI_API_KEY, IMAGE_PROCESSOR_PORT, TARGET_SIZE, JPEG_QUALITY, CONVERT_TO_BW
-import base64
+from config import OPENAI_API_KEY, IMAGE_PROCESSOR_PORT, TARGET_SIZE, JPEG_QUALITY, CONVERT_TO_BW, NEAR_DUPLICATE_THRESHOLD, NEAR_DUPLICATE_HASH, UPLOAD_WORKERS, TAG_CACHE_PATH, TAG_CACHE_MAX_ENTRIES, VARIANT_CACHE_DIR, VARIANT_CACHE_MAX_MB, DECODE_CACHE_MB, EVENT_MAX_CLIENTS, EVENT_STREAM_PORT, METADATA_EXPORT_DELAY
+from metadata_store import MetadataStore
+from hash_index import HashIndex
+from image_hashing import HASH_KINDS, hash_image_file
+from job_queue import JobQueue, JobError, DONE, FAILED, MAX_ATTEMPTS
+from tag_cache import TagCache
+from vision_backend import VisionBackend
+from derivatives import generate_derivatives, remove_derivatives
+from image_features import image_features
+from sprite_atlas import build_atlas, load_manifest, ATLASES_DIR
+from variant_cache import VariantCache
+from image_cache import shared_cache
+from event_broker import EventBroker, SubscriberLimitError
+from event_stream_server import EventStreamServer
+from tag_index import TagIndex, DEFAULT_LIMIT, DEFAULT_SAMPLE_SIZE
+from collage_renderer import render, collection_paths, OUTPUT_FORMATS, DEFAULT_SIZE, DEFAULT_IMAGE_COUNT, BLEND_MODES
 import hashlib
 import io
 from werkzeug.utils import secure_filename
@@ -49,44 +77,80 @@ UPLOAD_FOLDER = os.path.join(ROOT_DIR, "uploads")
 os.makedirs(COLLAGES_DIR, exist_ok=True)
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Indexed metadata store; metadata.json is exported from it in the background,
+# once per burst of writes, so an upload only costs a row insert
+metadata_store = MetadataStore(METADATA_FILE, export_delay=METADATA_EXPORT_DELAY)
+
+# Durable queue for upload processing (survives restarts)
+job_queue = JobQueue(os.path.join(UPLOAD_FOLDER, "jobs.db"))
+SSE_HEARTBEAT_INTERVAL = 15  # Seconds between keep-alive comments on event streams
+
+# Metadata changes pushed to browsers over /metadata/events: on its own port
+# from an asyncio loop, which holds idle connections without a thread each,
+# with the route on this server (a thread per stream) as the fallback
+event_stream_server = None
+event_broker = EventBroker()
+metadata_changed = threading.Event()
+metadata_store.add_listener(lambda event, version, payload: metadata_changed.set())
+
+# Tag -> image index for /api/images, kept in step with the store's change log
+tag_index = TagIndex(metadata_store)
+
+# Sprite atlases are rebuilt (incrementally) by one request at a time
+atlas_lock = threading.Lock()
+
+# Renders are CPU-bound; more at once only makes each one slower
+RENDER_CONCURRENCY = 2
+render_slots = threading.BoundedSemaphore(RENDER_CONCURRENCY)
+
+# Vision results keyed by image content, so re-uploads don't call the API again
+tag_cache = TagCache(TAG_CACHE_PATH, TAG_CACHE_MAX_ENTRIES)
+vision_backend = VisionBackend(OPENAI_API_KEY, cache=tag_cache)
+
+# Resized variants for /images/collages/<id>?w=&format=&q=
+variant_cache = VariantCache(VARIANT_CACHE_DIR, VARIANT_CACHE_MAX_MB * 1024 * 1024)
+
+# Decoded images shared by processing, hashing and rendering
+decoded_images = shared_cache(DECODE_CACHE_MB * 1024 * 1024)
+
+METADATA_PROMPT = "Analyze this black and white collage image. Provide a detailed description of its composition, textures, and artistic elements. Also suggest 5 relevant tags that capture its essence. Format your response as: DESCRIPTION: [your description] TAGS: [tag1, tag2, tag3, tag4, tag5]"
+
 # -------------------- Image Processing Functions --------------------
 
 def process_image(image_path):
     """Process an image for web use."""
     try:
-        # Open the image
-        with Image.open(image_path) as img:
-            # Convert to RGB if necessary
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            
-            # Calculate dimensions while preserving aspect ratio
-            width, height = img.size
-            max_dimension = max(TARGET_SIZE)
-            ratio = min(max_dimension / width, max_dimension / height)
-            new_width = int(width * ratio)
-            new_height = int(height * ratio)
-            
-            # Resize using high-quality LANCZOS resampling
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            
-            # Create a white background of target size
-            background = Image.new('RGB', TARGET_SIZE, (255, 255, 255))
-            
-            # Calculate position to center the image
-            x = (TARGET_SIZE[0] - new_width) // 2
-            y = (TARGET_SIZE[1] - new_height) // 2
-            
-            # Paste the resized image onto the white background
-            background.paste(img, (x, y))
-            
-            # Save with high quality
-            output_path = os.path.join(UPLOAD_FOLDER, f'processed_{os.path.basename(image_path)}')
-            background.save(output_path, 'JPEG', quality=95, optimize=True)
-            
-            print(f"✓ Processed image saved to {output_path}")
-            return output_path
-            
+        max_dimension = max(TARGET_SIZE)
+        
+        # Calculate dimensions while preserving aspect ratio
+        width, height = decoded_images.header(image_path)['size']
+        ratio = min(max_dimension / width, max_dimension / height)
+        new_width = int(width * ratio)
+        new_height = int(height * ratio)
+        
+        # Shared RGB decode; large JPEGs are decoded at a reduced DCT scale since only the fitted size is needed
+        img = decoded_images.get(image_path, (new_width, new_height))
+        
+        # Resize using high-quality LANCZOS resampling
+        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        
+        # Create a white background of target size
+        background = Image.new('RGB', TARGET_SIZE, (255, 255, 255))
+        
+        # Calculate position to center the image
+        x = (TARGET_SIZE[0] - new_width) // 2
+        y = (TARGET_SIZE[1] - new_height) // 2
+        
+        # Paste the resized image onto the white background
+        background.paste(img, (x, y))
+        
+        # Save with high quality
+        output_path = os.path.join(UPLOAD_FOLDER, f'processed_{os.path.basename(image_path)}')
+        background.save(output_path, 'JPEG', quality=95, optimize=True)
+        
+        print(f"✓ Processed image saved to {output_path}")
+        return output_path
+        
     except Exception as e:
         print(f"❌ Error processing image: {str(e)}")
         raise
@@ -98,74 +162,18 @@ def generate_metadata(image_path):
     print("="*50)
     
     try:
-        # Read and encode the image
-        with open(image_path, "rb") as image_file:
-            print("✓ Image encoded successfully")
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+        # Shared backend: pooled client, cached results, known-bad models skipped
+        model_name, metadata = vision_backend.tag(image_path, METADATA_PROMPT)
+        description, tags = metadata['description'], metadata['tags']
         
-        # Initialize OpenAI client
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
+        print(f"✓ Received metadata from {model_name}")
+        print(f"  Description: {description}")
+        print(f"  Tags: {', '.join(tags)}")
         
-        # Try different model names in sequence
-        model_names = ["gpt-4-vision", "gpt-4o", "gpt-4o-vision"]
-        last_error = None
-        
-        for model_name in model_names:
-            try:
-                print(f"Trying model: {model_name}")
-                response = client.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": "Analyze this black and white collage image. Provide a detailed description of its composition, textures, and artistic elements. Also suggest 5 relevant tags that capture its essence. Format your response as: DESCRIPTION: [your description] TAGS: [tag1, tag2, tag3, tag4, tag5]"
-                                },
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{base64_image}"
-                                    }
-                                }
-                            ]
-                        }
-                    ],
-                    max_tokens=300
-                )
-                
-                # Parse the response
-                content = response.choices[0].message.content
-                print(f"✓ Received response from OpenAI API")
-                
-                # Extract description and tags
-                description = ""
-                tags = []
-                
-                if "DESCRIPTION:" in content and "TAGS:" in content:
-                    desc_part = content.split("DESCRIPTION:")[1].split("TAGS:")[0].strip()
-                    tags_part = content.split("TAGS:")[1].strip()
-                    
-                    description = desc_part
-                    tags = [tag.strip() for tag in tags_part.strip("[]").split(",")]
-                
-                print(f"✓ Parsed metadata:")
-                print(f"  Description: {description}")
-                print(f"  Tags: {', '.join(tags)}")
-                
-                return {
-                    'description': description,
-                    'tags': tags
-                }
-                
-            except Exception as e:
-                print(f"Error with model {model_name}: {str(e)}")
-                last_error = e
-                continue
-        
-        # If we get here, all models failed
-        raise last_error
+        return {
+            'description': description,
+            'tags': tags
+        }
         
     except Exception as e:
         print(f"❌ Error generating metadata: {str(e)}")
@@ -175,19 +183,9 @@ def generate_metadata(image_path):
             'tags': ['collage', 'black and white', 'art', 'texture', 'composition']
         }
 
-def update_metadata(image_id, description, tags):
-    """Update metadata.json with new image information."""
-    metadata_file = METADATA_FILE
-    print(f"\nUpdating metadata file: {metadata_file}")
-    
-    # Load existing metadata
-    if os.path.exists(metadata_file):
-        with open(metadata_file, 'r') as f:
-            metadata = json.load(f)
-            print(f"✓ Loaded existing metadata ({len(metadata)} entries)")
-    else:
-        metadata = []
-        print("Creating new metadata file")
+def update_metadata(image_id, description, tags, derivatives=None, features=None):
+    """Add a new image entry to the metadata store (and the exported metadata.json)."""
+    print(f"\nUpdating metadata store: {metadata_store.db_path}")
     
     # Add new image metadata
     new_entry = {
@@ -198,83 +196,67 @@ def update_metadata(image_id, description, tags):
         'tags': tags,
         'dateAdded': datetime.now().isoformat()
     }
+    if derivatives:
+        new_entry['derivatives'] = derivatives
+    if features:
+        new_entry['features'] = features
     
-    metadata.append(new_entry)
+    metadata_store.add(new_entry)
     print("\n✓ Added new metadata entry:")
     print(json.dumps(new_entry, indent=2))
-    
-    # Save updated metadata
-    with open(metadata_file, 'w') as f:
-        json.dump(metadata, f, indent=2)
-    print(f"✓ Saved metadata file with {len(metadata)} total entries")
+    print(f"✓ Saved metadata with {metadata_store.count()} total entries")
+    return new_entry
 
 def cleanup_metadata():
     """Remove metadata entries for images that don't exist in the collages directory."""
-    if not os.path.exists(METADATA_FILE):
-        print("No metadata file found.")
-        return
-        
     print("\nCleaning up metadata...")
     try:
-        # Load existing metadata
-        with open(METADATA_FILE, 'r') as f:
-            metadata = json.load(f)
-        original_count = len(metadata)
-        
-        # Filter out entries with missing images
-        valid_entries = []
-        for entry in metadata:
+        # Find entries with missing images
+        missing_ids = []
+        for entry in metadata_store.all():
             image_path = os.path.join(COLLAGES_DIR, entry['src'])
-            if os.path.exists(image_path):
-                valid_entries.append(entry)
-            else:
+            if not os.path.exists(image_path):
                 print(f"Removing entry for missing image: {entry['id']}")
+                missing_ids.append(entry['id'])
+                remove_derivatives(entry['id'])
         
-        # Save updated metadata
-        with open(METADATA_FILE, 'w') as f:
-            json.dump(valid_entries, f, indent=2)
-            
-        removed_count = original_count - len(valid_entries)
+        removed_count = metadata_store.remove(missing_ids)
         print(f"Cleanup complete. Removed {removed_count} entries for missing images.")
         
     except Exception as e:
         print(f"Error during metadata cleanup: {e}")
 
-def compute_image_hash(image_path):
-    """Compute a perceptual hash of an image for duplicate detection."""
+def compute_image_hashes(image_path):
+    """Compute the perceptual hashes (aHash, dHash, pHash) of an image for duplicate detection."""
     try:
-        with Image.open(image_path) as img:
-            # Convert to grayscale and resize to 8x8
-            img = img.convert('L').resize((8, 8), Image.Resampling.LANCZOS)
-            # Get pixel values
-            pixels = list(img.getdata())
-            # Compute average pixel value
-            avg = sum(pixels) / len(pixels)
-            # Create binary hash
-            bits = ''.join(['1' if pixel >= avg else '0' for pixel in pixels])
-            # Convert binary to hexadecimal
-            return hex(int(bits, 2))[2:].zfill(16)
+        return hash_image_file(image_path)
     except Exception as e:
         print(f"Error computing hash for {image_path}: {e}")
         return None
 
+def compute_image_hash(image_path):
+    """Compute the average hash of an image for duplicate detection."""
+    hashes = compute_image_hashes(image_path)
+    return hashes['ahash'] if hashes else None
+
+# Persistent hash index, stored alongside the metadata
+hash_index = HashIndex(metadata_store.db_path, COLLAGES_DIR)
+
 def find_duplicates():
     """Find duplicate images in the collages directory."""
     print("\nChecking for duplicate images...")
     hash_dict = {}
     duplicates = []
     
-    # Compute hashes for all images
-    for filename in os.listdir(COLLAGES_DIR):
-        if not filename.endswith('.jpg'):
-            continue
-        image_path = os.path.join(COLLAGES_DIR, filename)
-        image_hash = compute_image_hash(image_path)
-        if image_hash:
-            if image_hash in hash_dict:
-                duplicates.append((hash_dict[image_hash], filename))
-            else:
-                hash_dict[image_hash] = filename
+    # Hashes come from the index; only new or modified images are re-hashed.
+    # An exact duplicate has to match on all hash kinds (aHash alone collides
+    # on visually similar pages such as text blocks).
+    for filename, hashes in hash_index.refresh():
+        image_hash = tuple(hashes[kind] for kind in HASH_KINDS)
+        if image_hash in hash_dict:
+            duplicates.append((hash_dict[image_hash], filename))
+        else:
+            hash_dict[image_hash] = filename
     
     return duplicates
 
@@ -289,35 +271,236 @@ def cleanup_duplicates():
     for original, duplicate in duplicates:
         print(f"- {original} and {duplicate}")
     
-    # Load metadata
-    with open(METADATA_FILE, 'r') as f:
-        metadata = json.load(f)
-    
     # Remove entries for duplicate images
-    original_count = len(metadata)
-    metadata = [entry for entry in metadata if entry['src'] not in [d[1] for d in duplicates]]
-    
-    # Save updated metadata
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    duplicate_ids = []
+    for _, duplicate in duplicates:
+        entry = metadata_store.get_by_src(duplicate)
+        if entry:
+            duplicate_ids.append(entry['id'])
+    removed_count = metadata_store.remove(duplicate_ids)
     
     # Remove duplicate files
     for _, duplicate in duplicates:
         try:
             os.remove(os.path.join(COLLAGES_DIR, duplicate))
+            hash_index.remove(duplicate)
+            remove_derivatives(os.path.splitext(duplicate)[0])
             print(f"Removed duplicate file: {duplicate}")
         except Exception as e:
             print(f"Error removing {duplicate}: {e}")
     
     print(f"\nCleanup complete:")
-    print(f"- Removed {original_count - len(metadata)} metadata entries")
+    print(f"- Removed {removed_count} metadata entries")
     print(f"- Removed {len(duplicates)} duplicate files")
 
+# -------------------- Upload Pipeline --------------------
+
+class DuplicateImageError(JobError):
+    """Raised when an uploaded image matches one already in the collection."""
+
+# Serializes the duplicate check and the move into the collection, so two
+# workers can't both accept copies of the same image
+_ingest_lock = threading.Lock()
+
+def ingest_upload(job, report):
+    """Process one uploaded file into the collection (runs in an upload worker).
+
+    Safe to run again for the same job: the image id comes from the job id,
+    so a retry after a crash part way through replaces the file it already
+    moved into the collection rather than flagging it as a duplicate.
+    """
+    temp_path = job['path']
+    processed_path = None
+    keep_upload = False
+    image_id = f"img{job['id'][:8]}"
+    filename = f"{image_id}.jpg"
+    final_path = os.path.join(COLLAGES_DIR, filename)
+    
+    try:
+        # An earlier attempt got as far as recording the image
+        entry = metadata_store.get(image_id)
+        if entry is not None:
+            return upload_result(entry)
+        
+        if not os.path.exists(temp_path):
+            raise JobError(f"Uploaded file is missing: {job['filename']}")
+        
+        # Process image
+        report('processing', 0.1)
+        processed_path = process_image(temp_path)
+        
+        # Check for duplicates and near-duplicates against the hash index
+        report('checking for duplicates', 0.3)
+        new_hashes = compute_image_hashes(processed_path)
+        with _ingest_lock:
+            matches = []
+            if new_hashes:
+                matches = hash_index.find_near(new_hashes[NEAR_DUPLICATE_HASH], NEAR_DUPLICATE_THRESHOLD,
+                                               kind=NEAR_DUPLICATE_HASH, exclude=filename)
+            if matches:
+                match, distance = matches[0]
+                raise DuplicateImageError(f"Skipped duplicate image: {job['filename']} (matches {match}, distance {distance})")
+            
+            # Move to final location
+            shutil.move(processed_path, final_path)
+            processed_path = None
+            hash_index.add(filename, new_hashes)
+        
+        # Smaller renditions for the frontend (thumb/small/medium/full, JPEG + WebP)
+        report('generating derivatives', 0.4)
+        try:
+            derivatives = generate_derivatives(final_path, image_id)
+        except Exception as e:
+            print(f"Error generating derivatives for {image_id}: {e}")
+            derivatives = None
+        
+        # Brightness, contrast, saliency and crop hints for the collage generators
+        try:
+            features = image_features(final_path)
+        except Exception as e:
+            print(f"Error computing features for {image_id}: {e}")
+            features = None
+        
+        # Generate metadata
+        report('generating tags', 0.5)
+        metadata = generate_metadata(final_path)
+        
+        report('saving metadata', 0.9)
+        entry = update_metadata(image_id, metadata['description'], metadata['tags'], derivatives, features)
+        return upload_result(entry)
+    
+    except JobError:
+        raise
+    except Exception:
+        # The queue retries the job until it runs out of attempts, and the retry needs the upload
+        keep_upload = job['attempts'] < MAX_ATTEMPTS
+        if not keep_upload and os.path.exists(final_path) and image_id not in metadata_store:
+            # Last attempt: don't leave an image in the collection that has no metadata
+            with _ingest_lock:
+                hash_index.remove(filename)
+                os.remove(final_path)
+            remove_derivatives(image_id)
+        raise
+    
+    finally:
+        # The job owns its upload; clean up whatever is left over
+        for path in [None if keep_upload else temp_path, processed_path]:
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except Exception as e:
+                    print(f"Error cleaning up {path}: {e}")
+
+def upload_result(entry):
+    """Result recorded for a finished upload job."""
+    return {
+        'id': entry['id'],
+        'path': f"images/collages/{entry['id']}.jpg",
+        'description': entry['description'],
+        'tags': entry['tags'],
+        'derivatives': entry.get('derivatives'),
+        'features': entry.get('features')
+    }
+
+def job_status(job):
+    """Public view of a job for the API."""
+    return {
+        'id': job['id'],
+        'filename': job['filename'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'progress': job['progress'],
+        'image': job['result'],
+        'error': job['error']
+    }
+
+# -------------------- Metadata Events --------------------
+
+# Change log ops -> event names on /metadata/events
+METADATA_EVENTS = {'add': 'added', 'put': 'updated', 'remove': 'removed'}
+
+def metadata_events(delta):
+    """Turn a changes_since() result into (name, data, event_id) events.
+    
+    Only the last event carries the id (the delta's version), so a client that
+    reconnects mid-batch resumes from before the batch.
+    """
+    if delta['reset']:
+        return [('reset', {'version': delta['version']}, delta['version'])]
+    events = [(METADATA_EVENTS[change['op']], change.get('entry') or {'id': change['id']}, None)
+              for change in delta['changes']]
+    if events:
+        events[-1] = events[-1][:2] + (delta['version'],)
+    return events
+
+def relay_metadata_changes():
+    """Publish metadata changes to event stream subscribers.
+    
+    Woken by the store after every local write; the store is also checked
+    every heartbeat interval to pick up writes from other processes (such as
+    tag_images_with_gpt.py).
+    """
+    version = metadata_store.version()
+    while True:
+        metadata_changed.wait(SSE_HEARTBEAT_INTERVAL)
+        metadata_changed.clear()
+        if metadata_store.version() == version:
+            continue
+        delta = metadata_store.changes_since(version)
+        for name, data, event_id in metadata_events(delta):
+            event_broker.publish(name, data, event_id)
+            if event_stream_server is not None:
+                event_stream_server.publish(name, data, event_id)
+        version = delta['version']
+
+def replay_metadata_events(since):
+    """Events a stream starts with: what changed since a version, or just the current version."""
+    if since is None:
+        version = metadata_store.version()
+        return [('version', {'version': version}, version)]
+    return metadata_events(metadata_store.changes_since(since))
+
+def format_event(name, data, event_id=None):
+    """Encode one server-sent event."""
+    lines = f"event: {name}\ndata: {json.dumps(data)}\n"
+    if event_id is not None:
+        lines += f"id: {event_id}\n"
+    return lines + "\n"
+
 # -------------------- Flask Application --------------------
 
 app = Flask(__name__, static_folder=ROOT_DIR, static_url_path='')
 CORS(app)  # Enable CORS for all routes
 
+_background_lock = threading.Lock()
+_background_started = False
+
+def start_background_threads():
+    """Start the upload workers, the event stream server and the metadata event relay (once per process)."""
+    global _background_started, event_stream_server
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    if EVENT_STREAM_PORT:
+        server = EventStreamServer(replay_metadata_events, port=EVENT_STREAM_PORT,
+                                   max_clients=EVENT_MAX_CLIENTS, heartbeat=SSE_HEARTBEAT_INTERVAL)
+        try:
+            server.start()
+            event_stream_server = server
+            print(f"✓ Serving metadata events on port {EVENT_STREAM_PORT}")
+        except OSError as e:
+            # e.g. another worker process of the same app already has the port
+            print(f"Event stream port {EVENT_STREAM_PORT} unavailable ({e}); serving /metadata/events from this server")
+    job_queue.start_workers(ingest_upload, count=UPLOAD_WORKERS)
+    threading.Thread(target=relay_metadata_changes, name="metadata-events", daemon=True).start()
+
+@app.before_request
+def ensure_background_threads():
+    # However the app is served (flask run, debug off, a WSGI server), the
+    # process that handles requests is the one that runs the workers
+    start_background_threads()
+
 @app.route('/')
 def index():
     return send_from_directory(ROOT_DIR, 'index.html')
@@ -326,15 +509,126 @@ def index():
 def upload_page():
     return send_from_directory(ROOT_DIR, 'upload.html')
 
+# Precompressed metadata.json copies written by the store, best first
+METADATA_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
 @app.route('/images/metadata.json')
 def serve_metadata():
-    """Serve the metadata.json file"""
-    return send_from_directory(IMAGES_DIR, 'metadata.json')
+    """Serve the metadata.json file.
+    
+    The ETag is the store version it was exported at (one per encoding), so
+    polling clients get a 304 until something changes. Precompressed copies
+    are sent when the client accepts them. X-Metadata-Version carries the
+    version to pass to /metadata/changes. Writes not yet exported by the
+    background exporter are exported first.
+    """
+    metadata_store.flush()
+    version = metadata_store.exported_version()
+    filename, encoding = 'metadata.json', None
+    for name, suffix in METADATA_ENCODINGS:
+        if name in request.accept_encodings and os.path.exists(os.path.join(IMAGES_DIR, filename + suffix)):
+            filename, encoding = filename + suffix, name
+            break
+    etag = f"{version}-{encoding}" if encoding else str(version)
+    
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = send_from_directory(IMAGES_DIR, filename, mimetype='application/json', etag=False, conditional=False)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['X-Metadata-Version'] = str(version)
+    if event_stream_server is not None:
+        response.headers['X-Metadata-Events'] = f"{request.scheme}://{request.host.rsplit(':', 1)[0]}:{EVENT_STREAM_PORT}/metadata/events"
+    return response
+
+@app.route('/metadata/changes')
+def metadata_changes():
+    """Entries added, updated or removed since a metadata version.
+    
+    GET /metadata/changes?since=<version> returns {version, reset, changes};
+    with reset true the client should reload metadata.json instead.
+    """
+    try:
+        since = int(request.args.get('since', ''))
+    except ValueError:
+        return jsonify({'error': 'since must be a metadata version number'}), 400
+    return jsonify(metadata_store.changes_since(since))
 
 @app.route('/images/collages/<path:filename>')
 def serve_collage(filename):
-    """Serve collage images from the collages directory"""
-    return send_from_directory(COLLAGES_DIR, filename)
+    """Serve collage images from the collages directory.
+    
+    With any of w (width), format (jpg/webp/avif) or q (quality), a resized
+    variant is rendered on first request and served from the variant cache.
+    The .jpg extension may be left off.
+    """
+    if not os.path.splitext(filename)[1]:
+        filename = f"{filename}.jpg"
+    params = {name: request.args.get(name) for name in ('w', 'format', 'q')}
+    if not any(params.values()):
+        return send_from_directory(COLLAGES_DIR, filename)
+    
+    source_path = os.path.join(COLLAGES_DIR, secure_filename(os.path.basename(filename)))
+    if not os.path.isfile(source_path):
+        return jsonify({'error': 'Image not found'}), 404
+    
+    # A variant can be evicted between lookup and open; render it again if so
+    for attempt in range(2):
+        try:
+            path, mimetype = variant_cache.get(source_path, params['w'], params['format'], params['q'])
+            response = send_file(path, mimetype=mimetype)
+            break
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except FileNotFoundError:
+            if attempt:
+                raise
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+@app.route('/variants/stats')
+def variant_stats():
+    """Variant cache hit ratio, evictions and render latency."""
+    return jsonify(variant_cache.stats())
+
+@app.route('/decoded/stats')
+def decoded_image_stats():
+    """Decoded image cache hit rate, memory use and evictions."""
+    return jsonify(decoded_images.stats())
+
+@app.route('/images/atlases/<path:filename>')
+def serve_atlas(filename):
+    """Serve sprite sheets; sheet names carry a content hash, so they never change."""
+    response = send_from_directory(ATLASES_DIR, filename)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable' if filename.endswith('.webp') else 'no-cache'
+    return response
+
+@app.route('/api/atlases/<int:tile_size>')
+def api_atlas(tile_size):
+    """Sprite atlas manifest for a tile size (128 or 256).
+    
+    Returns atlas.json: {sheets: [{file, width, height, images}], images:
+    {id: [sheet, x, y, width, height]}}, with sheets under
+    /images/atlases/<tile size>/. The atlas is brought up to date with the
+    collection first; only sheets whose images changed are redrawn.
+    """
+    manifest = load_manifest(tile_size)
+    if not manifest or manifest.get('metadata_version') != metadata_store.version():
+        with atlas_lock:
+            manifest = load_manifest(tile_size)
+            if not manifest or manifest.get('metadata_version') != metadata_store.version():
+                try:
+                    manifest = build_atlas(metadata_store, tile_size, COLLAGES_DIR)
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+    response = jsonify(manifest)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Metadata-Version'] = str(manifest['metadata_version'])
+    return response
 
 @app.route('/images/<path:filename>')
 def serve_image(filename):
@@ -343,77 +637,223 @@ def serve_image(filename):
 
 @app.route('/upload', methods=['POST'])
 def upload_images():
-    """Handle image upload and processing."""
+    """Accept uploaded images and queue them for processing.
+    
+    Returns 202 with one job per file; poll /jobs/<id> (or stream
+    /jobs/<id>/events) for progress and the resulting image.
+    """
     if 'files[]' not in request.files:
         return jsonify({'success': False, 'message': 'No files uploaded'})
     
     files = request.files.getlist('files[]')
-    processed_images = []
+    jobs = []
     errors = []
     
     for file in files:
         if not file.filename:
             continue
-            
-        temp_path = None
-        processed_path = None
         
+        temp_path = os.path.join(UPLOAD_FOLDER, f"upload_{uuid.uuid4().hex[:8]}_{secure_filename(file.filename)}")
         try:
-            # Save uploaded file
-            temp_path = os.path.join(UPLOAD_FOLDER, secure_filename(file.filename))
             file.save(temp_path)
-            
-            # Process image
-            processed_path = process_image(temp_path)
-            
-            # Check for duplicates
-            new_hash = compute_image_hash(processed_path)
-            if new_hash:
-                duplicates = find_duplicates()
-                if any(new_hash == compute_image_hash(os.path.join(COLLAGES_DIR, d[0])) for d in duplicates):
-                    os.remove(processed_path)
-                    errors.append(f"Skipped duplicate image: {file.filename}")
-                    continue
-            
-            # Generate unique ID and move to final location
-            image_id = f"img{str(uuid.uuid4())[:8]}"
-            final_path = os.path.join(COLLAGES_DIR, f"{image_id}.jpg")
-            shutil.move(processed_path, final_path)
-            
-            # Generate metadata
-            metadata = generate_metadata(final_path)
-            update_metadata(image_id, metadata['description'], metadata['tags'])
-            
-            processed_images.append({
-                'id': image_id,
-                'path': f"images/collages/{image_id}.jpg",
-                'description': metadata['description'],
-                'tags': metadata['tags']
-            })
-            
+            job = job_queue.enqueue(file.filename, temp_path)
+            jobs.append(job_status(job))
         except Exception as e:
-            errors.append(f"Error processing {file.filename}: {str(e)}")
-            # Cleanup on error
-            for path in [temp_path, processed_path]:
-                if path and os.path.exists(path):
-                    try:
-                        os.remove(path)
-                    except Exception as e:
-                        print(f"Error cleaning up {path}: {e}")
-    
-    if not processed_images and errors:
+            errors.append(f"Error saving {file.filename}: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    if not jobs:
         return jsonify({
             'success': False,
-            'message': 'Failed to process any images',
+            'message': 'Failed to queue any images',
             'errors': errors
         })
     
     return jsonify({
         'success': True,
-        'message': f'Successfully processed {len(processed_images)} images',
-        'images': processed_images,
+        'message': f'Queued {len(jobs)} images for processing',
+        'jobs': jobs,
         'errors': errors if errors else None
-    })
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Report the status of an upload job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify(job_status(job))
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Stream job progress as server-sent events until the job finishes."""
+    if job_queue.get(job_id) is None:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    
+    def stream():
+        since = 0
+        while True:
+            job = job_queue.wait_for_update(job_id, since, timeout=SSE_HEARTBEAT_INTERVAL)
+            if job is None:
+                return
+            if job['updated'] <= since:
+                yield ": heartbeat\n\n"
+                continue
+            since = job['updated']
+            yield f"event: progress\ndata: {json.dumps(job_status(job))}\n\n"
+            if job['status'] in (DONE, FAILED):
+                return
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metadata/events')
+def metadata_event_stream():
+    """Stream metadata changes as server-sent events.
+    
+    Events are added / updated (data: the entry), removed (data: {id}) and
+    reset (reload metadata.json). Each batch ends with the metadata version
+    as its event id; pass ?since=<version> (or reconnect with Last-Event-ID)
+    to first receive everything missed since that version.
+    
+    Each stream here holds a server thread, so this route is the fallback:
+    pages use the event stream server on EVENT_STREAM_PORT when metadata.json
+    advertises it (X-Metadata-Events).
+    """
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        return jsonify({'error': 'since must be a metadata version number'}), 400
+    try:
+        subscription = event_broker.subscribe()
+    except SubscriberLimitError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(SSE_HEARTBEAT_INTERVAL)}
+    
+    def stream():
+        with subscription:
+            # Reconnect at most every few seconds; subscribe before replaying so nothing is missed
+            yield "retry: 5000\n\n"
+            for event in replay_metadata_events(since):
+                yield format_event(*event)
+            for event in subscription.events(SSE_HEARTBEAT_INTERVAL):
+                yield format_event(*event) if event else ": heartbeat\n\n"
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metadata/events/stats')
+def metadata_event_stats():
+    """Connected event stream clients and buffer overflows."""
+    stats = event_broker.stats()
+    if event_stream_server is not None:
+        stats['stream_server'] = event_stream_server.stats()
+    return jsonify(stats)
+
+def split_param(name):
+    """Comma-separated and/or repeated query parameter values."""
+    return [value.strip() for param in request.args.getlist(name) for value in param.split(',') if value.strip()]
+
+@app.route('/api/images')
+def api_images():
+    """Query the collection.
+    
+    GET /api/images?tags=vintage,portrait&match=all&fields=id,src,tags&limit=100&cursor=...
+    
+    tags: only images carrying every tag (match=all, default) or any of them
+    (match=any). fields: keys to return per image (default: all). Returns
+    {images, total, next_cursor, version}; pass next_cursor back as cursor
+    for the next page (null on the last page).
+    """
+    try:
+        return jsonify(tag_index.query(
+            tags=split_param('tags'),
+            match=request.args.get('match', 'all'),
+            fields=split_param('fields') or None,
+            limit=request.args.get('limit', DEFAULT_LIMIT),
+            cursor=request.args.get('cursor'),
+        ))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/sample')
+def api_sample():
+    """Randomly pick images matching a tag expression.
+    
+    GET /api/sample?q=vintage & (portrait | face) & !color&n=12&weight=relevance&fields=id,src,tags
+    
+    q: tag expression (& or , for AND, | for OR, ! for NOT, parentheses);
+    tags are matched normalized and stemmed. n: images to draw. weight:
+    uniform (default) or relevance (favour images matching more terms).
+    seed: repeatable draws. exclude: ids to leave out. Returns {images, matched, version}.
+    """
+    try:
+        seed = request.args.get('seed')
+        return jsonify(tag_index.sample(
+            expression=request.args.get('q') or None,
+            n=request.args.get('n', DEFAULT_SAMPLE_SIZE),
+            weight=request.args.get('weight', 'uniform'),
+            fields=split_param('fields') or None,
+            seed=int(seed) if seed else None,
+            exclude=split_param('exclude'),
+        ))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+RENDER_MIMETYPES = {'jpg': 'image/jpeg', 'png': 'image/png'}
+
+@app.route('/api/render')
+def api_render():
+    """Render a collage on the server.
+    
+    GET /api/render?style=mosaic&w=1200&h=800&format=jpg&q=vintage & !color&n=40&seed=7
+    
+    style: mosaic (default), tiling or layered. w, h: output size (at most
+    4096). format: jpg (default) or png. q, n: tag expression and number of
+    images to draw from (as /api/sample). blend: blend mode for every
+    fragment. seed: the same seed renders the same collage, and the
+    response may then be cached.
+    """
+    style = request.args.get('style', 'mosaic')
+    fmt = request.args.get('format', 'jpg').lower().replace('jpeg', 'jpg')
+    if fmt not in OUTPUT_FORMATS:
+        return jsonify({'error': 'format must be jpg or png'}), 400
+    blend = request.args.get('blend')
+    if blend and blend not in BLEND_MODES:
+        return jsonify({'error': f"blend must be one of: {', '.join(BLEND_MODES)}"}), 400
+    try:
+        width = int(request.args.get('w', DEFAULT_SIZE[0]))
+        height = int(request.args.get('h', DEFAULT_SIZE[1]))
+        seed = request.args.get('seed')
+        seed = int(seed) if seed else None
+        sample = tag_index.sample(
+            expression=request.args.get('q') or None,
+            n=request.args.get('n', DEFAULT_IMAGE_COUNT.get(style, DEFAULT_SAMPLE_SIZE)),
+            fields=['src'],
+            seed=seed,
+        )
+        paths = collection_paths(sample['images'], COLLAGES_DIR)
+        if not paths:
+            return jsonify({'error': 'No images match'}), 404
+        with render_slots:
+            img = render(style, paths, width, height, seed=seed, params={'blend': blend} if blend else None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    pil_format, options = OUTPUT_FORMATS[fmt]
+    output = io.BytesIO()
+    img.save(output, format=pil_format, **options)
+    response = Response(output.getvalue(), mimetype=RENDER_MIMETYPES[fmt])
+    # Seeded renders are repeatable until the collection changes
+    response.headers['Cache-Control'] = 'public, max-age=3600' if seed is not None else 'no-store'
+    response.headers['X-Metadata-Version'] = str(sample['version'])
+    return response
+
+@app.route('/api/images/stats')
+def api_images_stats():
+    """Tag index size and how often it was reloaded."""
+    return jsonify(tag_index.stats())
 
 # Start the server if run directly
 if __name__ == '__main__':
@@ -422,4 +862,8 @@ if __name__ == '__main__':
     print(f"Metadata will be updated at: {os.path.abspath(METADATA_FILE)}")
     cleanup_metadata()  # Clean up metadata before starting server
     cleanup_duplicates()  # Clean up duplicates before starting server
+    # With the debug reloader, only the child process that serves requests
+    # runs workers; start them now so queued jobs resume before the first request
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_threads()
     app.run(host='0.0.0.0', port=IMAGE_PROCESSOR_PORT, debug=True)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Durable Job Queue for Assemblage
+
+A small SQLite-backed queue for upload processing. /upload saves the files and
+enqueues one job per file; worker threads claim jobs, report progress as they
+go, and record the result. Jobs survive restarts: anything that was running
+when the server stopped is put back in the queue on startup.
+
+Usage:
+    from job_queue import JobQueue
+
+    queue = JobQueue("/path/to/jobs.db")
+    job = queue.enqueue("photo.jpg", "/path/to/uploads/photo.jpg")
+    queue.start_workers(handler, count=2)   # handler(job, report) -> result dict
+    queue.get(job['id'])
+"""
+
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT,
+    path TEXT,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created);
+"""
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+MAX_ATTEMPTS = 3
+
+
+class JobError(Exception):
+    """Raised by a job handler for an expected failure (reported without a traceback)."""
+
+
+class JobQueue:
+    """SQLite-backed job queue with in-process change notification."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._changed = threading.Condition(self._lock)
+        self._workers = []
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._requeue_interrupted()
+
+    # -------------------- Internal helpers --------------------
+
+    def _row_to_job(self, row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def _set(self, job_id, **fields):
+        fields['updated'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._changed.notify_all()
+
+    def _requeue_interrupted(self):
+        """Put jobs that were running when the process stopped back in the queue.
+
+        A job that has already used up its attempts is failed instead: it may
+        be what took the process down (a decoder running out of memory, say),
+        and would otherwise be retried on every restart.
+        """
+        now = time.time()
+        with self._lock:
+            failed = self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = 'failed', error = ?, updated = ? WHERE status = ? AND attempts >= ?",
+                (FAILED, "Interrupted on its last attempt (the server stopped while processing it)", now, RUNNING, MAX_ATTEMPTS),
+            ).rowcount
+            count = self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = 'queued (restarted)', updated = ? WHERE status = ?",
+                (QUEUED, now, RUNNING),
+            ).rowcount
+        if count:
+            print(f"Requeued {count} interrupted jobs")
+        if failed:
+            print(f"Failed {failed} interrupted jobs that had no attempts left")
+
+    # -------------------- Queue operations --------------------
+
+    def enqueue(self, filename, path):
+        """Add a job for an uploaded file. Returns the job."""
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, filename, path, stage, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, filename, path, 'queued', now, now),
+            )
+            self._changed.notify_all()
+        return self.get(job_id)
+
+    def claim(self):
+        """Atomically take the oldest queued job and mark it running. Returns None if the queue is empty."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, stage = 'starting', attempts = attempts + 1, updated = ? WHERE id = ?",
+                        (RUNNING, time.time(), row['id']),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            if row is None:
+                return None
+            self._changed.notify_all()
+            return self.get(row['id'])
+
+    def report(self, job_id, stage, progress=None):
+        """Record progress for a running job."""
+        fields = {'stage': stage}
+        if progress is not None:
+            fields['progress'] = progress
+        self._set(job_id, **fields)
+
+    def complete(self, job_id, result):
+        self._set(job_id, status=DONE, stage='done', progress=1.0, result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        self._set(job_id, status=FAILED, stage='failed', error=str(error))
+
+    def retry_or_fail(self, job, error):
+        """Requeue a job after an unexpected error, or fail it once it has used up its attempts."""
+        if job['attempts'] < MAX_ATTEMPTS:
+            self._set(job['id'], status=QUEUED, stage=f"retrying after error: {error}")
+        else:
+            self.fail(job['id'], error)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def wait_for_update(self, job_id, since, timeout):
+        """Block until the job's 'updated' timestamp moves past `since` (or timeout). Returns the job."""
+        deadline = time.time() + timeout
+        with self._changed:
+            while True:
+                job = self.get(job_id)
+                if job is None or job['updated'] > since:
+                    return job
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return job
+                self._changed.wait(remaining)
+
+    # -------------------- Workers --------------------
+
+    def _work(self, handler, poll_interval):
+        while True:
+            job = self.claim()
+            if job is None:
+                with self._changed:
+                    self._changed.wait(poll_interval)
+                continue
+
+            def report(stage, progress=None, job_id=job['id']):
+                self.report(job_id, stage, progress)
+
+            try:
+                self.complete(job['id'], handler(job, report))
+            except JobError as e:
+                self.fail(job['id'], e)
+            except Exception as e:
+                print(f"❌ Job {job['id']} ({job['filename']}) failed: {e}")
+                self.retry_or_fail(job, e)
+
+    def start_workers(self, handler, count=1, poll_interval=5.0):
+        """Start daemon worker threads that run handler(job, report) for each claimed job."""
+        for i in range(count):
+            worker = threading.Thread(target=self._work, args=(handler, poll_interval),
+                                      name=f"upload-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        print(f"✓ Started {count} upload worker{'s' if count != 1 else ''}")
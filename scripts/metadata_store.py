@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+Metadata Store for Assemblage
+
+SQLite-backed store for image metadata. Entries are kept one row per image
+(WAL mode, indexed by id, filename and tag) so adding or updating an image no
+longer means parsing and rewriting the whole metadata.json.
+
+metadata.json is still written as a derived artifact so the frontend keeps
+loading the same file, along with gzip (and, if the brotli package is
+installed, Brotli) precompressed copies. By default it is exported after every
+change; with export_delay set, writes only mark it stale and a background
+thread exports once per burst of writes, off the store lock (flush() exports
+straight away). A store opened after an unfinished export catches up. If
+metadata.json is edited by hand, the store notices on the next open and
+re-imports it.
+
+Every write is recorded in a change log with an increasing version number, so
+clients that already hold metadata.json at some version can fetch just the
+entries added, updated or removed since (changes_since). Listeners registered
+with add_listener are called after each committed write, e.g. to push changes
+to connected browsers.
+
+Usage:
+    from metadata_store import MetadataStore
+
+    store = MetadataStore("/path/to/metadata.json")   # or export_delay=1.0 in a long-running server
+    store.add({"id": "img1234abcd", "src": "img1234abcd.jpg", "tags": []})
+    store.find_by_tag("vintage")
+    store.changes_since(42)  # {"version": 45, "reset": False, "changes": [...]}
+"""
+
+import os
+import gzip
+import json
+import time
+import sqlite3
+import threading
+import textwrap
+from contextlib import contextmanager
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    filename TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_images_filename ON images(filename);
+CREATE TABLE IF NOT EXISTS image_tags (
+    image_id TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (image_id, tag)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_image_tags_tag ON image_tags(tag);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS changes (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    image_id TEXT,
+    op TEXT NOT NULL
+);
+"""
+
+# Change log ops: an entry was added, replaced, removed, or the whole store
+# was replaced (re-import or clear) and clients must reload metadata.json
+ADD, PUT, REMOVE, RESET = "add", "put", "remove", "reset"
+
+# Listener events: listener(event, version, payload) with the entry for
+# ADDED/UPDATED, the image id for REMOVED and None for RESET
+ADDED, UPDATED, REMOVED = "added", "updated", "removed"
+
+CHANGE_LOG_LIMIT = 10000  # Changes kept; older clients get a reset
+
+
+def db_path_for(metadata_file):
+    """Return the database path that backs a given metadata JSON file."""
+    return os.path.splitext(metadata_file)[0] + ".db"
+
+
+def entry_filename(entry):
+    """Get the image filename for an entry, which may use 'src' or 'path'."""
+    src = entry.get("src") or entry.get("path")
+    return os.path.basename(src) if src else None
+
+
+def normalize_tag(tag):
+    """Normalize a tag for indexing and lookup."""
+    return str(tag).strip().lower()
+
+
+def _render_entry(entry):
+    """Render an entry exactly as json.dump(metadata, indent=2) lays it out."""
+    return textwrap.indent(json.dumps(entry, indent=2), "  ")
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class MetadataStore:
+    """Indexed image metadata with metadata.json exported as a derived file."""
+
+    def __init__(self, metadata_file, db_path=None, export_delay=0):
+        self.metadata_file = metadata_file
+        self.db_path = db_path or db_path_for(metadata_file)
+        self.export_delay = export_delay
+        self._lock = threading.RLock()
+        self._export_deferred = 0
+        self._export_pending = False
+        self._listeners = []
+
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+        # Exports read a snapshot through their own connection, so they never wait on the store lock
+        self._export_lock = threading.Lock()
+        self._export_conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._export_wanted = threading.Event()
+        self._exporter = None
+
+        self._sync_from_json()
+        if not self.version():
+            # New store, or one created before the change log existed
+            with self._transaction() as conn:
+                self._record(conn, RESET)
+            if self.count():
+                self.export_json()
+        elif self.exported_version() < self.version():
+            # Writes whose export didn't happen before the last process stopped
+            self.export_json()
+
+    # -------------------- Internal helpers --------------------
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _json_signature(self):
+        try:
+            st = os.stat(self.metadata_file)
+        except FileNotFoundError:
+            return None
+        return f"{st.st_mtime_ns}:{st.st_size}"
+
+    def _sync_from_json(self):
+        """Import metadata.json if it changed outside the store (or the store is new)."""
+        with self._lock:
+            signature = self._json_signature()
+            if signature is None:
+                if self.count():
+                    self.export_json()
+                return
+            if signature == self._get_meta("json_signature"):
+                return
+
+            with open(self.metadata_file, "rb") as f:
+                body = f.read()
+            metadata = json.loads(body)
+            print(f"Importing {len(metadata)} metadata entries from {self.metadata_file}")
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM images")
+                conn.execute("DELETE FROM image_tags")
+                for entry in metadata:
+                    self._insert(conn, entry, replace=True)
+                version = self._record(conn, RESET)
+                self._set_meta(conn, "json_signature", signature)
+                self._set_meta(conn, "exported_version", version)
+            self._write_compressed(self.metadata_file, body)
+            self._notify(RESET, version)
+
+    def _insert(self, conn, entry, replace=False):
+        verb = "INSERT OR REPLACE" if replace else "INSERT"
+        conn.execute(
+            f"{verb} INTO images (id, filename, data) VALUES (?, ?, ?)",
+            (entry["id"], entry_filename(entry), _render_entry(entry)),
+        )
+        self._index_tags(conn, entry)
+
+    def _index_tags(self, conn, entry):
+        conn.execute("DELETE FROM image_tags WHERE image_id = ?", (entry["id"],))
+        tags = {normalize_tag(tag) for tag in entry.get("tags") or [] if str(tag).strip()}
+        conn.executemany(
+            "INSERT INTO image_tags (image_id, tag) VALUES (?, ?)",
+            [(entry["id"], tag) for tag in tags],
+        )
+
+    def _record(self, conn, op, image_ids=(None,)):
+        """Append to the change log, trimming it to CHANGE_LOG_LIMIT entries. Returns the new version."""
+        conn.executemany("INSERT INTO changes (image_id, op) VALUES (?, ?)",
+                         [(image_id, op) for image_id in image_ids])
+        version = conn.execute("SELECT COALESCE(MAX(version), 0) FROM changes").fetchone()[0]
+        conn.execute("DELETE FROM changes WHERE version <= ?", (version - CHANGE_LOG_LIMIT,))
+        return version
+
+    def _notify(self, event, version, payload=None):
+        """Call listeners after a commit. Caller holds the lock, so events arrive in version order."""
+        for listener in self._listeners:
+            try:
+                listener(event, version, payload)
+            except Exception as e:
+                print(f"Metadata listener failed: {e}")
+
+    def _changed(self):
+        self._export_pending = True
+        if not self._export_deferred:
+            self._schedule_export()
+
+    def _schedule_export(self):
+        """Export now, or wake the background exporter when exports are delayed."""
+        if not self.export_delay:
+            self.export_json()
+            return
+        if self._exporter is None:
+            self._exporter = threading.Thread(target=self._export_worker, name="metadata-export", daemon=True)
+            self._exporter.start()
+        self._export_wanted.set()
+
+    def _export_worker(self):
+        while True:
+            self._export_wanted.wait()
+            # Let a burst of writes land in one export
+            time.sleep(self.export_delay)
+            self._export_wanted.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error exporting {self.metadata_file}: {e}")
+
+    # -------------------- Lookups --------------------
+
+    def get(self, image_id):
+        """Return the entry with the given id, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM images WHERE id = ?", (image_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_by_src(self, src):
+        """Return the entry whose image file matches src (filename or path), or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM images WHERE filename = ? ORDER BY seq LIMIT 1",
+                (os.path.basename(src),),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_by_tag(self, tag):
+        """Return all entries carrying the given tag (case-insensitive)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT images.data FROM image_tags JOIN images ON images.id = image_tags.image_id "
+                "WHERE image_tags.tag = ? ORDER BY images.seq",
+                (normalize_tag(tag),),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def all(self):
+        """Return every entry in insertion order."""
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM images ORDER BY seq").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __contains__(self, image_id):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM images WHERE id = ?", (image_id,)).fetchone() is not None
+
+    # -------------------- Versions --------------------
+
+    def add_listener(self, listener):
+        """Call listener(event, version, payload) after every committed write (see ADDED etc.)."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def version(self):
+        """Current store version: the number of the latest change."""
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(version), 0) FROM changes").fetchone()[0]
+
+    def exported_version(self):
+        """Store version that metadata.json (and its compressed copies) was last exported at."""
+        with self._lock:
+            value = self._get_meta("exported_version")
+        return int(value) if value else 0
+
+    def changes_since(self, since):
+        """Entries changed after version `since`.
+
+        Returns {"version", "reset", "changes"}, where changes lists
+        {"op": "add" or "put", "entry": {...}} and {"op": "remove", "id": ...}
+        in the order they last changed, one per image ("add" if the image is
+        new since then). "reset" is True (and changes
+        empty) when the log no longer covers `since` or the store was replaced
+        since then; the client should reload metadata.json instead.
+        """
+        with self._lock:
+            version = self.version()
+            oldest = self._conn.execute("SELECT MIN(version) FROM changes").fetchone()[0] or 0
+            reset = since > version or since < oldest - 1 or self._conn.execute(
+                "SELECT 1 FROM changes WHERE version > ? AND op = ?", (since, RESET)).fetchone() is not None
+            if reset:
+                return {"version": version, "reset": True, "changes": []}
+
+            rows = self._conn.execute(
+                "SELECT changes.image_id, changes.op, images.data FROM changes "
+                "LEFT JOIN images ON images.id = changes.image_id "
+                "WHERE changes.version > ? ORDER BY changes.version",
+                (since,),
+            ).fetchall()
+
+        latest = {}
+        added = set()
+        for image_id, op, data in rows:
+            latest.pop(image_id, None)  # Keep only the last change, in its position
+            latest[image_id] = (op, data)
+            if op == ADD:
+                added.add(image_id)
+        changes = []
+        for image_id, (op, data) in latest.items():
+            if op != REMOVE and data is not None:
+                changes.append({"op": ADD if image_id in added else PUT, "entry": json.loads(data)})
+            else:
+                changes.append({"op": REMOVE, "id": image_id})
+        return {"version": version, "reset": False, "changes": changes}
+
+    # -------------------- Writes --------------------
+
+    def add(self, entry):
+        """Append a new entry. Raises ValueError if the id already exists."""
+        with self._lock:
+            try:
+                with self._transaction() as conn:
+                    self._insert(conn, entry)
+                    version = self._record(conn, ADD, [entry["id"]])
+            except sqlite3.IntegrityError:
+                raise ValueError(f"Image id already exists: {entry['id']}")
+            self._notify(ADDED, version, entry)
+            self._changed()
+        return entry
+
+    def put(self, entry):
+        """Replace an entry in place (keeping its position), or append it if new."""
+        with self._lock:
+            with self._transaction() as conn:
+                updated = conn.execute(
+                    "UPDATE images SET filename = ?, data = ? WHERE id = ?",
+                    (entry_filename(entry), _render_entry(entry), entry["id"]),
+                ).rowcount
+                if updated:
+                    self._index_tags(conn, entry)
+                else:
+                    self._insert(conn, entry)
+                version = self._record(conn, PUT if updated else ADD, [entry["id"]])
+            self._notify(UPDATED if updated else ADDED, version, entry)
+            self._changed()
+        return entry
+
+    def update(self, image_id, **fields):
+        """Merge fields into an existing entry. Returns the updated entry, or None if missing."""
+        with self._lock:
+            entry = self.get(image_id)
+            if entry is None:
+                return None
+            entry.update(fields)
+            return self.put(entry)
+
+    def remove(self, image_ids):
+        """Remove entries by id. Returns the number of entries removed."""
+        if isinstance(image_ids, str):
+            image_ids = [image_ids]
+        removed = []
+        with self._lock:
+            with self._transaction() as conn:
+                for image_id in image_ids:
+                    if conn.execute("DELETE FROM images WHERE id = ?", (image_id,)).rowcount:
+                        removed.append(image_id)
+                    conn.execute("DELETE FROM image_tags WHERE image_id = ?", (image_id,))
+                version = self._record(conn, REMOVE, removed)
+            if removed:
+                # One change log entry per image, numbered consecutively up to version
+                first = version - len(removed) + 1
+                for offset, image_id in enumerate(removed):
+                    self._notify(REMOVED, first + offset, image_id)
+                self._changed()
+        return len(removed)
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM images")
+                conn.execute("DELETE FROM image_tags")
+                version = self._record(conn, RESET)
+            self._notify(RESET, version)
+            self._changed()
+
+    @contextmanager
+    def batch(self):
+        """Defer the metadata.json export until the end of a group of writes.
+
+        Each write still commits on its own, so an interrupted batch keeps the
+        entries written so far.
+        """
+        with self._lock:
+            self._export_deferred += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._export_deferred -= 1
+                if not self._export_deferred and self._export_pending:
+                    self._schedule_export()
+
+    # -------------------- Export --------------------
+
+    def export_json(self, path=None):
+        """Write the store out as metadata.json (same layout as json.dump(..., indent=2)).
+
+        Precompressed path.gz and path.br (when brotli is installed) copies are
+        written alongside for servers that can send them as-is.
+        """
+        path = path or self.metadata_file
+        conn = self._export_conn
+        with self._export_lock:
+            if path == self.metadata_file:
+                # Cleared before the snapshot: a write that lands after it marks the export stale again
+                self._export_pending = False
+            conn.execute("BEGIN")
+            try:
+                version = conn.execute("SELECT COALESCE(MAX(version), 0) FROM changes").fetchone()[0]
+                rows = conn.execute("SELECT data FROM images ORDER BY seq").fetchall()
+            finally:
+                conn.execute("COMMIT")
+            body = ("[\n" + ",\n".join(row[0] for row in rows) + "\n]" if rows else "[]").encode("utf-8")
+
+            # Compressed copies first, so a reader that sees the new file also sees new copies
+            self._write_compressed(path, body)
+            _write_atomic(path, body)
+
+            if path == self.metadata_file:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._set_meta(conn, "json_signature", self._json_signature())
+                    self._set_meta(conn, "exported_version", version)
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                conn.execute("COMMIT")
+        return path
+
+    def flush(self):
+        """Export metadata.json now if writes since the last export haven't been. Returns whether it exported."""
+        if not self._export_pending:
+            return False
+        self.export_json()
+        return True
+
+    def _write_compressed(self, path, body):
+        _write_atomic(f"{path}.gz", gzip.compress(body, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write_atomic(f"{path}.br", brotli.compress(body, quality=11))
+
+    def close(self):
+        self.flush()
+        with self._lock, self._export_lock:
+            self._conn.close()
+            self._export_conn.close()
@@ -9,6 +9,7 @@ This script:
 
 Usage:
 python process_images.py --input /path/to/images --output /path/to/processed --size 800x600
+python process_images.py --input /path/to/images --output /path/to/processed --workers 16
 """
 
 import os
@@ -17,8 +18,15 @@ import json
 import argparse
 from PIL import Image
 import uuid
-from typing import Tuple, List, Dict, Optional
+from typing import Tuple, Dict, Optional
 import io
+import time
+import sqlite3
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+from image_io import reduce_for, fit_size
+from metadata_store import MetadataStore
 
 # Supported input formats
 SUPPORTED_FORMATS = {
@@ -54,27 +62,191 @@ def resize_image(img: Image.Image, max_size: Tuple[int, int]) -> Image.Image:
     # Resize the image
     return img.resize((new_width, new_height), Image.Resampling.LANCZOS)
 
-def optimize_for_web(img: Image.Image, output_format: str, max_size: int = 500_000) -> Tuple[Image.Image, int]:
+MIN_QUALITY = 20
+MAX_QUALITY = 90
+QUALITY_STEP = 5
+QUALITY_LADDER = list(range(MIN_QUALITY, MAX_QUALITY + 1, QUALITY_STEP))
+PROBE_SCALE = 0.5  # Linear scale of the probe used to estimate encoded size
+
+# Chosen quality per (source file hash, format, output size, max_size), kept
+# in the output directory so later runs over the same sources skip the search
+QUALITY_CACHE_FILE = "quality_cache.db"
+_quality_dbs: Dict[str, sqlite3.Connection] = {}
+
+def encode_image(img: Image.Image, output_format: str, quality: int) -> bytes:
+    """Encode an image to bytes with the settings used for web output"""
+    buffer = io.BytesIO()
+    img.save(buffer, format=output_format, quality=quality, optimize=True)
+    return buffer.getvalue()
+
+def quality_cache(path: str) -> sqlite3.Connection:
+    """This process's connection to the quality cache at path (created if missing)"""
+    conn = _quality_dbs.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS qualities (key TEXT PRIMARY KEY, quality INTEGER NOT NULL)")
+        _quality_dbs[path] = conn
+    return conn
+
+def quality_cache_key(source_digest: str, img: Image.Image, output_format: str, max_size: int) -> str:
+    return f"{source_digest}:{output_format}:{img.width}x{img.height}:{max_size}"
+
+def estimate_quality_index(img: Image.Image, output_format: str, max_size: int, top_size: int) -> int:
     """
-    Optimize image for web use by iteratively reducing quality until file size is under max_size
-    Returns tuple of (optimized image, quality used)
+    Estimate the highest QUALITY_LADDER index that fits max_size by bisecting on a downscaled probe.
+    Probe sizes are scaled by the ratio between the full image and the probe at MAX_QUALITY
+    (top_size is the full image's encoded size at MAX_QUALITY), so the estimate is calibrated
+    to this image's content. Cheap, but only an estimate.
     """
-    quality = 90
-    while True:
-        # Save to temporary buffer to check size
-        buffer = io.BytesIO()
-        img.save(buffer, format=output_format, quality=quality, optimize=True)
-        size = buffer.getbuffer().nbytes
-        
-        if size <= max_size or quality <= 20:
-            break
+    probe_size = (max(1, int(img.width * PROBE_SCALE)), max(1, int(img.height * PROBE_SCALE)))
+    probe = img.resize(probe_size, Image.Resampling.BOX)
+    scale = top_size / len(encode_image(probe, output_format, MAX_QUALITY))
+    
+    lo, hi = 0, len(QUALITY_LADDER) - 2  # The top rung is already known not to fit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if len(encode_image(probe, output_format, QUALITY_LADDER[mid])) * scale <= max_size:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def optimize_for_web(img: Image.Image, output_format: str, max_size: int = 500_000,
+                     known_quality: Optional[int] = None) -> Tuple[bytes, int]:
+    """
+    Optimize image for web use by finding the highest quality (90, 85, ... 20) whose encoded size is under max_size
+    Returns tuple of (encoded bytes, quality used)
+    
+    Quality is found by bisection seeded with an estimate from a downscaled probe,
+    instead of stepping down one full encode at a time. known_quality, the quality
+    chosen for the same source on an earlier run, is tried first. The returned
+    bytes are the final encode, so callers write them directly instead of saving again.
+    """
+    if known_quality is not None:
+        data = encode_image(img, output_format, known_quality)
+        if len(data) <= max_size or known_quality <= MIN_QUALITY:
+            return data, known_quality
+    
+    # Most images fit at the top quality: one encode
+    top = len(QUALITY_LADDER) - 1
+    encodes = {top: encode_image(img, output_format, MAX_QUALITY)}
+    if len(encodes[top]) <= max_size:
+        best = (encodes[top], MAX_QUALITY)
+    else:
+        # Bisect over ladder indices: lo fits (-1 stands for "nothing fits yet"),
+        # hi is known not to fit
+        lo, hi = -1, top
+        guess = estimate_quality_index(img, output_format, max_size, len(encodes[top]))
+        first = True
+        while hi - lo > 1:
+            encodes[guess] = encode_image(img, output_format, QUALITY_LADDER[guess])
+            fits = len(encodes[guess]) <= max_size
+            if fits:
+                lo = guess
+            else:
+                hi = guess
             
-        quality -= 5
+            # The estimate is usually within a step, so check its neighbour first
+            guess = (guess + 1 if fits else guess - 1) if first else (lo + hi + 1) // 2
+            if not lo < guess < hi:
+                guess = (lo + hi + 1) // 2
+            first = False
+        
+        # If nothing fits, fall back to the floor quality (already encoded)
+        index = max(lo, 0)
+        best = (encodes[index], QUALITY_LADDER[index])
     
-    return img, quality
+    return best
 
-def process_images(input_dir: str, output_dir: str, max_size: Tuple[int, int] = (800, 600)):
-    """Process all images in the input directory"""
+STAGES = ("decode", "resize", "encode", "write")
+
+def process_one(task: Tuple[str, str, str, Tuple[int, int], str]) -> Dict:
+    """
+    Process a single image. Runs in a worker process in --workers mode.
+    Returns a dict with the metadata entry (or error) and per-stage timings in seconds.
+    """
+    filename, input_dir, processed_dir, max_size, quality_db = task
+    ext = os.path.splitext(filename)[1].lower()
+    timings = {stage: 0.0 for stage in STAGES}
+    
+    try:
+        # Generate a unique ID for this image
+        image_id = generate_id()
+        
+        # Open and process the image
+        start = time.perf_counter()
+        img_path = os.path.join(input_dir, filename)
+        with open(img_path, 'rb') as f:
+            source = f.read()
+        source_digest = hashlib.blake2b(source, digest_size=16).hexdigest()
+        img = Image.open(io.BytesIO(source))
+        original_size = img.size
+        
+        # Decode large JPEGs at a reduced DCT scale; only the fitted size is needed
+        reduce_for(img, fit_size(img.size, max_size))
+        
+        # Convert to RGB if necessary (for PNGs with transparency)
+        if img.mode == 'RGBA':
+            # Create a white background
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            # Paste the image on the background
+            background.paste(img, mask=img.split()[3])
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        else:
+            img.load()
+        timings["decode"] = time.perf_counter() - start
+        
+        # Resize the image if needed
+        start = time.perf_counter()
+        processed_img = resize_image(img, max_size)
+        timings["resize"] = time.perf_counter() - start
+        
+        # Optimize for web
+        start = time.perf_counter()
+        cache = quality_cache(quality_db)
+        key = quality_cache_key(source_digest, processed_img, "JPEG", 500_000)
+        row = cache.execute("SELECT quality FROM qualities WHERE key = ?", (key,)).fetchone()
+        encoded, quality = optimize_for_web(processed_img, "JPEG", known_quality=row[0] if row else None)
+        if not row or row[0] != quality:
+            cache.execute("INSERT OR REPLACE INTO qualities (key, quality) VALUES (?, ?)", (key, quality))
+        timings["encode"] = time.perf_counter() - start
+        
+        # Save the processed image (already encoded; no second save)
+        start = time.perf_counter()
+        output_filename = f"{image_id}.jpg"
+        output_path = os.path.join(processed_dir, output_filename)
+        with open(output_path, 'wb') as f:
+            f.write(encoded)
+        timings["write"] = time.perf_counter() - start
+        
+        entry = {
+            "id": image_id,
+            "originalFilename": filename,
+            "src": f"images/collages/{output_filename}",
+            "tags": [],  # Placeholder for tags to be filled later
+            "description": "",  # Placeholder for description
+            "originalFormat": ext[1:].upper(),  # Store original format
+            "processedFormat": "JPEG",
+            "quality": quality,
+            "dimensions": {
+                "width": processed_img.size[0],
+                "height": processed_img.size[1]
+            },
+            "originalDimensions": {
+                "width": original_size[0],
+                "height": original_size[1]
+            }
+        }
+        return {"filename": filename, "entry": entry, "timings": timings}
+        
+    except Exception as e:
+        return {"filename": filename, "error": str(e), "timings": timings}
+
+def process_images(input_dir: str, output_dir: str, max_size: Tuple[int, int] = (800, 600), workers: int = 1):
+    """Process all images in the input directory, optionally across a pool of worker processes"""
     # Ensure output directory exists
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -84,82 +256,69 @@ def process_images(input_dir: str, output_dir: str, max_size: Tuple[int, int] =
     if not os.path.exists(processed_dir):
         os.makedirs(processed_dir)
     
-    # Process each image
-    metadata: List[Dict] = []
+    # Created here so worker processes only open it
+    quality_db = os.path.join(output_dir, QUALITY_CACHE_FILE)
+    quality_cache(quality_db)
     
-    for filename in os.listdir(input_dir):
+    # Collect the images to process
+    tasks = []
+    for filename in sorted(os.listdir(input_dir)):
         # Get file extension and check if supported
         ext = os.path.splitext(filename)[1].lower()
         if ext not in SUPPORTED_FORMATS:
             print(f"Skipping unsupported format: {filename}")
             continue
-            
-        try:
-            # Generate a unique ID for this image
-            image_id = generate_id()
-            
-            # Open and process the image
-            img_path = os.path.join(input_dir, filename)
-            img = Image.open(img_path)
-            
-            # Convert to RGB if necessary (for PNGs with transparency)
-            if img.mode == 'RGBA':
-                # Create a white background
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                # Paste the image on the background
-                background.paste(img, mask=img.split()[3])
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Resize the image if needed
-            processed_img = resize_image(img, max_size)
-            
-            # Optimize for web
-            optimized_img, quality = optimize_for_web(processed_img, "JPEG")
-            
-            # Save the processed image
-            output_filename = f"{image_id}.jpg"
-            output_path = os.path.join(processed_dir, output_filename)
-            optimized_img.save(output_path, "JPEG", quality=quality, optimize=True)
-            
-            # Add metadata
-            metadata.append({
-                "id": image_id,
-                "originalFilename": filename,
-                "src": f"images/collages/{output_filename}",
-                "tags": [],  # Placeholder for tags to be filled later
-                "description": "",  # Placeholder for description
-                "originalFormat": ext[1:].upper(),  # Store original format
-                "processedFormat": "JPEG",
-                "quality": quality,
-                "dimensions": {
-                    "width": processed_img.size[0],
-                    "height": processed_img.size[1]
-                },
-                "originalDimensions": {
-                    "width": img.size[0],
-                    "height": img.size[1]
-                }
-            })
-            
-            print(f"Processed: {filename} -> {output_filename} (quality: {quality})")
-            
-        except Exception as e:
-            print(f"Error processing {filename}: {e}")
+        tasks.append((filename, input_dir, processed_dir, max_size, quality_db))
     
-    # Save metadata to JSON file
+    # Metadata is written to the store as each result arrives; the JSON file
+    # is exported once at the end
     metadata_path = os.path.join(output_dir, "image_metadata.json")
-    with open(metadata_path, 'w') as f:
-        json.dump(metadata, f, indent=2)
+    store = MetadataStore(metadata_path)
+    store.clear()
+    
+    totals = {stage: 0.0 for stage in STAGES}
+    processed_count = 0
+    error_count = 0
+    wall_start = time.perf_counter()
+    
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        # Results stream back in input order
+        results = executor.map(process_one, tasks, chunksize=4) if executor else map(process_one, tasks)
+        with store.batch():
+            for result in results:
+                for stage, seconds in result["timings"].items():
+                    totals[stage] += seconds
+                
+                if "error" in result:
+                    print(f"Error processing {result['filename']}: {result['error']}")
+                    error_count += 1
+                    continue
+                
+                entry = result["entry"]
+                store.add(entry)
+                processed_count += 1
+                print(f"Processed: {result['filename']} -> {entry['id']}.jpg (quality: {entry['quality']})")
+    finally:
+        if executor:
+            executor.shutdown()
+    
+    wall_time = time.perf_counter() - wall_start
     
     # Also create a JavaScript file for the web app
-    js_data = f"const imageCollection = {json.dumps(metadata, indent=2)};"
+    js_data = f"const imageCollection = {json.dumps(store.all(), indent=2)};"
     js_path = os.path.join(output_dir, "data.js")
     with open(js_path, 'w') as f:
         f.write(js_data)
     
-    print(f"\nProcessed {len(metadata)} images")
+    print(f"\nProcessed {processed_count} images ({error_count} errors) in {wall_time:.1f}s "
+          f"with {workers} worker{'s' if workers != 1 else ''} "
+          f"({processed_count / wall_time if wall_time else 0:.1f} images/s)")
+    cpu_time = sum(totals.values())
+    print("Time per stage (summed across workers):")
+    for stage in STAGES:
+        share = totals[stage] / cpu_time * 100 if cpu_time else 0
+        print(f"- {stage}: {totals[stage]:.2f}s ({share:.0f}%)")
     print(f"Metadata saved to: {metadata_path}")
     print(f"JavaScript data saved to: {js_path}")
     print("\nNext steps:")
@@ -181,6 +340,8 @@ def main():
     parser.add_argument("--input", "-i", required=True, help="Input directory containing images")
     parser.add_argument("--output", "-o", required=True, help="Output directory for processed images and metadata")
     parser.add_argument("--size", "-s", default="800x600", type=parse_size, help="Target size for images (WIDTHxHEIGHT)")
+    parser.add_argument("--workers", "-w", type=int, default=1,
+                        help="Number of worker processes (default: 1, 0 = one per CPU core)")
     
     args = parser.parse_args()
     
@@ -190,7 +351,8 @@ def main():
         sys.exit(1)
     
     # Process images
-    process_images(args.input, args.output, args.size)
+    workers = args.workers or os.cpu_count() or 1
+    process_images(args.input, args.output, args.size, workers)
 
 if __name__ == "__main__":
     main()
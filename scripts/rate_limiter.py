@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Rate limiting for OpenAI API calls
+
+A thread-safe token bucket that is tuned at runtime from the API's rate-limit
+response headers, plus exponential backoff for 429s and transient errors. Used
+by the concurrent tagger so several worker threads can share one request
+budget without tripping the limit.
+
+Usage:
+    from rate_limiter import TokenBucket, call_with_backoff
+
+    limiter = TokenBucket(rate=1.0, capacity=4)
+    raw = call_with_backoff(lambda: client.chat.completions.with_raw_response.create(...), limiter)
+"""
+
+import re
+import time
+import random
+import threading
+
+# Status codes worth retrying: rate limited, or a transient server error
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value):
+    """Parse a reset duration header such as '1s', '6m0s' or '120ms' into seconds."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _header_int(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Token bucket limiter whose rate follows the API's rate-limit headers."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold all requests for the given number of seconds (e.g. after a 429)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+    def update_from_headers(self, headers):
+        """Adjust to x-ratelimit-* response headers.
+
+        The request limit (per minute) sets the refill rate; when the remaining
+        request or token budget is exhausted, requests pause until its reset.
+        """
+        if not headers:
+            return
+        limit = _header_int(headers, 'x-ratelimit-limit-requests')
+        if limit:
+            with self._lock:
+                self.rate = limit / 60.0
+
+        for kind in ('requests', 'tokens'):
+            remaining = _header_int(headers, f'x-ratelimit-remaining-{kind}')
+            reset = parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+            if remaining is not None and remaining <= 0 and reset:
+                self.pause(reset)
+
+
+def _retry_after(error):
+    """Seconds the server asked us to wait, if it said."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    if headers.get('retry-after-ms'):
+        try:
+            return float(headers['retry-after-ms']) / 1000
+        except ValueError:
+            pass
+    return parse_duration(headers.get('retry-after'))
+
+
+def is_retryable(error):
+    """True for rate-limit, timeout, connection and 5xx errors."""
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # Connection errors and timeouts carry no status code
+    return type(error).__name__ in ('APIConnectionError', 'APITimeoutError')
+
+
+def call_with_backoff(func, limiter=None, max_retries=5, base_delay=1.0, max_delay=60.0):
+    """Call func() under the limiter, retrying retryable errors with exponential backoff and jitter.
+
+    If func returns a raw response with headers, the limiter is updated from them.
+    """
+    for attempt in range(max_retries + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            result = func()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = _retry_after(e) or min(max_delay, base_delay * 2 ** attempt)
+            delay += random.uniform(0, delay / 2)
+            if limiter and getattr(e, 'status_code', None) == 429:
+                limiter.pause(delay)
+            print(f"Retryable error ({e.__class__.__name__}), retrying in {delay:.1f}s "
+                  f"[{attempt + 1}/{max_retries}]")
+            time.sleep(delay)
+            continue
+
+        if limiter:
+            limiter.update_from_headers(getattr(result, 'headers', None))
+        return result
@@ -1,100 +1,206 @@
 #!/usr/bin/env python3
 """
 Script to reprocess existing images with improved mobile-friendly settings.
+
+Images are processed by a pool of worker threads (Pillow releases the GIL
+while decoding, resizing and encoding) and each is decoded once: the check
+only reads the header. Originals are backed up to images/collages/backup by
+hardlink (or a byte copy where links aren't possible) before being replaced.
+
+Progress is checkpointed to backup/reprocess_checkpoint.json, so an
+interrupted run picks up where it stopped; images that failed are retried on
+the next run. The checkpoint is removed once a run finishes without errors.
+
+Usage:
+    python reprocess_images.py                 # one worker per CPU, resuming any interrupted run
+    python reprocess_images.py --workers 2
+    python reprocess_images.py --fresh         # ignore the checkpoint and check every image again
 """
 
 import os
 import sys
-from PIL import Image
 import json
-from pathlib import Path
+import time
+import shutil
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 # Import configuration from image_processor
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from scripts.image_processor import process_image, COLLAGES_DIR, METADATA_FILE, TARGET_SIZE, JPEG_QUALITY
+from image_cache import shared_cache
+
+BACKUP_DIR = os.path.join(COLLAGES_DIR, 'backup')
+CHECKPOINT_FILE = os.path.join(BACKUP_DIR, 'reprocess_checkpoint.json')
+CHECKPOINT_INTERVAL = 2.0  # Seconds between checkpoint writes
+
+PROCESSED, SKIPPED, ERROR = 'processed', 'skipped', 'error'
 
 def should_reprocess_image(img_path):
     """Check if an image needs reprocessing based on its current properties."""
     try:
-        with Image.open(img_path) as img:
-            # Check if image is already JPEG
-            if img.format != 'JPEG':
-                return True, "Not a JPEG file"
-            
-            # Check if image dimensions are already within target size
-            if max(img.size) <= max(TARGET_SIZE):
-                return False, "Already within target size"
-            
-            # Check if image quality is already good
-            if hasattr(img, 'info') and 'quality' in img.info:
-                if img.info['quality'] >= JPEG_QUALITY:
-                    return False, "Already at target quality"
-            
-            return True, "Needs optimization"
+        # Header only; the decode is left to process_image, through the same cache
+        header = shared_cache().header(img_path)
+
+        # Check if image is already JPEG
+        if header['format'] != 'JPEG':
+            return True, "Not a JPEG file"
+
+        # Check if image dimensions are already within target size
+        if max(header['size']) <= max(TARGET_SIZE):
+            return False, "Already within target size"
+
+        # Check if image quality is already good
+        if 'quality' in header['info']:
+            if header['info']['quality'] >= JPEG_QUALITY:
+                return False, "Already at target quality"
+
+        return True, "Needs optimization"
     except Exception as e:
         return True, f"Error checking image: {str(e)}"
 
-def reprocess_all_images():
+def backup_image(image_path, backup_path):
+    """Keep the original bytes: a hardlink where possible, else a copy. Returns how it was kept."""
+    try:
+        os.link(image_path, backup_path)
+        return "linked"
+    except OSError:
+        tmp_path = f"{backup_path}.tmp"
+        shutil.copyfile(image_path, tmp_path)
+        os.replace(tmp_path, backup_path)
+        return "copied"
+
+def reprocess_image(image_id, image_path):
+    """Check, back up and reprocess one image. Returns (status, message, bytes before, bytes after)."""
+    needs_reprocess, reason = should_reprocess_image(image_path)
+    size_before = os.path.getsize(image_path)
+    if not needs_reprocess:
+        return SKIPPED, reason, size_before, size_before
+
+    # Backup first; an existing backup is the original from an earlier run
+    backup_path = os.path.join(BACKUP_DIR, f"{image_id}.jpg")
+    backup_note = ""
+    if not os.path.exists(backup_path):
+        backup_note = f", original {backup_image(image_path, backup_path)} to backup"
+
+    # Process image with new settings, then move it over the original
+    processed_path = process_image(image_path)
+    if not os.path.exists(processed_path):
+        return ERROR, "Failed to process", size_before, size_before
+    size_after = os.path.getsize(processed_path)
+    os.replace(processed_path, image_path)
+    return PROCESSED, f"{reason}{backup_note}", size_before, size_after
+
+def load_checkpoint(fresh=False):
+    """Statuses recorded by an interrupted run with the same settings, keyed by image id."""
+    if fresh or not os.path.exists(CHECKPOINT_FILE):
+        return {}
+    try:
+        with open(CHECKPOINT_FILE, 'r') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if checkpoint.get('settings') != checkpoint_settings():
+        print("Checkpoint was written with different settings; starting over")
+        return {}
+    return checkpoint.get('done', {})
+
+def checkpoint_settings():
+    return {'target_size': list(TARGET_SIZE), 'jpeg_quality': JPEG_QUALITY}
+
+def save_checkpoint(done):
+    tmp_path = f"{CHECKPOINT_FILE}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'settings': checkpoint_settings(), 'done': done}, f)
+    os.replace(tmp_path, CHECKPOINT_FILE)
+
+def reprocess_all_images(workers=None, fresh=False):
     """Reprocess all existing images in the collages directory."""
     print("Starting image reprocessing...")
-    
+    workers = workers or os.cpu_count() or 1
+
     # Load existing metadata
     with open(METADATA_FILE, 'r') as f:
         metadata = json.load(f)
-    
+
     # Create a backup of the original images
-    backup_dir = os.path.join(COLLAGES_DIR, 'backup')
-    os.makedirs(backup_dir, exist_ok=True)
-    
-    processed_count = 0
-    skipped_count = 0
-    error_count = 0
-    
-    # Process each image
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+
+    done = load_checkpoint(fresh)
+    tasks = []
     for entry in metadata:
         image_id = entry['id']
+        if done.get(image_id) in (PROCESSED, SKIPPED):
+            continue
         image_path = os.path.join(COLLAGES_DIR, f"{image_id}.jpg")
-        
         if not os.path.exists(image_path):
             print(f"Warning: Image not found: {image_path}")
             continue
-            
+        tasks.append((image_id, image_path))
+
+    resumed = sum(1 for status in done.values() if status in (PROCESSED, SKIPPED))
+    if resumed:
+        print(f"Resuming: {resumed} images already done in an earlier run")
+    print(f"Checking {len(tasks)} images with {workers} worker(s)")
+
+    counts = {PROCESSED: 0, SKIPPED: 0, ERROR: 0}
+    bytes_before = bytes_after = 0
+    last_checkpoint = time.time()
+    started = time.perf_counter()
+
+    def run(task):
+        image_id, image_path = task
         try:
-            # Check if image needs reprocessing
-            needs_reprocess, reason = should_reprocess_image(image_path)
-            
-            if not needs_reprocess:
-                print(f"⏩ Skipped {image_id}: {reason}")
-                skipped_count += 1
-                continue
-            
-            # Create backup
-            backup_path = os.path.join(backup_dir, f"{image_id}.jpg")
-            if not os.path.exists(backup_path):
-                Image.open(image_path).save(backup_path)
-                print(f"📦 Backed up: {image_id}")
-            
-            # Process image with new settings
-            processed_path = process_image(image_path)
-            
-            # Move processed image back to original location
-            if os.path.exists(processed_path):
-                os.replace(processed_path, image_path)
-                processed_count += 1
-                print(f"✓ Reprocessed: {image_id}")
-            else:
-                print(f"✗ Failed to process: {image_id}")
-                error_count += 1
-                
+            return image_id, reprocess_image(image_id, image_path)
         except Exception as e:
-            print(f"✗ Error processing {image_id}: {str(e)}")
-            error_count += 1
-    
+            return image_id, (ERROR, str(e), 0, 0)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for image_id, (status, message, size_before, size_after) in executor.map(run, tasks):
+            counts[status] += 1
+            if status == PROCESSED:
+                bytes_before += size_before
+                bytes_after += size_after
+                print(f"✓ Reprocessed: {image_id} ({message})")
+            elif status == SKIPPED:
+                print(f"⏩ Skipped {image_id}: {message}")
+            else:
+                print(f"✗ Error processing {image_id}: {message}")
+
+            done[image_id] = status
+            if time.time() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                save_checkpoint(done)
+                last_checkpoint = time.time()
+    finally:
+        # Also on Ctrl-C: drop queued images, let running ones finish, and record progress
+        executor.shutdown(wait=True, cancel_futures=True)
+        save_checkpoint(done)
+
+    elapsed = time.perf_counter() - started
+    checked = sum(counts.values())
+    if counts[ERROR] == 0:
+        os.remove(CHECKPOINT_FILE)
+
     print(f"\nReprocessing complete:")
-    print(f"- Successfully processed: {processed_count} images")
-    print(f"- Skipped (already optimized): {skipped_count} images")
-    print(f"- Errors encountered: {error_count} images")
-    print(f"- Original images backed up to: {backup_dir}")
+    print(f"- Successfully processed: {counts[PROCESSED]} images")
+    print(f"- Skipped (already optimized): {counts[SKIPPED]} images")
+    print(f"- Errors encountered: {counts[ERROR]} images" + (" (retried on the next run)" if counts[ERROR] else ""))
+    if resumed:
+        print(f"- Done in an earlier run: {resumed} images")
+    print(f"- Time: {elapsed:.1f}s, {checked / elapsed if elapsed else 0:.1f} images/s checked, "
+          f"{counts[PROCESSED] / elapsed if elapsed else 0:.1f} images/s reprocessed")
+    if counts[PROCESSED]:
+        print(f"- Size of reprocessed images: {bytes_before / (1024 * 1024):.1f} MB -> {bytes_after / (1024 * 1024):.1f} MB "
+              f"({bytes_before / (1024 * 1024) / elapsed:.1f} MB/s read)")
+    print(f"- Original images backed up to: {BACKUP_DIR}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocess the collection with the current size and quality settings")
+    parser.add_argument("--workers", "-w", type=int, default=0, help="Worker threads (0 = one per CPU, default: 0)")
+    parser.add_argument("--fresh", action="store_true", help="Ignore the checkpoint of an interrupted run")
+    args = parser.parse_args()
+    reprocess_all_images(args.workers, args.fresh)
 
 if __name__ == '__main__':
-    reprocess_all_images() 
\ No newline at end of file
+    main()
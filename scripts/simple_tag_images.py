@@ -13,124 +13,21 @@ python simple_tag_images.py --input /path/to/images --metadata /path/to/metadata
 import os
 import json
 import argparse
-import base64
-from openai import OpenAI
 
-def encode_image(image_path):
-    """Encode image to base64"""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+from tag_cache import open_default_cache
+from vision_backend import VisionBackend, VisionError
 
-def analyze_image(client, image_path):
-    """Analyze image using GPT Vision"""
+ANALYZE_PROMPT = "Describe this image and provide 5 tags. Format: DESCRIPTION: [text] TAGS: [tag1], [tag2], [tag3], [tag4], [tag5]"
+ANALYZE_MODELS = ["gpt-4-vision", "gpt-4o", "gpt-4o-vision"]
+
+def analyze_image(backend, image_path):
+    """Analyze image using GPT Vision (via the shared backend: cached results, model fallback)"""
     try:
-        # Encode image
-        base64_image = encode_image(image_path)
-        
-        print("Trying model: gpt-4-vision")
-        # Make API call
-        response = client.chat.completions.create(
-            model="gpt-4-vision",  # Try new model name
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "Describe this image and provide 5 tags. Format: DESCRIPTION: [text] TAGS: [tag1], [tag2], [tag3], [tag4], [tag5]"},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                                "detail": "high"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=300
-        )
-        
-        # Parse response - updated to match new API format
-        result = response.choices[0].message.content
-        
-        # Extract description and tags
-        desc_start = result.find("DESCRIPTION:") + len("DESCRIPTION:")
-        tags_start = result.find("TAGS:")
-        
-        if desc_start >= 0 and tags_start >= 0:
-            description = result[desc_start:tags_start].strip()
-            tags = [tag.strip() for tag in result[tags_start + len("TAGS:"):].strip().split(',')]
-            return description, tags
-            
-    except Exception as e:
+        model, result = backend.tag(image_path, ANALYZE_PROMPT)
+        print(f"Tagged with model: {model}")
+        return result["description"], result["tags"]
+    except VisionError as e:
         print(f"Error analyzing image: {e}")
-        # If the model name is incorrect, try alternative names
-        if "model_not_found" in str(e):
-            try:
-                print("Trying model: gpt-4o")
-                # Try alternative model name
-                response = client.chat.completions.create(
-                    model="gpt-4o",  # Try alternative model name
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": "Describe this image and provide 5 tags. Format: DESCRIPTION: [text] TAGS: [tag1], [tag2], [tag3], [tag4], [tag5]"},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{base64_image}",
-                                        "detail": "high"
-                                    }
-                                }
-                            ]
-                        }
-                    ],
-                    max_tokens=300
-                )
-                result = response.choices[0].message.content
-                
-                desc_start = result.find("DESCRIPTION:") + len("DESCRIPTION:")
-                tags_start = result.find("TAGS:")
-                
-                if desc_start >= 0 and tags_start >= 0:
-                    description = result[desc_start:tags_start].strip()
-                    tags = [tag.strip() for tag in result[tags_start + len("TAGS:"):].strip().split(',')]
-                    return description, tags
-            except Exception as e2:
-                print(f"Error with alternative model: {e2}")
-                try:
-                    print("Trying model: gpt-4o-vision")
-                    # Try second alternative model name
-                    response = client.chat.completions.create(
-                        model="gpt-4o-vision",  # Try second alternative model name
-                        messages=[
-                            {
-                                "role": "user",
-                                "content": [
-                                    {"type": "text", "text": "Describe this image and provide 5 tags. Format: DESCRIPTION: [text] TAGS: [tag1], [tag2], [tag3], [tag4], [tag5]"},
-                                    {
-                                        "type": "image_url",
-                                        "image_url": {
-                                            "url": f"data:image/jpeg;base64,{base64_image}",
-                                            "detail": "high"
-                                        }
-                                    }
-                                ]
-                            }
-                        ],
-                        max_tokens=300
-                    )
-                    result = response.choices[0].message.content
-                    
-                    desc_start = result.find("DESCRIPTION:") + len("DESCRIPTION:")
-                    tags_start = result.find("TAGS:")
-                    
-                    if desc_start >= 0 and tags_start >= 0:
-                        description = result[desc_start:tags_start].strip()
-                        tags = [tag.strip() for tag in result[tags_start + len("TAGS:"):].strip().split(',')]
-                        return description, tags
-                except Exception as e3:
-                    print(f"Error with second alternative model: {e3}")
     
     return "", []
 
@@ -139,11 +36,13 @@ def main():
     parser.add_argument("--input", required=True, help="Directory containing images")
     parser.add_argument("--metadata", required=True, help="Path to metadata.json")
     parser.add_argument("--api-key", required=True, help="OpenAI API key")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the API, ignoring the tagging cache")
     
     args = parser.parse_args()
     
-    # Initialize OpenAI client
-    client = OpenAI(api_key=args.api_key)
+    # Initialize the vision backend (one pooled client for all images)
+    cache = None if args.no_cache else open_default_cache()
+    backend = VisionBackend(args.api_key, models=ANALYZE_MODELS, cache=cache)
     
     # Load metadata
     with open(args.metadata, 'r') as f:
@@ -165,7 +64,7 @@ def main():
         print(f"Processing [{i+1}/{len(metadata)}]: {image_data['id']}")
         
         # Analyze image
-        description, tags = analyze_image(client, image_path)
+        description, tags = analyze_image(backend, image_path)
         
         # Update metadata
         if description:
@@ -182,6 +81,9 @@ def main():
         print("---")
     
     print("Finished processing all images")
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Tag cache: {stats['hits']} hits, {stats['misses']} misses ({stats['entries']} entries)")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Sprite Atlases for Assemblage
+
+Mosaic and tiling compositions draw dozens of small fragments, each one a
+separate image request. This packs a downscaled copy of every collection
+image into a few large WebP sprite sheets, plus a JSON index of where each
+image sits, so the frontend loads a handful of files instead of hundreds:
+
+    images/atlases/<tile size>/atlas.json
+    images/atlases/<tile size>/sheet-<n>.<content hash>.webp
+
+Tiles are placed with MaxRects bin packing (bottom-left rule, so a partly
+filled sheet stays short) on sheets of at most 4096x4096, with a gutter
+between tiles so filtering at the edges doesn't bleed in a neighbour. Rebuilds are incremental: the packing (free
+space per sheet) is kept in packing.json, images that were removed or
+changed give their space back, new images fill gaps before a new sheet is
+started, and only sheets whose contents changed are re-encoded. Sheet files
+are named by content, so they can be cached forever.
+
+atlas.json:
+
+    {"version": 1, "tile_size": 256, "metadata_version": 812,
+     "sheets": [{"file": "sheet-0.3f2a9c1e.webp", "width": 4096, "height": 3112, "images": 231}, ...],
+     "images": {"img1a2b3c4d": [sheet, x, y, width, height], ...}}
+
+Usage:
+    python sprite_atlas.py                  # build or update the 256px atlas
+    python sprite_atlas.py --size 128
+    python sprite_atlas.py --force          # repack from scratch
+
+    from sprite_atlas import build_atlas
+    manifest = build_atlas(metadata_store, tile_size=256)
+"""
+
+import os
+import json
+import hashlib
+import argparse
+
+from PIL import Image
+
+from image_cache import shared_cache
+from image_io import fit_size
+from metadata_store import MetadataStore, entry_filename
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+IMAGES_DIR = os.path.join(ROOT_DIR, "images")
+COLLAGES_DIR = os.path.join(IMAGES_DIR, "collages")
+ATLASES_DIR = os.path.join(IMAGES_DIR, "atlases")
+METADATA_FILE = os.path.join(IMAGES_DIR, "metadata.json")
+
+# Bump when the layout of atlas.json or packing.json changes; older atlases are repacked
+ATLAS_VERSION = 1
+
+TILE_SIZES = (128, 256)
+DEFAULT_TILE_SIZE = 256
+SHEET_SIZE = 4096
+GUTTER = 2
+WEBP_OPTIONS = {"quality": 82, "method": 4}
+BACKGROUND = (255, 255, 255)
+
+
+class MaxRectsBin:
+    """Free space of one sheet as a list of maximal free rectangles (x, y, width, height)."""
+
+    def __init__(self, width, height, free=None):
+        self.width = width
+        self.height = height
+        self.free = [tuple(rect) for rect in free] if free is not None else [(0, 0, width, height)]
+
+    def insert(self, width, height):
+        """Place a width x height rectangle; returns (x, y), or None if it doesn't fit."""
+        best, best_fit = None, None
+        for fx, fy, fw, fh in self.free:
+            if width <= fw and height <= fh:
+                fit = (fy + height, fx)
+                if best_fit is None or fit < best_fit:
+                    best, best_fit = (fx, fy), fit
+        if best is not None:
+            self._occupy((best[0], best[1], width, height))
+        return best
+
+    def release(self, rect):
+        """Give a placed rectangle's space back."""
+        self.free.append(tuple(rect))
+        self._prune()
+
+    def _occupy(self, used):
+        ux, uy, uw, uh = used
+        split = []
+        for rect in self.free:
+            fx, fy, fw, fh = rect
+            if ux >= fx + fw or ux + uw <= fx or uy >= fy + fh or uy + uh <= fy:
+                split.append(rect)
+                continue
+            # Up to four maximal rectangles around the used one
+            if ux > fx:
+                split.append((fx, fy, ux - fx, fh))
+            if ux + uw < fx + fw:
+                split.append((ux + uw, fy, fx + fw - ux - uw, fh))
+            if uy > fy:
+                split.append((fx, fy, fw, uy - fy))
+            if uy + uh < fy + fh:
+                split.append((fx, uy + uh, fw, fy + fh - uy - uh))
+        self.free = split
+        self._prune()
+
+    def _prune(self):
+        """Drop free rectangles contained in another."""
+        rects = sorted(set(self.free), key=lambda rect: rect[2] * rect[3], reverse=True)
+        kept = []
+        for rect in rects:
+            x, y, w, h = rect
+            if not any(kx <= x and ky <= y and x + w <= kx + kw and y + h <= ky + kh for kx, ky, kw, kh in kept):
+                kept.append(rect)
+        self.free = kept
+
+
+def atlas_dir(tile_size, atlases_dir=ATLASES_DIR):
+    return os.path.join(atlases_dir, str(tile_size))
+
+
+def manifest_path(tile_size, atlases_dir=ATLASES_DIR):
+    return os.path.join(atlas_dir(tile_size, atlases_dir), "atlas.json")
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def _load_packing(path, tile_size):
+    try:
+        with open(path) as f:
+            packing = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if packing.get("version") != ATLAS_VERSION or packing.get("tile_size") != tile_size:
+        return None
+    return packing
+
+
+def _render_sheet(index, placements, sources, directory):
+    """Draw a sheet's tiles from their source images and write it. Returns its manifest record."""
+    tiles = sorted(placements.items())
+    width = max(x + w for _, (_, x, y, w, h) in tiles)
+    height = max(y + h for _, (_, x, y, w, h) in tiles)
+    digest = hashlib.sha1(json.dumps([(image_id, placement, sources[image_id][1]) for image_id, placement in tiles]).encode())
+    filename = f"sheet-{index}.{digest.hexdigest()[:10]}.webp"
+    path = os.path.join(directory, filename)
+    if not os.path.exists(path):
+        cache = shared_cache()
+        sheet = Image.new("RGB", (width, height), BACKGROUND)
+        for image_id, (_, x, y, w, h) in tiles:
+            tile = cache.get(sources[image_id][0], (w, h))
+            if tile.size != (w, h):
+                tile = tile.resize((w, h), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            sheet.paste(tile, (x, y))
+        tmp_path = f"{path}.tmp"
+        sheet.save(tmp_path, format="WEBP", **WEBP_OPTIONS)
+        os.replace(tmp_path, path)
+    return {"file": filename, "width": width, "height": height, "images": len(tiles)}
+
+
+def build_atlas(store, tile_size=DEFAULT_TILE_SIZE, collages_dir=COLLAGES_DIR, atlases_dir=ATLASES_DIR, force=False):
+    """Create or update the atlas for one tile size. Returns the manifest (as written to atlas.json)."""
+    if tile_size not in TILE_SIZES:
+        raise ValueError(f"tile size must be one of: {', '.join(map(str, TILE_SIZES))}")
+    directory = atlas_dir(tile_size, atlases_dir)
+    os.makedirs(directory, exist_ok=True)
+    packing_path = os.path.join(directory, "packing.json")
+    metadata_version = store.version()
+
+    # Source file and its (mtime, size) signature per image
+    sources = {}
+    for entry in store.all():
+        path = os.path.join(collages_dir, entry_filename(entry))
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        sources[entry["id"]] = (path, [st.st_mtime_ns, st.st_size])
+
+    packing = None if force else _load_packing(packing_path, tile_size)
+    if packing is None:
+        packing = {"version": ATLAS_VERSION, "tile_size": tile_size, "sheets": [], "images": {}}
+    bins = [MaxRectsBin(SHEET_SIZE, SHEET_SIZE, sheet["free"]) for sheet in packing["sheets"]]
+    placed = packing["images"]  # id -> {"rect": [sheet, x, y, w, h], "source": signature}
+    dirty = set()
+
+    for image_id in list(placed):
+        source = sources.get(image_id)
+        if source is None or source[1] != placed[image_id]["source"]:
+            sheet, x, y, w, h = placed.pop(image_id)["rect"]
+            bins[sheet].release((x, y, w + GUTTER, h + GUTTER))
+            dirty.add(sheet)
+
+    # Tallest first packs tighter
+    added = []
+    for image_id, (path, signature) in sources.items():
+        if image_id not in placed:
+            size = fit_size(shared_cache().header(path)["size"], (tile_size, tile_size))
+            added.append((size[1], size[0], image_id, signature))
+    added.sort(reverse=True)
+
+    for h, w, image_id, signature in added:
+        for sheet, sheet_bin in enumerate(bins):
+            position = sheet_bin.insert(w + GUTTER, h + GUTTER)
+            if position:
+                break
+        else:
+            bins.append(MaxRectsBin(SHEET_SIZE, SHEET_SIZE))
+            sheet = len(bins) - 1
+            position = bins[sheet].insert(w + GUTTER, h + GUTTER)
+        placed[image_id] = {"rect": [sheet, position[0], position[1], w, h], "source": signature}
+        dirty.add(sheet)
+
+    previous = {}
+    if os.path.exists(manifest_path(tile_size, atlases_dir)) and not force:
+        try:
+            with open(manifest_path(tile_size, atlases_dir)) as f:
+                previous = json.load(f)
+        except ValueError:
+            previous = {}
+    previous_sheets = previous.get("sheets", []) if previous.get("version") == ATLAS_VERSION else []
+
+    by_sheet = [{} for _ in bins]
+    for image_id, placement in placed.items():
+        by_sheet[placement["rect"][0]][image_id] = placement["rect"]
+    sheets = []
+    for index, placements in enumerate(by_sheet):
+        if not placements:
+            sheets.append({"file": None, "width": 0, "height": 0, "images": 0})
+        elif index in dirty or index >= len(previous_sheets) or not previous_sheets[index].get("file"):
+            sheets.append(_render_sheet(index, placements, sources, directory))
+        else:
+            sheets.append(previous_sheets[index])
+
+    manifest = {
+        "version": ATLAS_VERSION,
+        "tile_size": tile_size,
+        "metadata_version": metadata_version,
+        "sheets": sheets,
+        "images": {image_id: placement["rect"] for image_id, placement in sorted(placed.items())},
+    }
+    packing["sheets"] = [{"free": sheet_bin.free} for sheet_bin in bins]
+    _write_json(packing_path, packing)
+    _write_json(manifest_path(tile_size, atlases_dir), manifest)
+
+    # Sheets replaced by this build
+    current = {sheet["file"] for sheet in sheets if sheet["file"]}
+    for name in os.listdir(directory):
+        if name.startswith("sheet-") and name.endswith(".webp") and name not in current:
+            os.remove(os.path.join(directory, name))
+    return manifest
+
+
+def load_manifest(tile_size, atlases_dir=ATLASES_DIR):
+    """The atlas.json for a tile size, or None if it hasn't been built."""
+    try:
+        with open(manifest_path(tile_size, atlases_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack the collection into WebP sprite sheets for the mosaic and tiling generators")
+    parser.add_argument("--metadata", "-m", default=METADATA_FILE, help="Path to metadata.json")
+    parser.add_argument("--input", "-i", default=COLLAGES_DIR, help="Directory containing the collection images")
+    parser.add_argument("--output", "-o", default=ATLASES_DIR, help="Directory to write atlases to")
+    parser.add_argument("--size", "-s", type=int, choices=TILE_SIZES, default=DEFAULT_TILE_SIZE,
+                        help=f"Longest side of each tile (default: {DEFAULT_TILE_SIZE})")
+    parser.add_argument("--force", action="store_true", help="Repack every image instead of updating the existing atlas")
+    args = parser.parse_args()
+
+    manifest = build_atlas(MetadataStore(args.metadata), args.size, args.input, args.output, args.force)
+    sheets = [sheet for sheet in manifest["sheets"] if sheet["file"]]
+    total = sum(os.path.getsize(os.path.join(atlas_dir(args.size, args.output), sheet["file"])) for sheet in sheets)
+    print(f"✓ {len(manifest['images'])} images in {len(sheets)} sheet(s), {total / (1024 * 1024):.1f} MB "
+          f"-> {manifest_path(args.size, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Static File Server for Assemblage
+
+A threaded replacement for the single-threaded SimpleHTTPRequestHandler setup
+in server.py. It serves the site the same way (same paths, directory index
+and listings) but:
+
+- handles each connection on its own thread with HTTP/1.1 keep-alive, so one
+  slow client no longer blocks everyone else
+- sends file bodies with os.sendfile (zero-copy) from an LRU cache of open
+  file handles, revalidated with a stat() per request
+- answers If-None-Match / If-Modified-Since with 304 (ETag from mtime and
+  size), and single byte ranges with 206
+- marks content-hashed assets (name.<hex hash>.ext) as immutable for a year;
+  everything else is revalidated on each use
+- serves a precompressed file.br / file.gz next to the requested file when
+  the client accepts it and the copy is up to date
+
+Usage:
+    python static_server.py                      # serve the project root on port 8000
+    python static_server.py --port 8080 --root /path/to/site
+    python static_server.py --precompress        # write .gz (and .br) copies of text assets, then exit
+"""
+
+import os
+import re
+import sys
+import gzip
+import argparse
+import threading
+import email.utils
+from http import HTTPStatus
+from functools import partial
+from collections import OrderedDict
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+
+DEFAULT_PORT = 8000
+FILE_CACHE_SIZE = 256  # Open file handles kept for reuse
+SENDFILE_CHUNK = 1 << 20
+
+# Precompressed copies, best first: (Content-Encoding, file suffix)
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# name.<8+ hex digits>.ext, e.g. app.3f9a1c2e.js: the name changes with the content
+HASHED_ASSET = re.compile(r"\.[0-9a-f]{8,}\.[A-Za-z0-9]+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Compressed by --precompress (binary formats like images are already compressed)
+COMPRESSIBLE_EXTENSIONS = {".html", ".js", ".mjs", ".css", ".json", ".svg", ".txt", ".md"}
+MIN_COMPRESS_SIZE = 1024
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class OpenFile:
+    """A cached open file: descriptor plus the stat it was opened with."""
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDONLY)
+        st = os.fstat(self.fd)
+        self.mtime_ns = st.st_mtime_ns
+        self.size = st.st_size
+        self.etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        self.last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+        self.users = 0
+        self.evicted = False
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileCache:
+    """LRU cache of open file descriptors shared by request threads.
+
+    A descriptor is only closed once it is both evicted (or stale) and no
+    longer in use; reads use explicit offsets so threads can share it.
+    """
+
+    def __init__(self, max_entries=FILE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._files = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, path):
+        """Open (or reuse) path. Raises OSError if it can't be opened. Pair with release()."""
+        st = os.stat(path)
+        with self._lock:
+            entry = self._files.get(path)
+            if entry and entry.mtime_ns == st.st_mtime_ns and entry.size == st.st_size:
+                self._files.move_to_end(path)
+                entry.users += 1
+                self.hits += 1
+                return entry
+            if entry:
+                self._discard(path)
+        entry = OpenFile(path)
+        with self._lock:
+            self.misses += 1
+            if path in self._files:
+                self._discard(path)
+            self._files[path] = entry
+            entry.users += 1
+            while len(self._files) > self.max_entries:
+                self._discard(next(iter(self._files)))
+        return entry
+
+    def release(self, entry):
+        with self._lock:
+            entry.users -= 1
+            if entry.evicted and not entry.users:
+                entry.close()
+
+    def _discard(self, path):
+        """Drop a cache entry, closing it now if unused. Caller holds the lock."""
+        entry = self._files.pop(path)
+        entry.evicted = True
+        if not entry.users:
+            entry.close()
+
+    def stats(self):
+        with self._lock:
+            return {"open_files": len(self._files), "hits": self.hits, "misses": self.misses}
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single "bytes=" range, None to ignore it, or False if unsatisfiable."""
+    match = _RANGE.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if not length or not size:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+class StaticRequestHandler(SimpleHTTPRequestHandler):
+    """SimpleHTTPRequestHandler with keep-alive, caching headers, ranges, precompression and sendfile."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and the sendfile body go out as separate writes; without this,
+    # Nagle's algorithm holds the body back for the client's delayed ACK
+    disable_nagle_algorithm = True
+    file_cache = FileCache()
+    quiet = False
+
+    def do_GET(self):
+        self._serve(head=False)
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def _accepts(self, encoding):
+        accepted = self.headers.get("Accept-Encoding", "")
+        return any(part.split(";")[0].strip() == encoding and not part.replace(" ", "").endswith(";q=0")
+                   for part in accepted.split(","))
+
+    def _resolve(self):
+        """Map the request to a file path, or None after answering (redirect, listing or 404)."""
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            for index in ("index.html", "index.htm"):
+                if os.path.isfile(os.path.join(path, index)) and self.path.split("?")[0].endswith("/"):
+                    return os.path.join(path, index)
+            # Trailing-slash redirect and directory listing as before
+            f = super().send_head()
+            if f:
+                try:
+                    if self.command != "HEAD":
+                        self.copyfile(f, self.wfile)
+                finally:
+                    f.close()
+            return None
+        if path.endswith("/") or not os.path.isfile(path):
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        return path
+
+    def _precompressed(self, path, source_mtime_ns):
+        """(encoding, path) of an up-to-date precompressed copy the client accepts, or (None, path)."""
+        for encoding, suffix in ENCODINGS:
+            if not self._accepts(encoding):
+                continue
+            try:
+                st = os.stat(path + suffix)
+            except OSError:
+                continue
+            if st.st_mtime_ns >= source_mtime_ns:
+                return encoding, path + suffix
+        return None, path
+
+    def _not_modified(self, etag, entry):
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags or f"W/{etag}" in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            return entry.mtime_ns // 1_000_000_000 <= since
+        return False
+
+    def _serve(self, head):
+        path = self._resolve()
+        if path is None:
+            return
+        source_mtime_ns = os.stat(path).st_mtime_ns
+        encoding, body_path = self._precompressed(path, source_mtime_ns)
+        try:
+            entry = self.file_cache.acquire(body_path)
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return
+
+        try:
+            etag = entry.etag if not encoding else f'{entry.etag[:-1]}-{encoding}"'
+            cache_control = IMMUTABLE_CACHE_CONTROL if HASHED_ASSET.search(path) else REVALIDATE_CACHE_CONTROL
+
+            if self._not_modified(etag, entry):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", cache_control)
+                self.end_headers()
+                return
+
+            start, end = 0, entry.size - 1
+            status = HTTPStatus.OK
+            range_header = self.headers.get("Range")
+            if range_header and not encoding and self.headers.get("If-Range", etag) == etag:
+                byte_range = parse_range(range_header, entry.size)
+                if byte_range is False:
+                    self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                    self.send_header("Content-Range", f"bytes */{entry.size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if byte_range:
+                    start, end = byte_range
+                    status = HTTPStatus.PARTIAL_CONTENT
+
+            length = end - start + 1
+            self.send_response(status)
+            self.send_header("Content-Type", self.guess_type(path))
+            self.send_header("Content-Length", str(length))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", entry.last_modified)
+            self.send_header("Cache-Control", cache_control)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Vary", "Accept-Encoding")
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            if status == HTTPStatus.PARTIAL_CONTENT:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{entry.size}")
+            self.end_headers()
+
+            if not head and length > 0:
+                self._send_body(entry.fd, start, length)
+        finally:
+            self.file_cache.release(entry)
+
+    def _send_body(self, fd, offset, count):
+        self.wfile.flush()
+        if hasattr(os, "sendfile"):
+            out_fd = self.connection.fileno()
+            while count > 0:
+                sent = os.sendfile(out_fd, fd, offset, min(count, SENDFILE_CHUNK))
+                if not sent:
+                    break
+                offset += sent
+                count -= sent
+            return
+        while count > 0:
+            chunk = os.pread(fd, min(count, SENDFILE_CHUNK), offset)
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            offset += len(chunk)
+            count -= len(chunk)
+
+
+def make_server(root=ROOT_DIR, port=DEFAULT_PORT, host="", quiet=False):
+    """A ThreadingHTTPServer serving root with StaticRequestHandler."""
+    handler_class = type("StaticRequestHandler", (StaticRequestHandler,), {"quiet": quiet})
+    server = ThreadingHTTPServer((host, port), partial(handler_class, directory=root))
+    server.daemon_threads = True
+    return server
+
+
+def precompress(root=ROOT_DIR, force=False):
+    """Write .gz (and .br, if brotli is installed) copies of text assets under root."""
+    written = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith(".") and name not in ("node_modules", "venv")]
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if os.path.splitext(filename)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            st = os.stat(path)
+            if st.st_size < MIN_COMPRESS_SIZE:
+                continue
+            outputs = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                outputs.append((".br", lambda data: brotli.compress(data, quality=11)))
+            for suffix, compress in outputs:
+                out_path = path + suffix
+                if not force and os.path.exists(out_path) and os.stat(out_path).st_mtime_ns >= st.st_mtime_ns:
+                    continue
+                with open(path, "rb") as f:
+                    data = compress(f.read())
+                tmp_path = f"{out_path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, out_path)
+                written += 1
+    print(f"Wrote {written} precompressed file{'s' if written != 1 else ''}"
+          + ("" if brotli is not None else " (gzip only; install brotli for .br)"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Assemblage site with a threaded static file server")
+    parser.add_argument("--port", "-p", type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument("--root", "-r", default=ROOT_DIR, help="Directory to serve (default: project root)")
+    parser.add_argument("--quiet", "-q", action="store_true", help="Don't log each request")
+    parser.add_argument("--precompress", action="store_true", help="Write .gz/.br copies of text assets and exit")
+    parser.add_argument("--force", action="store_true", help="With --precompress, rewrite copies that are up to date")
+    args = parser.parse_args()
+
+    if args.precompress:
+        precompress(args.root, args.force)
+        return
+
+    with make_server(args.root, args.port, quiet=args.quiet) as httpd:
+        print(f"Serving {args.root} at http://localhost:{args.port}")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Stub Vision API Server
+
+A local stand-in for the OpenAI chat completions endpoint, for exercising the
+concurrent tagger without an API key or spending tokens. It answers
+POST /v1/chat/completions with a canned DESCRIPTION/TAGS reply (one
+"IMAGE n:" block per image for multi-image requests), sends
+x-ratelimit-* headers, and returns 429 with retry-after once the simulated
+requests-per-minute budget is used up.
+
+Usage:
+python stub_vision_server.py --port 8001 --rpm 120 --latency 0.5
+python stub_vision_server.py --models gpt-4o      # other models answer 404 model_not_found
+python tag_images_with_gpt.py --input ... --metadata ... --api-key stub --base-url http://localhost:8001/v1
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_TAGS = ['surreal', 'vintage', 'monochrome', 'dreamlike', 'collage', 'mysterious',
+             'botanical', 'architectural', 'portrait', 'celestial', 'geometric', 'nostalgic']
+
+
+def stub_answer():
+    """A canned reply in the DESCRIPTION/TAGS format."""
+    tags = random.sample(STUB_TAGS, 6)
+    return (f"DESCRIPTION: A stub description of a {tags[0]} black and white collage image.\n"
+            f"TAGS: {', '.join(tags)}")
+
+
+class RequestWindow:
+    """Sliding one-minute window of request times."""
+
+    def __init__(self, rpm):
+        self.rpm = rpm
+        self._times = deque()
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """Record a request. Returns (allowed, remaining, seconds until a slot frees)."""
+        with self._lock:
+            now = time.monotonic()
+            while self._times and now - self._times[0] >= 60:
+                self._times.popleft()
+            reset = 60 - (now - self._times[0]) if self._times else 0.0
+            if len(self._times) >= self.rpm:
+                return False, 0, reset
+            self._times.append(now)
+            return True, self.rpm - len(self._times), reset
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    window = None
+    latency = 0.0
+    models = None  # Model names served; others get a 404 model_not_found (None serves any)
+
+    def _send_json(self, status, body, headers):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            request_body = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            request_body = {}
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Not found'}}, {})
+            return
+
+        model = request_body.get('model', 'stub-vision')
+        if self.models is not None and model not in self.models:
+            self._send_json(404, {'error': {
+                'message': f"The model `{model}` does not exist or you do not have access to it.",
+                'type': 'invalid_request_error',
+                'code': 'model_not_found',
+            }}, {})
+            return
+
+        allowed, remaining, reset = self.window.admit()
+        headers = {
+            'x-ratelimit-limit-requests': str(self.window.rpm),
+            'x-ratelimit-remaining-requests': str(remaining),
+            'x-ratelimit-reset-requests': f"{reset:.3f}s",
+        }
+        if not allowed:
+            headers['retry-after'] = f"{max(reset, 0.1):.3f}"
+            self._send_json(429, {'error': {'message': 'Rate limit reached (stub)', 'type': 'requests'}}, headers)
+            return
+
+        time.sleep(self.latency * random.uniform(0.5, 1.5))
+        images = sum(1 for message in request_body.get('messages', [])
+                     for part in message.get('content', []) if isinstance(part, dict) and part.get('type') == 'image_url')
+        if images > 1:
+            content = "\n\n".join(f"IMAGE {number}:\n{stub_answer()}" for number in range(1, images + 1))
+        else:
+            content = stub_answer()
+        self._send_json(200, {
+            'id': f"chatcmpl-stub{random.getrandbits(32):08x}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 100, 'completion_tokens': 30, 'total_tokens': 130},
+        }, headers)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of the OpenAI vision chat completions API")
+    parser.add_argument("--port", "-p", type=int, default=8001, help="Port to listen on (default: 8001)")
+    parser.add_argument("--rpm", type=int, default=120, help="Simulated requests per minute before 429s (default: 120)")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean response latency in seconds (default: 0.5)")
+    parser.add_argument("--models", help="Comma-separated model names to serve; others return model_not_found (default: any)")
+    args = parser.parse_args()
+
+    StubHandler.window = RequestWindow(args.rpm)
+    StubHandler.latency = args.latency
+    if args.models:
+        StubHandler.models = {name.strip() for name in args.models.split(',') if name.strip()}
+    server = ThreadingHTTPServer(('localhost', args.port), StubHandler)
+    print(f"Stub vision API on http://localhost:{args.port}/v1 ({args.rpm} rpm, ~{args.latency}s latency)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
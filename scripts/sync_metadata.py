@@ -4,8 +4,10 @@ Synchronize metadata.json with actual files in the collages directory
 """
 
 import os
-import json
 import sys
+import shutil
+
+from metadata_store import MetadataStore
 
 # Get the absolute path to the script
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -23,9 +25,14 @@ def sync_metadata():
     
     print(f"Processing metadata file: {METADATA_FILE}")
     
+    # Backup original file
+    backup_file = f"{METADATA_FILE}.backup"
+    print(f"Creating backup at {backup_file}")
+    shutil.copy2(METADATA_FILE, backup_file)
+    
     # Load the existing metadata
-    with open(METADATA_FILE, 'r') as f:
-        metadata = json.load(f)
+    store = MetadataStore(METADATA_FILE)
+    metadata = store.all()
     
     print(f"Found {len(metadata)} entries in metadata.json")
     
@@ -40,9 +47,9 @@ def sync_metadata():
     found_entries = 0
     missing_files = 0
     
-    # Filter metadata to only include entries for existing files
-    valid_metadata = []
+    # Find entries to drop (missing files) and entries to rewrite (path -> src)
     invalid_entries = []
+    converted_entries = []
     
     for entry in metadata:
         # Get the filename from the entry
@@ -55,6 +62,7 @@ def sync_metadata():
                 entry['src'] = filename
                 if 'path' in entry:
                     del entry['path']
+                converted_entries.append(entry)
             else:
                 print(f"Warning: Entry without src or path: {entry}")
                 invalid_entries.append(entry)
@@ -62,7 +70,6 @@ def sync_metadata():
         
         # Check if the file exists
         if filename in image_files_set:
-            valid_metadata.append(entry)
             found_entries += 1
         else:
             print(f"Warning: File not found for entry: {filename}")
@@ -73,16 +80,12 @@ def sync_metadata():
     print(f"- Valid entries (file exists): {found_entries}")
     print(f"- Invalid entries (file missing): {missing_files}")
     
-    # Backup original file
-    backup_file = f"{METADATA_FILE}.backup"
-    print(f"Creating backup at {backup_file}")
-    with open(backup_file, 'w') as f:
-        json.dump(metadata, f, indent=2)
-    
     # Save the filtered metadata
     print(f"Saving updated metadata to {METADATA_FILE}")
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(valid_metadata, f, indent=2)
+    with store.batch():
+        for entry in converted_entries:
+            store.put(entry)
+        store.remove([entry['id'] for entry in invalid_entries if 'id' in entry])
     
     print(f"Metadata updated successfully")
     
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Tagging Cache for Assemblage
+
+Persistent cache of vision-model results (description and tags) keyed by the
+image content, the prompt, the model and the request variant (the detail
+level and tile budget the image was sent at, since a low-detail answer
+shouldn't stand in for a high-detail one). A re-uploaded, reprocessed or
+re-tagged image with the same bytes gets its stored result back instead of
+another API round-trip.
+
+The cache is a small SQLite database (WAL mode, safe to share between worker
+threads) bounded to a maximum number of entries; the least recently used
+entries are evicted first. The entry count is kept in memory, so a put
+doesn't count the table; it is re-read every RECOUNT_INTERVAL puts to pick up
+entries added by other processes sharing the database. Hits and misses are
+counted per process.
+
+Usage:
+    from tag_cache import open_default_cache, file_content_hash
+
+    cache = open_default_cache()
+    key = file_content_hash("/path/to/image.jpg")
+    result = cache.get(key, prompt, "gpt-4o", variant="detail=low")   # {'description': ..., 'tags': [...]} or None
+    cache.put(key, prompt, "gpt-4o", description, tags, variant="detail=low")
+    cache.stats()
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+
+DEFAULT_CACHE_PATH = os.path.join(ROOT_DIR, "images", "tag_cache.db")
+DEFAULT_MAX_ENTRIES = 50000
+RECOUNT_INTERVAL = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tag_cache (
+    content_hash TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    description TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (content_hash, prompt_hash, model)
+);
+CREATE INDEX IF NOT EXISTS idx_tag_cache_last_used ON tag_cache(last_used);
+"""
+
+_READ_CHUNK = 1 << 20
+
+
+def file_content_hash(path):
+    """SHA-256 of a file's bytes, as hex."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_READ_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bytes_content_hash(data):
+    """SHA-256 of in-memory image bytes, as hex."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def prompt_hash(prompt, variant=""):
+    """Short stable hash of the prompt text and the request variant (anything else that shapes the answer)."""
+    text = f"{prompt}\0{variant}" if variant else prompt
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class TagCache:
+    """Content-addressed, LRU-bounded cache of vision tagging results."""
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._count = self._conn.execute("SELECT COUNT(*) FROM tag_cache").fetchone()[0]
+        self._puts = 0
+
+    def get(self, content_hash, prompt, model, variant=""):
+        """Return the cached {'description', 'tags'} for this image, prompt, model and variant, or None."""
+        return self.get_any(content_hash, prompt, (model,), variant)[1]
+
+    def get_any(self, content_hash, prompt, models, variant=""):
+        """Return (model, result) for the first model in `models` with a cached result, or (None, None).
+
+        Counts as a single lookup, for callers that fall back through several models.
+        """
+        ph = prompt_hash(prompt, variant)
+        with self._lock:
+            for model in models:
+                row = self._conn.execute(
+                    "SELECT description, tags FROM tag_cache WHERE content_hash = ? AND prompt_hash = ? AND model = ?",
+                    (content_hash, ph, model),
+                ).fetchone()
+                if row is not None:
+                    self.hits += 1
+                    self._conn.execute(
+                        "UPDATE tag_cache SET last_used = ? WHERE content_hash = ? AND prompt_hash = ? AND model = ?",
+                        (time.time(), content_hash, ph, model),
+                    )
+                    return model, {"description": row[0], "tags": json.loads(row[1])}
+            self.misses += 1
+        return None, None
+
+    def put(self, content_hash, prompt, model, description, tags, variant=""):
+        """Store a result, evicting the least recently used entries beyond max_entries."""
+        now = time.time()
+        ph = prompt_hash(prompt, variant)
+        with self._lock:
+            # Update first, so it's known whether a row was added
+            updated = self._conn.execute(
+                "UPDATE tag_cache SET description = ?, tags = ?, created = ?, last_used = ? "
+                "WHERE content_hash = ? AND prompt_hash = ? AND model = ?",
+                (description, json.dumps(tags), now, now, content_hash, ph, model),
+            ).rowcount
+            if not updated:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO tag_cache "
+                    "(content_hash, prompt_hash, model, description, tags, created, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (content_hash, ph, model, description, json.dumps(tags), now, now),
+                )
+                self._count += 1
+            self._puts += 1
+            if self._puts % RECOUNT_INTERVAL == 0:
+                self._count = self._conn.execute("SELECT COUNT(*) FROM tag_cache").fetchone()[0]
+            self._evict()
+
+    def _evict(self):
+        excess = self._count - self.max_entries
+        if excess > 0:
+            self._count -= self._conn.execute(
+                "DELETE FROM tag_cache WHERE rowid IN "
+                "(SELECT rowid FROM tag_cache ORDER BY last_used LIMIT ?)",
+                (excess,),
+            ).rowcount
+
+    def count(self):
+        with self._lock:
+            return self._count
+
+    def stats(self):
+        """Hit/miss counters for this process and the current number of entries."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self.count(),
+            "max_entries": self.max_entries,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM tag_cache")
+            self._count = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_default_cache():
+    """Open the cache at TAG_CACHE_PATH (or images/tag_cache.db), bounded by TAG_CACHE_MAX_ENTRIES."""
+    return TagCache(
+        os.getenv("TAG_CACHE_PATH") or DEFAULT_CACHE_PATH,
+        int(os.getenv("TAG_CACHE_MAX_ENTRIES") or DEFAULT_MAX_ENTRIES),
+    )
@@ -10,48 +10,48 @@ Requirements:
 - openai Python package: pip install openai
 - PIL: pip install pillow
 
+Images are tagged concurrently by a small thread pool. Requests share a token
+bucket that follows the API's rate-limit headers and back off exponentially on
+429s. Each result is appended to a journal file next to the metadata as soon as
+it arrives, so an interrupted run resumes where it stopped; the journal is
+folded into the metadata at the end.
+
 Usage:
 python tag_images_with_gpt.py --input /path/to/processed/images --metadata /path/to/image_metadata.json --api-key YOUR_OPENAI_API_KEY
+python tag_images_with_gpt.py ... --concurrency 8
+python tag_images_with_gpt.py ... --images-per-request 8           # bulk runs: 8 low-detail images per request
+python tag_images_with_gpt.py ... --batch-export batch.jsonl       # or an OpenAI Batch API job file...
+python tag_images_with_gpt.py ... --batch-ingest batch_output.jsonl   # ...and its results
+python tag_images_with_gpt.py ... --base-url http://localhost:8001/v1   # e.g. against stub_vision_server.py
 """
 
 import os
 import sys
 import json
 import argparse
-import base64
 from PIL import Image
 import io
 import time
-import random
-from openai import OpenAI
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from metadata_store import MetadataStore
+from rate_limiter import TokenBucket
+from tag_cache import open_default_cache, file_content_hash
 
-# Try importing OpenAI
+# The vision backend needs the OpenAI package
 try:
-    from openai import OpenAI
-except ImportError:
+    from vision_backend import VisionBackend, VisionError, batch_request_line, read_batch_results, cache_variant
+except ModuleNotFoundError as e:
+    if e.name != "openai":
+        raise
     print("OpenAI package not found. Please install it with: pip install openai")
     print("Then run this script again.")
     sys.exit(1)
+from vision_payload import DEFAULT_MAX_TILES
 
-def encode_image(image_path):
-    """
-    Encode an image to base64 for API submission
-    """
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-def get_tags_with_gpt_vision(image_path, api_key):
-    """
-    Get tags and description for an image using GPT-4 Vision API
-    """
-    # Initialize OpenAI client
-    client = OpenAI(api_key=api_key)
-    
-    # Encode image
-    base64_image = encode_image(image_path)
-    
-    # Prompt for the API
-    prompt = """
+# Prompt and model for the API
+TAGGING_PROMPT = """
     This image is part of a surreal black and white collage art collection for an interactive oracle/fortune-telling web experience.
     
     Please provide:
@@ -62,121 +62,182 @@ def get_tags_with_gpt_vision(image_path, api_key):
     DESCRIPTION: [your description here]
     TAGS: [tag1], [tag2], [tag3], [tag4], [tag5], [tag6]
     """
+# Tried in order; models the API rejects are skipped for an hour
+TAGGING_MODELS = ["gpt-4-vision-preview", "gpt-4o"]
+# Model named in Batch API job files
+BATCH_MODEL = "gpt-4o"
+
+def get_tags_with_gpt_vision(image_path, api_key, backend=None):
+    """
+    Get tags and description for an image using GPT-4 Vision API
+    
+    Pass a shared VisionBackend when calling from several threads: it holds the
+    pooled client, rate limiter, tagging cache and model health.
+    """
+    if backend is None:
+        backend = VisionBackend(api_key, models=TAGGING_MODELS, cache=open_default_cache())
     
     try:
-        # Call the OpenAI API using the new format
-        response = client.chat.completions.create(
-            model="gpt-4-vision-preview",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                                "detail": "high"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=300
-        )
-        
-        # Parse the response using the new format
-        result = response.choices[0].message.content
-        
-        # Extract description and tags
-        description = ""
-        tags = []
-        
-        # Parse the description
-        desc_start = result.find("DESCRIPTION:") + len("DESCRIPTION:")
-        tags_start = result.find("TAGS:")
-        if desc_start >= 0 and tags_start >= 0:
-            description = result[desc_start:tags_start].strip()
-            
-            # Parse tags
-            tags_text = result[tags_start + len("TAGS:"):].strip()
-            tags = [tag.strip() for tag in tags_text.split(',')]
-        
-        return {
-            "description": description,
-            "tags": tags
-        }
+        model, result = backend.tag(image_path, TAGGING_PROMPT)
+        return result
     
-    except Exception as e:
+    except VisionError as e:
         print(f"Error calling OpenAI API: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            print(f"Response status: {e.response.status_code}")
-            print(f"Response body: {e.response.text}")
+        cause = e.__cause__
+        if getattr(cause, 'response', None) is not None:
+            print(f"Response status: {cause.response.status_code}")
+            print(f"Response body: {cause.response.text}")
         return {
             "description": "",
             "tags": []
         }
 
-def process_metadata(metadata_path, processed_dir, api_key, delay=1):
+def get_tags_for_images(image_paths, api_key, backend=None):
+    """
+    Get tags and descriptions for several images with a single multi-image request
+    
+    The images are sent at low detail; the reply keeps the DESCRIPTION/TAGS
+    format per image. Returns a list of results aligned with image_paths.
+    """
+    if backend is None:
+        backend = VisionBackend(api_key, models=TAGGING_MODELS, cache=open_default_cache())
+    
+    try:
+        return [result for model, result in backend.tag_many(image_paths, TAGGING_PROMPT, detail="low")]
+    
+    except VisionError as e:
+        print(f"Error calling OpenAI API: {e}")
+        return [{"description": "", "tags": []} for _ in image_paths]
+
+def journal_path_for(metadata_path):
+    """Path of the append-only results journal for a metadata file"""
+    return f"{metadata_path}.journal.jsonl"
+
+def read_journal(journal_path):
+    """Read results from a journal, ignoring a partially written last line"""
+    results = {}
+    if not os.path.exists(journal_path):
+        return results
+    with open(journal_path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            results[record["id"]] = record
+    return results
+
+def apply_journal(store, results):
+    """Fold journaled results into the metadata store"""
+    with store.batch():
+        for record in results.values():
+            fields = {}
+            if record.get("description"):
+                fields["description"] = record["description"]
+            if record.get("tags"):
+                fields["tags"] = record["tags"]
+            if fields:
+                store.update(record["id"], **fields)
+
+def find_untagged(metadata, processed_dir):
+    """Return (id, image path) for entries still missing tags or a description"""
+    pending = []
+    for image_data in metadata:
+        # Check if this image already has tags
+        if image_data.get("tags") and len(image_data["tags"]) > 0 and image_data.get("description"):
+            print(f"Skipping {image_data['id']} - already has tags and description")
+            continue
+        
+        # Get the image filename from the src path
+        image_filename = os.path.basename(image_data["src"])
+        image_path = os.path.join(processed_dir, image_filename)
+        
+        if not os.path.exists(image_path):
+            print(f"Warning: Image file not found: {image_path}")
+            continue
+        
+        pending.append((image_data["id"], image_path))
+    return pending
+
+def write_data_js(store, metadata_path):
+    """Write the JavaScript copy of the metadata next to metadata.json"""
+    js_data = f"const imageCollection = {json.dumps(store.all(), indent=2)};"
+    js_path = os.path.join(os.path.dirname(metadata_path), "data.js")
+    with open(js_path, 'w') as f:
+        f.write(js_data)
+    return js_path
+
+def process_metadata(metadata_path, processed_dir, api_key, delay=1, concurrency=4, base_url=None, use_cache=True,
+                     images_per_request=1, max_tiles=DEFAULT_MAX_TILES):
     """Process the metadata file and update with tags and descriptions"""
     try:
         # Load the metadata
-        with open(metadata_path, 'r') as f:
-            metadata = json.load(f)
+        store = MetadataStore(metadata_path)
+        journal_path = journal_path_for(metadata_path)
+        
+        # Resume: results journaled by an interrupted run count as done
+        journaled = read_journal(journal_path)
+        if journaled:
+            print(f"Resuming: {len(journaled)} results found in {journal_path}")
+            apply_journal(store, journaled)
+        
+        metadata = store.all()
         
-        # Track changes
+        # Collect the images that still need tags
+        pending = find_untagged(metadata, processed_dir)
+        
+        # Pack several images into each request when asked (fewer, larger requests)
+        images_per_request = max(1, images_per_request)
+        groups = [pending[i:i + images_per_request] for i in range(0, len(pending), images_per_request)]
+        print(f"Tagging {len(pending)} images in {len(groups)} requests with {concurrency} concurrent requests")
+        
+        # One backend (connection pool, rate limiter, cache, model health) shared by all workers.
+        # --delay sets the starting request rate until rate-limit headers arrive.
+        limiter = TokenBucket(rate=1.0 / delay if delay > 0 else float(concurrency), capacity=concurrency)
+        cache = open_default_cache() if use_cache else None
+        backend = VisionBackend(api_key, models=TAGGING_MODELS, base_url=base_url, cache=cache, limiter=limiter,
+                                max_tiles=max_tiles)
+        journal_lock = threading.Lock()
         updated_count = 0
+        start_time = time.time()
         
-        # Process each image entry
-        for i, image_data in enumerate(metadata):
-            # Check if this image already has tags
-            if image_data.get("tags") and len(image_data["tags"]) > 0 and image_data.get("description"):
-                print(f"Skipping {image_data['id']} - already has tags and description")
-                continue
+        with open(journal_path, 'a') as journal, ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {}
+            for group in groups:
+                if len(group) == 1:
+                    future = executor.submit(lambda path: [get_tags_with_gpt_vision(path, api_key, backend)], group[0][1])
+                else:
+                    future = executor.submit(get_tags_for_images, [path for _, path in group], api_key, backend)
+                futures[future] = [image_id for image_id, _ in group]
             
-            # Get the image filename from the src path
-            image_filename = os.path.basename(image_data["src"])
-            image_path = os.path.join(processed_dir, image_filename)
-            
-            if not os.path.exists(image_path):
-                print(f"Warning: Image file not found: {image_path}")
-                continue
-            
-            print(f"Processing [{i+1}/{len(metadata)}]: {image_filename}")
-            
-            # Get tags and description from GPT Vision
-            result = get_tags_with_gpt_vision(image_path, api_key)
-            
-            # Update metadata
-            if result["description"]:
-                image_data["description"] = result["description"]
-            
-            if result["tags"]:
-                image_data["tags"] = result["tags"]
-                
-            updated_count += 1
-            
-            # Save updates after each image (in case of interruption)
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
-                
-            # Add delay to avoid rate limiting
-            if i < len(metadata) - 1:  # Don't delay after the last image
-                sleep_time = delay + random.uniform(0, 1)  # Add some randomness
-                print(f"Waiting {sleep_time:.1f} seconds before next image...")
-                time.sleep(sleep_time)
+            done = 0
+            for future in as_completed(futures):
+                for image_id, result in zip(futures[future], future.result()):
+                    done += 1
+                    if not result["description"] and not result["tags"]:
+                        print(f"[{done}/{len(pending)}] {image_id}: no result (will retry on next run)")
+                        continue
+                    
+                    # Checkpoint: append the result to the journal (not the whole file)
+                    with journal_lock:
+                        journal.write(json.dumps({"id": image_id, **result}) + "\n")
+                        journal.flush()
+                    journaled[image_id] = {"id": image_id, **result}
+                    updated_count += 1
+                    print(f"[{done}/{len(pending)}] {image_id}: {', '.join(result['tags'])}")
         
-        # Final save
-        with open(metadata_path, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        # Fold the journal into the metadata and export once
+        apply_journal(store, journaled)
+        os.remove(journal_path)
+        elapsed = time.time() - start_time
             
         # Also update the JavaScript file
-        js_data = f"const imageCollection = {json.dumps(metadata, indent=2)};"
-        js_path = os.path.join(os.path.dirname(metadata_path), "data.js")
-        with open(js_path, 'w') as f:
-            f.write(js_data)
+        js_path = write_data_js(store, metadata_path)
         
-        print(f"\nUpdated {updated_count} images with tags and descriptions")
+        print(f"\nUpdated {updated_count} images with tags and descriptions in {elapsed:.1f}s")
+        if cache is not None:
+            stats = cache.stats()
+            print(f"Tag cache: {stats['hits']} hits, {stats['misses']} misses ({stats['entries']} entries in {cache.db_path})")
         print(f"Updated metadata saved to: {metadata_path}")
         print(f"Updated JavaScript saved to: {js_path}")
         
@@ -184,13 +245,62 @@ def process_metadata(metadata_path, processed_dir, api_key, delay=1):
         print(f"Error processing metadata: {e}")
         sys.exit(1)
 
+def export_batch_file(metadata_path, processed_dir, output_path, model=BATCH_MODEL):
+    """Write an OpenAI Batch API input file with one request per untagged image"""
+    store = MetadataStore(metadata_path)
+    pending = find_untagged(store.all(), processed_dir)
+    with open(output_path, 'w') as f:
+        for image_id, image_path in pending:
+            f.write(json.dumps(batch_request_line(image_id, model, TAGGING_PROMPT, image_path)) + "\n")
+    print(f"Wrote {len(pending)} batch requests to {output_path}")
+    print("Submit it with the OpenAI Batch API, then load the output file with --batch-ingest")
+
+def ingest_batch_results(metadata_path, processed_dir, results_path, model=BATCH_MODEL, use_cache=True):
+    """Apply an OpenAI Batch API output file to the metadata (and the tagging cache)"""
+    store = MetadataStore(metadata_path)
+    cache = open_default_cache() if use_cache else None
+    results = read_batch_results(results_path)
+    
+    journaled = {}
+    for image_id, (description, tags) in results.items():
+        entry = store.get(image_id)
+        if entry is None:
+            print(f"Warning: No metadata entry for batch result {image_id}")
+            continue
+        if not description and not tags:
+            print(f"Warning: Could not parse batch result for {image_id}")
+            continue
+        journaled[image_id] = {"id": image_id, "description": description, "tags": tags}
+        
+        image_path = os.path.join(processed_dir, os.path.basename(entry["src"]))
+        if cache is not None and os.path.exists(image_path):
+            # Batch requests send each image at the default detail and tile budget
+            cache.put(file_content_hash(image_path), TAGGING_PROMPT, model, description, tags, cache_variant("auto"))
+    
+    apply_journal(store, journaled)
+    js_path = write_data_js(store, metadata_path)
+    print(f"Updated {len(journaled)} images from {results_path}")
+    print(f"Updated metadata saved to: {metadata_path}")
+    print(f"Updated JavaScript saved to: {js_path}")
+
 def main():
     """Main entry point for the script"""
     parser = argparse.ArgumentParser(description="Tag images using GPT Vision API")
     parser.add_argument("--input", "-i", required=True, help="Directory containing processed images")
     parser.add_argument("--metadata", "-m", required=True, help="Path to the image_metadata.json file")
-    parser.add_argument("--api-key", "-k", required=True, help="OpenAI API key")
-    parser.add_argument("--delay", "-d", type=float, default=1.0, help="Delay between API calls in seconds (default: 1.0)")
+    parser.add_argument("--api-key", "-k", help="OpenAI API key (not needed for --batch-export/--batch-ingest)")
+    parser.add_argument("--delay", "-d", type=float, default=1.0,
+                        help="Seconds between API calls until rate-limit headers set the pace (default: 1.0)")
+    parser.add_argument("--concurrency", "-c", type=int, default=4, help="Number of concurrent requests (default: 4)")
+    parser.add_argument("--base-url", help="Alternative API base URL, e.g. a local stub server")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the API, ignoring the tagging cache")
+    parser.add_argument("--images-per-request", "-n", type=int, default=1,
+                        help="Pack this many low-detail images into each request (default: 1, detail chosen from image size)")
+    parser.add_argument("--max-tiles", type=int, default=DEFAULT_MAX_TILES,
+                        help=f"Downsize high-detail images to at most this many 512px tiles (default: {DEFAULT_MAX_TILES})")
+    parser.add_argument("--batch-export", metavar="JSONL", help="Write an OpenAI Batch API job file instead of calling the API")
+    parser.add_argument("--batch-ingest", metavar="JSONL", help="Apply an OpenAI Batch API output file to the metadata")
+    parser.add_argument("--batch-model", default=BATCH_MODEL, help=f"Model for batch job files (default: {BATCH_MODEL})")
     
     args = parser.parse_args()
     
@@ -204,8 +314,20 @@ def main():
         print(f"Error: Metadata file '{args.metadata}' does not exist.")
         sys.exit(1)
     
+    if args.batch_export:
+        export_batch_file(args.metadata, args.input, args.batch_export, args.batch_model)
+        return
+    if args.batch_ingest:
+        ingest_batch_results(args.metadata, args.input, args.batch_ingest, args.batch_model, not args.no_cache)
+        return
+    
+    if not args.api_key:
+        print("Error: --api-key is required to call the API.")
+        sys.exit(1)
+    
     # Process metadata and update with tags
-    process_metadata(args.metadata, args.input, args.api_key, args.delay)
+    process_metadata(args.metadata, args.input, args.api_key, args.delay, args.concurrency, args.base_url,
+                     not args.no_cache, args.images_per_request, args.max_tiles)
 
 if __name__ == "__main__":
     main()
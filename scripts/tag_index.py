@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+In-Memory Tag Index for Assemblage
+
+Backs the /api/images and /api/sample endpoints: entries are held in memory
+in store order with an inverted index (posting lists) from stemmed tag to
+entry positions, so a tag query is a set intersection rather than a scan of
+metadata.json. Tags are normalized and lightly stemmed word by word, so
+"Textures", "textured" and "texture" are the same term.
+
+sample() draws N random images matching a tag expression such as
+
+    vintage & (portrait | face) & !color
+
+(& or , for AND, | for OR, ! for NOT, parentheses to group), optionally
+weighted towards images that match more of the expression's terms. Posting
+lists are kept sorted by position, so a draw picks random indices into them
+and rejects what doesn't qualify; the same seed gives the same draw for the
+same index. Drawing n images from the whole collection or for a single tag
+costs O(n + excluded ids). A compound expression costs a pass over the
+smallest posting list of an AND (the sum of them for an OR), and one whose
+matches can only be found through a NOT, such as "!color", a pass over the
+whole collection.
+
+The index follows the store's change log: every query first checks the
+store version and applies just the entries changed since (a full reload
+only after a re-import or clear), which also picks up writes from other
+processes.
+
+Pagination uses opaque cursors (the position of the last entry returned), so
+pages stay consistent while images are added or removed between requests.
+
+Usage:
+    from tag_index import TagIndex
+
+    index = TagIndex(metadata_store)
+    page = index.query(tags=["vintage", "portrait"], fields=["id", "src", "tags"], limit=50)
+    index.query(tags=["vintage"], cursor=page["next_cursor"])
+    index.sample("vintage & !color", n=12, weight="relevance")
+"""
+
+import re
+import heapq
+import bisect
+import random
+import threading
+from itertools import islice
+
+from metadata_store import ADD, REMOVE, normalize_tag
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+DEFAULT_SAMPLE_SIZE = 10
+MAX_SAMPLE_SIZE = 200
+SAMPLE_WEIGHTS = ("uniform", "relevance")
+
+# Longest first; each applies only if at least MIN_STEM letters remain
+_SUFFIXES = (("sses", "ss"), ("ies", "y"), ("ing", ""), ("ed", ""), ("es", ""), ("s", ""), ("e", ""))
+MIN_STEM = 3
+
+_EXPRESSION_TOKEN = re.compile(r"\s*([()|&,!])\s*")
+
+
+def stem_word(word):
+    """Light suffix stripping: "textures", "textured" and "texture" all become "textur"."""
+    if len(word) <= MIN_STEM or not word.isalpha():
+        return word
+    for suffix, replacement in _SUFFIXES:
+        if word.endswith(suffix) and not (suffix == "s" and word.endswith("ss")):
+            stem = word[:len(word) - len(suffix)] + replacement
+            if len(stem) >= MIN_STEM:
+                # "running" -> "runn" -> "run"
+                if suffix in ("ing", "ed") and len(stem) > MIN_STEM and stem[-1] == stem[-2] and stem[-1] not in "lsz":
+                    stem = stem[:-1]
+                return stem
+    return word
+
+
+def stem_tag(tag):
+    """Normalize a tag and stem each of its words."""
+    return " ".join(stem_word(word) for word in normalize_tag(tag).split())
+
+
+class ExpressionError(ValueError):
+    """Raised for a malformed tag expression."""
+
+
+def parse_expression(expression):
+    """Parse a tag expression into a tree of ("or"|"and", [children]), ("not", child) and ("term", stem)."""
+    tokens = [token.strip() for token in _EXPRESSION_TOKEN.split(expression) if token.strip()]
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        children = [parse_and()]
+        while peek() == "|":
+            take()
+            children.append(parse_and())
+        return children[0] if len(children) == 1 else ("or", children)
+
+    def parse_and():
+        children = [parse_unary()]
+        while peek() in ("&", ","):
+            take()
+            children.append(parse_unary())
+        return children[0] if len(children) == 1 else ("and", children)
+
+    def parse_unary():
+        token = peek()
+        if token is None:
+            raise ExpressionError("Tag expression ends unexpectedly")
+        if token == "!":
+            take()
+            return ("not", parse_unary())
+        if token == "(":
+            take()
+            node = parse_or()
+            if peek() != ")":
+                raise ExpressionError("Missing ) in tag expression")
+            take()
+            return node
+        if token in ")|&,":
+            raise ExpressionError(f"Unexpected '{token}' in tag expression")
+        return ("term", stem_tag(take()))
+
+    if not tokens:
+        raise ExpressionError("Empty tag expression")
+    tree = parse_or()
+    if position != len(tokens):
+        raise ExpressionError(f"Unexpected '{tokens[position]}' in tag expression")
+    return tree
+
+
+def positive_terms(tree):
+    """Terms of an expression that are not negated."""
+    kind, value = tree
+    if kind == "term":
+        return {value}
+    if kind == "not":
+        return set()
+    return set().union(*(positive_terms(child) for child in value))
+
+
+class CursorError(ValueError):
+    """Raised for a malformed cursor, or one from before the index was rebuilt."""
+
+
+class PositionList:
+    """Entry positions kept both sorted (for random access in a stable order) and as a set."""
+
+    def __init__(self):
+        self.order = []
+        self.members = set()
+
+    def add(self, position):
+        if position in self.members:
+            return
+        self.members.add(position)
+        if not self.order or position > self.order[-1]:
+            self.order.append(position)
+        else:
+            bisect.insort(self.order, position)
+
+    def discard(self, position):
+        if position in self.members:
+            self.members.discard(position)
+            del self.order[bisect.bisect_left(self.order, position)]
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, position):
+        return position in self.members
+
+
+def _terms(entry):
+    return {stem_tag(tag) for tag in entry.get("tags") or [] if str(tag).strip()}
+
+
+class TagIndex:
+    """Entries in store order with a stemmed tag -> positions inverted index."""
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self._version = None
+        self._generation = 0
+        self.full_reloads = 0
+        self.incremental_updates = 0
+
+    def _reload(self):
+        """Rebuild from every entry in the store. Caller holds the lock."""
+        version = self.store.version()
+        self._entries = {}      # position -> entry, in position order
+        self._all = PositionList()
+        self._positions = {}    # image id -> position
+        self._tags = {}         # stemmed tag -> PositionList (posting list)
+        self._next_position = 0
+        for entry in self.store.all():
+            self._put(entry)
+        self._version = version
+        self._generation += 1
+        self.full_reloads += 1
+
+    def _put(self, entry):
+        """Add or replace an entry, keeping the position of an existing one. Caller holds the lock."""
+        position = self._positions.get(entry["id"])
+        if position is None:
+            position = self._next_position
+            self._next_position += 1
+            self._positions[entry["id"]] = position
+        else:
+            self._unindex(position)
+        self._entries[position] = entry
+        self._all.add(position)
+        for term in _terms(entry):
+            self._tags.setdefault(term, PositionList()).add(position)
+
+    def _remove(self, image_id):
+        position = self._positions.pop(image_id, None)
+        if position is not None:
+            self._unindex(position)
+            del self._entries[position]
+            self._all.discard(position)
+
+    def _unindex(self, position):
+        for term in _terms(self._entries[position]):
+            positions = self._tags.get(term)
+            if positions is not None:
+                positions.discard(position)
+                if not positions:
+                    del self._tags[term]
+
+    def refresh(self):
+        """Bring the index up to date with the store (incrementally where possible)."""
+        with self._lock:
+            if self._version is None:
+                self._reload()
+                return
+            if self.store.version() == self._version:
+                return
+            delta = self.store.changes_since(self._version)
+            if delta["reset"]:
+                self._reload()
+                return
+            for change in delta["changes"]:
+                if change["op"] == REMOVE:
+                    self._remove(change["id"])
+                elif change["op"] == ADD and change["entry"]["id"] in self._positions:
+                    # Removed and added again since the last refresh: it goes to the end
+                    self._remove(change["entry"]["id"])
+                    self._put(change["entry"])
+                else:
+                    self._put(change["entry"])
+            self._version = delta["version"]
+            self.incremental_updates += 1
+
+    def _encode_cursor(self, position):
+        return f"{self._generation}-{position}"
+
+    def _decode_cursor(self, cursor):
+        try:
+            generation, position = (int(part) for part in cursor.split("-"))
+        except ValueError:
+            raise CursorError("Malformed cursor")
+        if generation != self._generation:
+            raise CursorError("Cursor has expired; start again without one")
+        return position
+
+    def query(self, tags=None, match="all", fields=None, limit=DEFAULT_LIMIT, cursor=None):
+        """One page of entries, in store order.
+
+        tags: entries must carry all of them (match="all") or any (match="any").
+        fields: keys to include in each entry (all keys if None).
+        Returns {"images", "total", "next_cursor", "version"}; next_cursor is
+        None on the last page. Raises ValueError (CursorError) for bad input.
+        """
+        if match not in ("all", "any"):
+            raise ValueError("match must be 'all' or 'any'")
+        limit = min(max(1, int(limit)), MAX_LIMIT)
+        self.refresh()
+
+        with self._lock:
+            after = self._decode_cursor(cursor) if cursor else -1
+            if tags:
+                sets = [self._tags[term].members if term in self._tags else set()
+                        for term in (stem_tag(tag) for tag in tags)]
+                matches = set.intersection(*sets) if match == "all" else set.union(*sets)
+                positions = sorted(position for position in matches if position > after)
+                total = len(matches)
+            else:
+                # Entries are kept in position order, so the page can stop early
+                positions = list(islice((position for position in self._entries if position > after), limit + 1))
+                total = len(self._entries)
+
+            page = positions[:limit]
+            entries = [self._entries[position] for position in page]
+            if fields:
+                entries = [{name: entry[name] for name in fields if name in entry} for entry in entries]
+            return {
+                "images": entries,
+                "total": total,
+                "next_cursor": self._encode_cursor(page[-1]) if len(positions) > limit else None,
+                "version": self._version,
+            }
+
+    def _matches(self, tree, position):
+        """Whether the entry at position matches a parsed expression. Caller holds the lock."""
+        kind, value = tree
+        if kind == "term":
+            return value in self._tags and position in self._tags[value]
+        if kind == "not":
+            return not self._matches(value, position)
+        if kind == "or":
+            return any(self._matches(child, position) for child in value)
+        return all(self._matches(child, position) for child in value)
+
+    def _population(self, tree):
+        """Posting lists whose union holds every match of an expression (the fewest positions found). Caller holds the lock."""
+        kind, value = tree
+        if kind == "term":
+            return [self._tags[value]] if value in self._tags else []
+        if kind == "not":
+            return [self._all]
+        children = [self._population(child) for child in value]
+        if kind == "and":
+            return min(children, key=lambda lists: sum(len(positions) for positions in lists))
+        lists = []
+        for child in children:
+            if self._all in child:
+                return [self._all]
+            lists.extend(positions for positions in child if all(positions is not kept for kept in lists))
+        return lists
+
+    def _draw(self, rng, positions, n, accept):
+        """Up to n distinct random picks from a sorted list that pass accept, by rejection.
+
+        Only called when at least half the list is acceptable and n is at most
+        half of that, so the expected number of tries is O(n).
+        """
+        picked, seen = [], set()
+        while len(picked) < n:
+            position = positions[rng.randrange(len(positions))]
+            if position not in seen:
+                seen.add(position)
+                if accept(position):
+                    picked.append(position)
+        return picked
+
+    def _weighted_draw(self, rng, candidates, n, weight_of, max_weight):
+        """Up to n distinct picks, each drawn with probability proportional to its weight.
+
+        Successive sampling by rejection (same distribution as taking the top n
+        of u^(1/w)), so weights are computed only for the candidates drawn.
+        """
+        if n * 2 >= len(candidates):
+            # Most of them are taken anyway: key every candidate (Efraimidis-Spirakis)
+            return heapq.nlargest(n, candidates, key=lambda position: rng.random() ** (1 / weight_of(position)))
+        picked, seen = [], set()
+        while len(picked) < n:
+            position = candidates[rng.randrange(len(candidates))]
+            if position not in seen and rng.random() * max_weight < weight_of(position):
+                seen.add(position)
+                picked.append(position)
+        return picked
+
+    def sample(self, expression=None, n=DEFAULT_SAMPLE_SIZE, weight="uniform", fields=None, seed=None, exclude=()):
+        """Up to n random entries matching a tag expression (any entry if None).
+
+        weight="relevance" favours entries carrying more of the expression's
+        (non-negated) terms: weight 1 + number of terms matched. Images in
+        exclude (ids) are never drawn. Returns {"images", "matched", "version"};
+        raises ValueError (ExpressionError) for bad input.
+        """
+        if weight not in SAMPLE_WEIGHTS:
+            raise ValueError(f"weight must be one of: {', '.join(SAMPLE_WEIGHTS)}")
+        n = min(max(1, int(n)), MAX_SAMPLE_SIZE)
+        tree = parse_expression(expression) if expression else None
+        rng = random.Random(seed)
+        self.refresh()
+
+        with self._lock:
+            excluded = {self._positions[image_id] for image_id in exclude if image_id in self._positions}
+            population = self._population(tree) if tree else [self._all]
+
+            if tree is None or tree[0] == "term":
+                # Everything in the one list matches (and all with the same relevance)
+                positions = population[0].order if population else []
+                matched = len(positions) - sum(position in population[0] for position in excluded) if population else 0
+                if n * 2 < matched and matched * 2 >= len(positions):
+                    picked = self._draw(rng, positions, n, lambda position: position not in excluded)
+                else:
+                    candidates = [position for position in positions if position not in excluded]
+                    picked = rng.sample(candidates, min(n, matched))
+            else:
+                # One pass over the population; lists are merged in position order so seeded draws repeat
+                merged = list(heapq.merge(*(lists.order for lists in population)))
+                candidates = [position for index, position in enumerate(merged)
+                              if (index == 0 or position != merged[index - 1])
+                              and position not in excluded and self._matches(tree, position)]
+                matched = len(candidates)
+                if weight == "relevance":
+                    postings = [self._tags[term] for term in positive_terms(tree) if term in self._tags]
+                    picked = self._weighted_draw(
+                        rng, candidates, min(n, matched),
+                        lambda position: 1 + sum(position in posting for posting in postings), 1 + len(postings))
+                else:
+                    picked = rng.sample(candidates, min(n, matched))
+
+            entries = [self._entries[position] for position in picked]
+            if fields:
+                entries = [{name: entry[name] for name in fields if name in entry} for entry in entries]
+            return {"images": entries, "matched": matched, "version": self._version}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries) if self._version is not None else 0,
+                "tags": len(self._tags) if self._version is not None else 0,
+                "version": self._version,
+                "full_reloads": self.full_reloads,
+                "incremental_updates": self.incremental_updates,
+            }
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+On-Demand Image Variants for Assemblage
+
+Renders resized / re-encoded variants of collection images on first request
+and keeps them in a size-bounded on-disk LRU cache. Backs the width, format
+and quality parameters of /images/collages/<id>:
+
+    /images/collages/img1234abcd.jpg?w=300&format=webp&q=70
+
+- Variants are keyed by the source file (name, mtime, size) and the render
+  parameters, so replacing an image never serves a stale variant.
+- Concurrent requests for the same variant are coalesced: one thread renders,
+  the others wait for its result.
+- Least recently used variants are evicted once the cache exceeds max_bytes;
+  recency survives restarts (file mtimes are touched on every hit).
+- stats() reports hits, misses, coalesced requests, evictions and render
+  latency.
+
+Usage:
+    from variant_cache import VariantCache
+
+    cache = VariantCache("/path/to/cache", max_bytes=512 * 1024 * 1024)
+    path, mimetype = cache.get("/path/to/image.jpg", width=300, fmt="webp", quality=70)
+"""
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict, deque
+
+from PIL import Image
+
+from image_io import reduce_for, fit_size
+from derivatives import FORMATS, available_formats
+
+FORMAT_ALIASES = {'jpeg': 'jpg'}
+MIMETYPES = {'jpg': 'image/jpeg', 'webp': 'image/webp', 'avif': 'image/avif'}
+
+MAX_WIDTH = 2048
+MIN_QUALITY = 1
+MAX_QUALITY = 95
+LATENCY_SAMPLES = 256
+
+
+def normalize_params(width=None, fmt=None, quality=None):
+    """Validate and normalize variant parameters. Raises ValueError on bad input."""
+    if width is not None:
+        width = int(width)
+        if not 1 <= width <= MAX_WIDTH:
+            raise ValueError(f"width must be between 1 and {MAX_WIDTH}")
+    fmt = (fmt or 'jpg').lower()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    if fmt not in available_formats():
+        raise ValueError(f"format must be one of: {', '.join(available_formats())}")
+    if quality is not None:
+        quality = int(quality)
+        if not MIN_QUALITY <= quality <= MAX_QUALITY:
+            raise ValueError(f"quality must be between {MIN_QUALITY} and {MAX_QUALITY}")
+    return width, fmt, quality
+
+
+class VariantCache:
+    """Size-bounded on-disk LRU cache of rendered image variants."""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # filename -> size, least recently used first
+        self._inflight = {}            # filename -> Event, for renders in progress
+        self._total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.render_errors = 0
+        self._render_times = deque(maxlen=LATENCY_SAMPLES)
+        self._render_count = 0
+        self._render_seconds = 0.0
+
+        self._load()
+
+    def _load(self):
+        """Index variants already on disk, oldest use first."""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+            st = os.stat(path)
+            files.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total_bytes += size
+        self._evict()
+
+    def variant_name(self, source_path, width, fmt, quality):
+        st = os.stat(source_path)
+        key = f"{os.path.basename(source_path)}:{st.st_mtime_ns}:{st.st_size}:{width}:{fmt}:{quality}"
+        return f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.{fmt}"
+
+    def get(self, source_path, width=None, fmt='jpg', quality=None):
+        """Return (path, mimetype) of the variant, rendering it if needed."""
+        width, fmt, quality = normalize_params(width, fmt, quality)
+        name = self.variant_name(source_path, width, fmt, quality)
+        path = os.path.join(self.cache_dir, name)
+
+        while True:
+            with self._lock:
+                if name in self._entries:
+                    self._entries.move_to_end(name)
+                    self.hits += 1
+                    try:
+                        os.utime(path)
+                    except FileNotFoundError:
+                        pass
+                    return path, MIMETYPES[fmt]
+                event = self._inflight.get(name)
+                leader = event is None
+                if leader:
+                    event = self._inflight[name] = threading.Event()
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+
+            if not leader:
+                # Another request is rendering this variant; use its result
+                # (or take over if it failed)
+                event.wait()
+                continue
+
+            try:
+                start = time.perf_counter()
+                size = self._render(source_path, path, width, fmt, quality)
+                seconds = time.perf_counter() - start
+                with self._lock:
+                    self._entries[name] = size
+                    self._total_bytes += size
+                    self._render_count += 1
+                    self._render_seconds += seconds
+                    self._render_times.append(seconds)
+                    self._evict()
+                return path, MIMETYPES[fmt]
+            except Exception:
+                with self._lock:
+                    self.render_errors += 1
+                raise
+            finally:
+                with self._lock:
+                    del self._inflight[name]
+                event.set()
+
+    def _render(self, source_path, path, width, fmt, quality):
+        """Render one variant to path. Returns its size in bytes."""
+        with Image.open(source_path) as img:
+            target = img.size
+            if width and width < img.size[0]:
+                target = fit_size(img.size, (width, img.size[1]))
+            reduce_for(img, target)
+            out = img.convert('RGB') if img.mode not in ('RGB', 'L') else img
+            if out.size != target:
+                out = out.resize(target, Image.Resampling.LANCZOS)
+
+            pil_format, options = FORMATS[fmt]
+            options = dict(options)
+            if quality is not None:
+                options['quality'] = quality
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            out.save(tmp_path, format=pil_format, **options)
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    def _evict(self):
+        """Drop least recently used variants until under max_bytes. Caller holds the lock."""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """Cache effectiveness and render latency."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            times = sorted(self._render_times)
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'render_errors': self.render_errors,
+                'renders': self._render_count,
+                'render_ms_avg': self._render_seconds / self._render_count * 1000 if self._render_count else 0.0,
+                'render_ms_p50': times[len(times) // 2] * 1000 if times else 0.0,
+                'render_ms_p95': times[int(len(times) * 0.95)] * 1000 if times else 0.0,
+                'render_ms_max': times[-1] * 1000 if times else 0.0,
+            }
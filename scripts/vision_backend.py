@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Vision Tagging Backend for Assemblage
+
+One shared backend for every script that asks a vision model for a
+description and tags:
+
+- A single OpenAI client per backend, so requests reuse its pooled keep-alive
+  connections instead of opening a new connection (and TLS handshake) per image.
+- Model fallback with remembered health: the model that last succeeded is
+  tried first, and a model the API rejects (not found / not available) is
+  skipped for `bad_model_ttl` seconds instead of costing a failed round-trip
+  on every image.
+- Right-sized payloads: images are downsized to the model's tile budget and
+  the detail level picked from their size (vision_payload.py); the prepared
+  bytes are kept for retries and model fallbacks.
+- Optional tagging cache and rate limiter (see tag_cache.py, rate_limiter.py).
+- One parser for the "DESCRIPTION: ... TAGS: ..." reply format, also used per
+  image when several images are packed into one request (tag_many) and for
+  OpenAI Batch API result files.
+
+Usage:
+    from vision_backend import VisionBackend
+
+    backend = VisionBackend(api_key, models=["gpt-4-vision", "gpt-4o"])
+    model, result = backend.tag("/path/to/image.jpg", prompt)   # result: {'description': ..., 'tags': [...]}
+    backend.tag_many(paths, prompt)                               # several low-detail images in one request
+"""
+
+import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+
+from openai import OpenAI
+
+from rate_limiter import call_with_backoff
+from tag_cache import file_content_hash
+from vision_payload import DEFAULT_MAX_TILES, prepare_payload
+
+DEFAULT_MODELS = ("gpt-4-vision", "gpt-4o", "gpt-4o-vision")
+DEFAULT_BAD_MODEL_TTL = 3600  # Seconds before a rejected model is probed again
+DEFAULT_TIMEOUT = 60.0
+PAYLOAD_CACHE_SIZE = 64  # Prepared images kept in memory for retries and fallbacks
+
+# Wraps the per-image prompt when several images share one request
+MULTI_IMAGE_PROMPT = """You will be given {count} images, each preceded by a label "IMAGE n:".
+Follow the instructions below for each image separately. Answer every image in order,
+starting each answer with its label on its own line (IMAGE 1:, IMAGE 2:, ...).
+
+{prompt}"""
+
+_IMAGE_HEADER = re.compile(r"^[ \t*#]*IMAGE\s+(\d+)\s*[:.)]?[ \t*]*", re.MULTILINE)
+
+# OpenAI Batch API (JSONL job files)
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+
+class VisionError(Exception):
+    """Raised when no model produced a result for an image."""
+
+
+def text_part(text):
+    return {"type": "text", "text": text}
+
+
+def image_part(base64_image, detail=None):
+    image_url = {"url": f"data:image/jpeg;base64,{base64_image}"}
+    if detail:
+        image_url["detail"] = detail
+    return {"type": "image_url", "image_url": image_url}
+
+
+def parse_response(content):
+    """Split a "DESCRIPTION: ... TAGS: a, b, c" reply into (description, tags)."""
+    if not content or "DESCRIPTION:" not in content or "TAGS:" not in content:
+        return "", []
+    desc_part, tags_part = content.split("DESCRIPTION:", 1)[1].split("TAGS:", 1)
+    tags = [tag.strip().strip("[]").strip() for tag in tags_part.strip().strip("[]").split(",")]
+    return desc_part.strip(), [tag for tag in tags if tag]
+
+
+def parse_multi_response(content):
+    """Split a multi-image reply into {image number: (description, tags)}."""
+    answers = {}
+    parts = _IMAGE_HEADER.split(content or "")
+    # parts: [preamble, number, block, number, block, ...]
+    for number, block in zip(parts[1::2], parts[2::2]):
+        answers.setdefault(int(number), parse_response(block))
+    return answers
+
+
+def cache_variant(detail, max_tiles=DEFAULT_MAX_TILES):
+    """Tag cache variant for an image sent at this detail level and tile budget."""
+    return f"detail={detail};max_tiles={max_tiles}"
+
+
+def batch_request_line(custom_id, model, prompt, image_path, detail="auto", max_tokens=300):
+    """One request line for an OpenAI Batch API input file."""
+    base64_image, detail, _ = prepare_payload(image_path, detail)
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": model,
+            "messages": [{"role": "user", "content": [text_part(prompt), image_part(base64_image, detail)]}],
+            "max_tokens": max_tokens,
+        },
+    }
+
+
+def read_batch_results(path):
+    """Parse an OpenAI Batch API output file into {custom_id: (description, tags)}.
+
+    Failed requests are reported and left out, so they can be resubmitted.
+    """
+    results = {}
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                print(f"Batch request {record.get('custom_id')} failed: {record.get('error') or response.get('status_code')}")
+                continue
+            content = response["body"]["choices"][0]["message"]["content"]
+            results[record["custom_id"]] = parse_response(content)
+    return results
+
+
+def is_model_unavailable(error):
+    """True if the API rejected the model itself (unknown, retired or without access).
+
+    Only the model_not_found error code, or a 404 naming the model parameter,
+    counts: other bad requests often mention the model too, and shouldn't
+    bench a healthy one.
+    """
+    if getattr(error, "code", None) == "model_not_found" or "model_not_found" in str(error):
+        return True
+    return getattr(error, "status_code", None) == 404 and getattr(error, "param", None) == "model"
+
+
+class VisionBackend:
+    """Shared vision-model client with model fallback, health tracking and optional caching."""
+
+    def __init__(self, api_key, models=DEFAULT_MODELS, base_url=None, cache=None, limiter=None,
+                 bad_model_ttl=DEFAULT_BAD_MODEL_TTL, timeout=DEFAULT_TIMEOUT, max_tiles=DEFAULT_MAX_TILES):
+        self.models = list(models)
+        self.max_tiles = max_tiles
+        self.cache = cache
+        self.limiter = limiter
+        self.bad_model_ttl = bad_model_ttl
+        # Retries are handled by call_with_backoff so they share the limiter
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0, timeout=timeout)
+
+        self._lock = threading.Lock()
+        self._preferred = None
+        self._bad_until = {}
+        self._payloads = OrderedDict()
+
+    # -------------------- Model health --------------------
+
+    def candidate_models(self):
+        """Models to try, in order: last good model first, known-bad models skipped."""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [model for model in self.models if self._bad_until.get(model, 0) <= now]
+            if self._preferred in healthy:
+                healthy.remove(self._preferred)
+                healthy.insert(0, self._preferred)
+        # If every model is marked bad, probe them all rather than give up
+        return healthy or list(self.models)
+
+    def mark_bad(self, model):
+        with self._lock:
+            self._bad_until[model] = time.monotonic() + self.bad_model_ttl
+            if self._preferred == model:
+                self._preferred = None
+
+    def mark_good(self, model):
+        with self._lock:
+            self._bad_until.pop(model, None)
+            self._preferred = model
+
+    def health(self):
+        """Current model preference and the seconds left on each known-bad model."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "preferred": self._preferred,
+                "unavailable": {model: round(until - now) for model, until in self._bad_until.items() if until > now},
+            }
+
+    # -------------------- Requests --------------------
+
+    def _create(self, model, content, max_tokens):
+        """One chat completion under the limiter. Returns the reply text."""
+        raw_response = call_with_backoff(lambda: self.client.chat.completions.with_raw_response.create(
+            model=model,
+            messages=[{"role": "user", "content": content}],
+            max_tokens=max_tokens
+        ), self.limiter)
+        return raw_response.parse().choices[0].message.content
+
+    def _create_with_fallback(self, content, max_tokens, label):
+        """Try candidate models in turn. Returns (model, reply text); raises VisionError."""
+        last_error = None
+        for model in self.candidate_models():
+            try:
+                reply = self._create(model, content, max_tokens)
+            except Exception as e:
+                print(f"Error with model {model}: {e}")
+                if is_model_unavailable(e):
+                    self.mark_bad(model)
+                last_error = e
+                continue
+            self.mark_good(model)
+            return model, reply
+        raise VisionError(f"No vision model succeeded for {label}: {last_error}") from last_error
+
+    def complete(self, model, prompt, base64_image, detail="auto", max_tokens=300):
+        """Send one image and prompt to a model. Returns the reply text."""
+        return self._create(model, [text_part(prompt), image_part(base64_image, detail)], max_tokens)
+
+    def _cached(self, content_hash, prompt, detail):
+        if self.cache is None:
+            return None, None
+        return self.cache.get_any(content_hash, prompt, self.models, cache_variant(detail, self.max_tiles))
+
+    def _remember(self, content_hash, prompt, detail, model, description, tags):
+        if self.cache is not None and (description or tags):
+            self.cache.put(content_hash, prompt, model, description, tags, cache_variant(detail, self.max_tiles))
+
+    def payload(self, image_path, detail="auto"):
+        """Right-sized (base64, detail) for an image, reused across retries, fallbacks and calls."""
+        st = os.stat(image_path)
+        key = (image_path, st.st_mtime_ns, st.st_size, detail, self.max_tiles)
+        with self._lock:
+            if key in self._payloads:
+                self._payloads.move_to_end(key)
+                return self._payloads[key]
+        base64_image, chosen_detail, _ = prepare_payload(image_path, detail, self.max_tiles)
+        with self._lock:
+            self._payloads[key] = (base64_image, chosen_detail)
+            while len(self._payloads) > PAYLOAD_CACHE_SIZE:
+                self._payloads.popitem(last=False)
+        return base64_image, chosen_detail
+
+    def tag(self, image_path, prompt, detail="auto", max_tokens=300):
+        """Describe and tag an image file.
+
+        Returns (model, {'description', 'tags'}); the model is the one that
+        answered (or whose cached answer was used). Raises VisionError if every
+        candidate model failed.
+        """
+        content_hash = file_content_hash(image_path) if self.cache is not None else None
+        model, cached = self._cached(content_hash, prompt, detail)
+        if cached is not None:
+            return model, cached
+
+        content = [text_part(prompt), image_part(*self.payload(image_path, detail))]
+        model, reply = self._create_with_fallback(content, max_tokens, image_path)
+        description, tags = parse_response(reply)
+        self._remember(content_hash, prompt, detail, model, description, tags)
+        return model, {"description": description, "tags": tags}
+
+    def tag_many(self, image_paths, prompt, detail="low", max_tokens_per_image=200):
+        """Describe and tag several images with one request.
+
+        The images are sent together (low detail by default) with instructions
+        to answer each one in the usual DESCRIPTION/TAGS format under an
+        "IMAGE n:" header. Cached images are left out of the request, and any
+        image missing from the reply is retried on its own; if that retry
+        fails too, the image gets (None, an empty result) and the rest of the
+        batch is kept. Returns a list of (model, result) aligned with
+        image_paths; raises VisionError if the request fails on every model.
+        """
+        results = [None] * len(image_paths)
+        hashes = [file_content_hash(path) if self.cache is not None else None for path in image_paths]
+        pending = []
+        for position, path in enumerate(image_paths):
+            model, cached = self._cached(hashes[position], prompt, detail)
+            if cached is not None:
+                results[position] = (model, cached)
+            else:
+                pending.append(position)
+
+        if len(pending) == 1:
+            position = pending[0]
+            results[position] = self.tag(image_paths[position], prompt, detail, max_tokens_per_image)
+        elif pending:
+            content = [text_part(MULTI_IMAGE_PROMPT.format(count=len(pending), prompt=prompt.strip()))]
+            for number, position in enumerate(pending, 1):
+                content.append(text_part(f"IMAGE {number}:"))
+                content.append(image_part(*self.payload(image_paths[position], detail)))
+            model, reply = self._create_with_fallback(
+                content, max_tokens_per_image * len(pending), f"{len(pending)} images")
+
+            answers = parse_multi_response(reply)
+            for number, position in enumerate(pending, 1):
+                description, tags = answers.get(number, ("", []))
+                if not description and not tags:
+                    # Not answered in the batch; fall back to a single-image request
+                    try:
+                        results[position] = self.tag(image_paths[position], prompt, detail, max_tokens_per_image)
+                    except VisionError as e:
+                        print(f"Error tagging {image_paths[position]} on its own: {e}")
+                        results[position] = (None, {"description": "", "tags": []})
+                    continue
+                self._remember(hashes[position], prompt, detail, model, description, tags)
+                results[position] = (model, {"description": description, "tags": tags})
+        return results
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Vision API Payloads for Assemblage
+
+Prepares the image bytes sent to the vision model. The API scales every image
+before the model sees it anyway:
+
+- low detail: fit within 512x512, a flat 85 tokens
+- high detail: fit within 2048x2048, then the short side to 768, billed as
+  85 tokens plus 170 per 512px tile
+
+so uploading the stored full-size JPEG only adds upload bytes and latency.
+Here each image is downsized (with a reduced-scale JPEG decode) to the size
+the API would use, further capped to a tile budget, and re-encoded in memory.
+With detail='auto' the level is chosen from the image size: images that
+already fit the low-detail box are sent as low detail.
+
+Usage:
+    from vision_payload import prepare_payload
+
+    base64_image, detail, size = prepare_payload("/path/to/image.jpg", detail="auto")
+"""
+
+import io
+import math
+import base64
+
+from PIL import Image
+
+from image_io import reduce_for, fit_size
+
+LOW_DETAIL_SIZE = 512
+HIGH_DETAIL_MAX_SIZE = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+TILE_SIZE = 512
+BASE_TOKENS = 85
+TILE_TOKENS = 170
+
+DEFAULT_MAX_TILES = 4
+PAYLOAD_QUALITY = 85
+
+
+def tile_count(size):
+    width, height = size
+    return math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def image_tokens(size, detail):
+    """Input tokens the API bills for an image of this (already scaled) size."""
+    if detail == 'low':
+        return BASE_TOKENS
+    return BASE_TOKENS + TILE_TOKENS * tile_count(size)
+
+
+def choose_detail(size):
+    """'low' when the image already fits the low-detail box, else 'high'."""
+    return 'low' if max(size) <= LOW_DETAIL_SIZE else 'high'
+
+
+def _shrink_to(size, box):
+    """Fit size within box, never enlarging."""
+    if size[0] <= box[0] and size[1] <= box[1]:
+        return size
+    return fit_size(size, box)
+
+
+def payload_size(size, detail, max_tiles=DEFAULT_MAX_TILES):
+    """Pixel size to send: what the API would scale to, capped at max_tiles for high detail."""
+    if detail == 'low':
+        return _shrink_to(size, (LOW_DETAIL_SIZE, LOW_DETAIL_SIZE))
+
+    width, height = _shrink_to(size, (HIGH_DETAIL_MAX_SIZE, HIGH_DETAIL_MAX_SIZE))
+    short_side = min(width, height)
+    if short_side > HIGH_DETAIL_SHORT_SIDE:
+        scale = HIGH_DETAIL_SHORT_SIDE / short_side
+        width, height = max(1, int(width * scale)), max(1, int(height * scale))
+
+    # Shrink further until the tile budget is met: best scale over every
+    # cols x rows tile grid that fits the budget
+    if max_tiles and tile_count((width, height)) > max_tiles:
+        scale = max(
+            min(1.0, cols * TILE_SIZE / width, (max_tiles // cols) * TILE_SIZE / height)
+            for cols in range(1, max_tiles + 1)
+        )
+        width, height = max(1, int(width * scale)), max(1, int(height * scale))
+    return width, height
+
+
+def prepare_payload(image_path, detail='auto', max_tiles=DEFAULT_MAX_TILES, quality=PAYLOAD_QUALITY):
+    """Downsize and re-encode an image for a vision request.
+
+    Returns (base64 JPEG, detail, (width, height)). A JPEG that is already at
+    the target size is sent as-is rather than re-encoded.
+    """
+    with Image.open(image_path) as img:
+        if detail in (None, 'auto'):
+            detail = choose_detail(img.size)
+        target = payload_size(img.size, detail, max_tiles)
+
+        if target == img.size and img.format == 'JPEG':
+            with open(image_path, 'rb') as f:
+                return base64.b64encode(f.read()).decode('utf-8'), detail, target
+
+        reduce_for(img, target)
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        if img.size != target:
+            img = img.resize(target, Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8'), detail, target
@@ -1,9 +1,24 @@
+import os
+import argparse
 import http.server
 import socketserver
 from scripts.config import MAIN_SERVER_PORT
+from scripts.static_server import make_server
 
-Handler = http.server.SimpleHTTPRequestHandler
+parser = argparse.ArgumentParser(description="Serve the Assemblage site from the current directory")
+parser.add_argument("--mode", choices=("static", "simple"), default="static",
+                    help="static: threaded server with keep-alive, caching headers, ranges, precompressed files "
+                         "and sendfile (default); simple: the single-threaded SimpleHTTPRequestHandler")
+parser.add_argument("--quiet", "-q", action="store_true", help="Don't log each request (static mode)")
+args = parser.parse_args()
 
-with socketserver.TCPServer(("", MAIN_SERVER_PORT), Handler) as httpd:
-    print(f"Serving at http://localhost:{MAIN_SERVER_PORT}")
-    httpd.serve_forever() 
\ No newline at end of file
+if args.mode == "simple":
+    Handler = http.server.SimpleHTTPRequestHandler
+
+    with socketserver.TCPServer(("", MAIN_SERVER_PORT), Handler) as httpd:
+        print(f"Serving at http://localhost:{MAIN_SERVER_PORT}")
+        httpd.serve_forever()
+else:
+    with make_server(os.getcwd(), MAIN_SERVER_PORT, quiet=args.quiet) as httpd:
+        print(f"Serving at http://localhost:{MAIN_SERVER_PORT}")
+        httpd.serve_forever()